@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Offline batch scoring: run a disease model over whole folders of photos or
+packed shard directories (packed_dataset.py) instead of uploading them one
+by one to /predict.
+
+The model is built by check.py exactly as the API serves it (CROP_MODELS,
+load_crop_model's checkpoint / head adaptation, DISEASE_MODEL_VARIANT or
+DISEASE_SHARED_BACKBONE), and labels follow the same threshold -> "Unclassified" rule (format_prediction).
+Images are decoded on a process pool with the serving decode (reduced-size
+JPEG decode + bilinear resize) while the main process scores full batches;
+packed directories are streamed shard by shard.
+
+    <out>/run.json               crop, model version, threshold, label mapping
+    <out>/predictions.csv        one row per image, appended batch by batch
+    <out>/confusion_matrix.csv   true label x predicted label (labeled images only)
+    <out>/per_class.csv          images, correct, accuracy, unclassified, mean confidence per true label
+
+predictions.csv doubles as the progress log: rerunning with the same model
+and threshold skips every image it already holds, so an interrupted backfill
+picks up where it stopped (--restart scores everything again). With
+--format parquet the three tables are also written as .parquet (needs pyarrow).
+
+An image's true label is the name of the folder holding it (the class of a
+packed image), mapped through --class-map (data_preprocessing/class_map.json
+format). Images directly inside an input root, or every image with
+--labels none, are unlabeled: they get predictions but stay out of the
+confusion matrix and accuracy.
+
+    python batch_score.py --crop corn --images ../../../data_preprocessing/data/CornDataset_1 --out scores/corn1
+    python batch_score.py --crop rice --images /data/field_photos /data/field_packed --labels none --out scores/backfill
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import torch
+
+from packed_dataset import is_packed, open_packed
+from preprocessing import IMAGE_SIZE
+from train_data import IMAGE_EXTENSIONS, _decoded_rows
+
+COLUMNS = ["path", "label", "prediction", "confidence", "top_k", "error"]
+BATCH_SIZE = int(os.environ.get("SCORE_BATCH_SIZE", "64"))
+DECODE_WORKERS = int(os.environ.get("SCORE_DECODE_WORKERS", os.cpu_count() or 1))
+
+
+# -------------------------------
+# Inputs
+# -------------------------------
+def list_images(root, class_map=None, labels="folder"):
+    """
+    [(path, true label or "")] for a folder tree or a packed directory, in
+    the order _decoded_rows() expects (packed: index order).
+    """
+    class_map = class_map or {}
+    if is_packed(root):
+        dataset = open_packed(root)
+        samples = [(os.path.join(root, row[5]), dataset.classes[row[3]]) for row in dataset.samples]
+    else:
+        samples = []
+        for dirpath, _, filenames in sorted(os.walk(root)):
+            label = "" if os.path.samefile(dirpath, root) else os.path.basename(dirpath)
+            samples.extend((os.path.join(dirpath, f), label)
+                           for f in sorted(filenames) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if labels == "none":
+        return [(path, "") for path, _ in samples]
+    return [(path, class_map.get(label, label)) for path, label in samples]
+
+
+def load_class_map(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# -------------------------------
+# Progress (predictions.csv)
+# -------------------------------
+def open_progress(out_dir, run, restart=False):
+    """
+    Open <out>/predictions.csv for appending and return (file, {path: row}
+    already scored). Rows of an earlier run are kept only when its run.json
+    matches `run`; a row cut short by a crash is dropped and rescored.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    run_path = os.path.join(out_dir, "run.json")
+    pred_path = os.path.join(out_dir, "predictions.csv")
+    done = {}
+    if not restart and os.path.exists(pred_path):
+        previous = {}
+        if os.path.exists(run_path):
+            with open(run_path) as f:
+                previous = json.load(f)
+        if previous != run:
+            changed = sorted(k for k in set(run) | set(previous) if run.get(k) != previous.get(k))
+            raise SystemExit(f"❌ {out_dir} holds scores from a different run (changed: {', '.join(changed)}). "
+                             f"Use --restart to score again, or another --out.")
+        with open(pred_path, newline="") as f:
+            for row in csv.DictReader(f):
+                if None not in row and None not in row.values():
+                    done[row["path"]] = row
+        print(f"[INFO] Resuming: {len(done)} images already scored in {pred_path}")
+
+    # rewrite what was kept, so appends never continue a torn last line
+    with open(pred_path + ".tmp", "w", newline="") as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        writer.writerows(done.values())
+    os.replace(pred_path + ".tmp", pred_path)
+    with open(run_path, "w") as f:
+        json.dump(run, f, indent=1)
+    return open(pred_path, "a", newline=""), done
+
+
+# -------------------------------
+# Reports
+# -------------------------------
+def build_reports(rows, classes):
+    """(predictions, confusion matrix, per-class accuracy) DataFrames from prediction rows."""
+    predictions = pd.DataFrame(rows, columns=COLUMNS)
+    predictions["confidence"] = pd.to_numeric(predictions["confidence"], errors="coerce")
+    labeled = predictions[(predictions["label"] != "") & (predictions["error"] == "")]
+    columns = list(dict.fromkeys(list(classes) + ["Unclassified"] + sorted(labeled["prediction"].unique())))
+    confusion = pd.crosstab(labeled["label"], labeled["prediction"]).reindex(columns=columns, fill_value=0)
+    confusion.index.name, confusion.columns.name = "label", None
+
+    per_class = labeled.assign(correct=labeled["prediction"] == labeled["label"],
+                               unclassified=labeled["prediction"] == "Unclassified")
+    per_class = per_class.groupby("label").agg(images=("path", "size"), correct=("correct", "sum"),
+                                               unclassified=("unclassified", "sum"),
+                                               mean_confidence=("confidence", "mean"))
+    per_class.insert(2, "accuracy", per_class["correct"] / per_class["images"])
+    return predictions, confusion, per_class
+
+
+def write_reports(out_dir, reports, fmt):
+    predictions, confusion, per_class = reports
+    confusion.to_csv(os.path.join(out_dir, "confusion_matrix.csv"))
+    per_class.to_csv(os.path.join(out_dir, "per_class.csv"), float_format="%.4f")
+    if fmt != "parquet":
+        return
+    try:
+        predictions.to_parquet(os.path.join(out_dir, "predictions.parquet"), index=False)
+        confusion.to_parquet(os.path.join(out_dir, "confusion_matrix.parquet"))
+        per_class.to_parquet(os.path.join(out_dir, "per_class.parquet"))
+    except ImportError as e:
+        print(f"[WARN] Parquet output unavailable ({str(e).splitlines()[0]}); CSV files only.")
+
+
+# -------------------------------
+# Scoring
+# -------------------------------
+def untrained_classes(check, crop):
+    """
+    Served classes the checkpoint has no classifier row for: load_crop_model
+    gives them randomly initialized rows, so their predictions mean nothing.
+    Call after the crop's model is loaded.
+    """
+    classes = check.CROP_MODELS[crop]["classes"]
+    if check.SHARED_MODEL is not None and crop in check.SHARED_MODEL.heads and crop != check.SHARED_MODEL.backbone_crop:
+        return []  # head fitted on every served class (shared_backbone.py fit-head)
+    return classes[check.CHECKPOINT_CLASSES.get(crop) or len(classes):]
+
+
+def main():
+    import check
+    from batching import make_forward_fn
+
+    parser = argparse.ArgumentParser(description="Score folders / packed shards with a disease model")
+    parser.add_argument("--crop", required=True, choices=sorted(check.CROP_MODELS))
+    parser.add_argument("--images", nargs="+", required=True, help="image folders and/or packed directories")
+    parser.add_argument("--out", required=True, help="output directory (predictions, reports, progress)")
+    parser.add_argument("--weights", default=None, help="score this checkpoint instead of the registry's")
+    parser.add_argument("--threshold", type=float, default=0.70, help="below this confidence -> 'Unclassified'")
+    parser.add_argument("--top-k", type=int, default=1, help="class:probability pairs kept per image")
+    parser.add_argument("--labels", choices=["folder", "none"], default="folder",
+                        help="true label = parent folder name, or no labels (pure backfill)")
+    parser.add_argument("--class-map", default="", help="JSON {folder name: model class} for the true labels")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DECODE_WORKERS, help="decode processes")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--restart", action="store_true", help="ignore earlier progress in --out")
+    args = parser.parse_args()
+
+    if args.weights:
+        check.CROP_MODELS[args.crop] = dict(check.CROP_MODELS[args.crop], weights=args.weights)
+    classes = check.CROP_MODELS[args.crop]["classes"]
+    class_map = load_class_map(args.class_map)
+    if check.SHARED_BACKBONE:
+        # set up like the API's startup hook, so model_version and the model are the shared ones
+        check.SHARED_MODEL = check.load_shared_model()
+    run = {"crop": args.crop, "model_version": check.model_version(args.crop), "threshold": args.threshold,
+           "top_k": args.top_k, "labels": args.labels, "class_map": class_map}
+    inputs = [(root, list_images(root, class_map, args.labels)) for root in args.images]
+    total = sum(len(samples) for _, samples in inputs)
+    log, done = open_progress(args.out, run, args.restart)
+    rows = dict(done)
+
+    # classes missing from a checkpoint get randomly initialized head rows (load_crop_model);
+    # the seed only makes those rows the same in a resumed run, it does not make them meaningful
+    torch.manual_seed(0)
+    model = check.load_serving_model(args.crop)
+    if check.SHARED_MODEL is not None:
+        check.SHARED_MODEL.ensure_loaded(args.crop)
+    untrained = untrained_classes(check, args.crop)
+    if untrained:
+        print(f"[WARN] The checkpoint has no trained head rows for {', '.join(untrained)}: their predictions "
+              f"are random, and accuracy on images labeled with them is meaningless.")
+    forward = make_forward_fn(model, check.DEVICE)
+    writer = csv.DictWriter(log, COLUMNS)
+    scored = failed = 0
+    model_seconds = 0.0
+
+    def score(batch):
+        nonlocal model_seconds
+        t0 = time.perf_counter()
+        probs = forward([torch.from_numpy(image) for _, _, image in batch])
+        model_seconds += time.perf_counter() - t0
+        out = []
+        for (path, label, _), p in zip(batch, probs):
+            result = check.format_prediction(args.crop, p, args.threshold, args.top_k)
+            top_k = ";".join(f"{name}:{prob:.4f}" for name, prob in result["top_k"])
+            out.append({"path": path, "label": label, "prediction": result["disease"],
+                        "confidence": f"{result['confidence']:.4f}", "top_k": top_k, "error": ""})
+        return out
+
+    def record(new_rows):
+        writer.writerows(new_rows)
+        log.flush()
+        for row in new_rows:
+            rows[row["path"]] = row
+
+    todo_total = sum(1 for _, samples in inputs for path, _ in samples if path not in done)
+    print(f"[INFO] {total} images in {len(inputs)} input(s), {todo_total} to score "
+          f"(batch {args.batch_size}, {args.workers} decode processes, {check.DEVICE})")
+    start = last_report = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for root, samples in inputs:
+                todo = [i for i, (path, _) in enumerate(samples) if path not in done]
+                batch = []
+                for i, image in _decoded_rows(pool, root, samples, IMAGE_SIZE, indices=todo):
+                    path, label = samples[i]
+                    if isinstance(image, str):
+                        record([{"path": path, "label": label, "prediction": "", "confidence": "",
+                                 "top_k": "", "error": image}])
+                        failed += 1
+                        continue
+                    batch.append((path, label, image))
+                    if len(batch) >= args.batch_size:
+                        record(score(batch))
+                        scored += len(batch)
+                        batch = []
+                    if time.perf_counter() - last_report >= 2.0:
+                        last_report = time.perf_counter()
+                        print(f"  {scored + failed}/{todo_total} ({scored / (last_report - start):.1f} img/s)")
+                if batch:
+                    record(score(batch))
+                    scored += len(batch)
+    finally:
+        log.close()
+
+    seconds = time.perf_counter() - start
+    print(f"✅ Scored {scored} images in {seconds:.1f}s ({scored / max(seconds, 1e-9):.1f} img/s, "
+          f"model {model_seconds:.1f}s); {failed} unreadable")
+
+    reports = build_reports(list(rows.values()), classes)
+    write_reports(args.out, reports, args.format)
+    per_class = reports[2]
+    if len(per_class):
+        for name, r in per_class.iterrows():
+            print(f"   - {name}: {r['accuracy']:.3f} ({int(r['correct'])}/{int(r['images'])}, "
+                  f"{int(r['unclassified'])} unclassified)")
+        print(f"   Accuracy {per_class['correct'].sum() / per_class['images'].sum():.3f} "
+              f"over {int(per_class['images'].sum())} labeled images")
+        if untrained:
+            print(f"[WARN] No trained head rows for {', '.join(untrained)}; see the warning above.")
+    print(f"✅ Reports written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
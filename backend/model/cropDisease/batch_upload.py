@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Helpers for /predict/batch: many leaf photos from one plot in one request.
+
+Images come either as repeated multipart `images` fields or as a single zip/tar
+`archive`. Every image is decoded on a thread pool and scored through the
+per-crop micro-batcher, and results are streamed back as NDJSON in completion
+order, followed by one plot-level summary line.
+"""
+import asyncio
+import io
+import json
+import os
+import tarfile
+import zipfile
+import zlib
+from collections import Counter, defaultdict
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp")
+MAX_BATCH_IMAGES = int(os.environ.get("DISEASE_MAX_BATCH_IMAGES", "500"))
+MAX_ARCHIVE_BYTES = int(os.environ.get("DISEASE_MAX_ARCHIVE_MB", "512")) << 20
+MAX_CONCURRENT_DECODES = int(os.environ.get("DISEASE_BATCH_CONCURRENCY", "32"))
+
+
+def iter_archive_images(data: bytes, max_bytes=None):
+    """
+    Yield (filename, bytes) for every image inside a zip or tar(.gz) archive.
+    Stops with ValueError once the images (tar: all members, which are
+    decompressed to be skipped) add up to more than `max_bytes` uncompressed.
+    """
+    total = 0
+
+    def take(size, name):
+        nonlocal total
+        total += size
+        if max_bytes is not None and total > max_bytes:
+            raise ValueError(f"Archive too large: more than {max_bytes >> 20} MB uncompressed (at '{name}').")
+
+    buffer = io.BytesIO(data)
+    if zipfile.is_zipfile(buffer):
+        with zipfile.ZipFile(buffer) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    # zipfile never returns more than the declared size, so this bounds memory
+                    take(info.file_size, info.filename)
+                    yield info.filename, zf.read(info)
+        return
+    buffer.seek(0)
+    try:
+        tf = tarfile.open(fileobj=buffer, mode="r:*")
+    except tarfile.TarError:
+        raise ValueError("Archive must be a zip or tar file.")
+    with tf:
+        for member in tf:
+            take(member.size, member.name)
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield member.name, tf.extractfile(member).read()
+
+
+def read_archive_images(data: bytes, max_images=MAX_BATCH_IMAGES, max_bytes=MAX_ARCHIVE_BYTES):
+    """
+    List of (filename, bytes) from an archive, reading at most `max_images` + 1
+    images. Too many images, too many bytes and corrupt archives all raise
+    ValueError (reported as HTTP 400).
+    """
+    items = []
+    try:
+        for item in iter_archive_images(data, max_bytes):
+            items.append(item)
+            if len(items) > max_images:
+                raise ValueError(f"Too many images; the limit is {MAX_BATCH_IMAGES} per request.")
+    except (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, OSError, RuntimeError,
+            NotImplementedError) as e:
+        raise ValueError(f"Corrupt or unsupported archive: {e}")
+    return items
+
+
+async def collect_uploads(images, archive):
+    """Read multipart images and/or an archive into a list of (filename, bytes)."""
+    items = []
+    for upload in images or []:
+        if len(items) >= MAX_BATCH_IMAGES:
+            raise ValueError(f"Too many images; the limit is {MAX_BATCH_IMAGES} per request.")
+        items.append((upload.filename or f"image_{len(items)}", await upload.read()))
+    if archive is not None:
+        data = await archive.read()
+        # decompression is CPU work: keep it off the event loop
+        loop = asyncio.get_running_loop()
+        items.extend(await loop.run_in_executor(None, read_archive_images, data, MAX_BATCH_IMAGES - len(items)))
+    return items
+
+
+def summarize_plot(results):
+    """
+    Plot-level diagnosis from per-image results: vote counts per label, mean
+    confidence per label, and the most frequent non-"Unclassified" label.
+    """
+    ok = [r for r in results if r.get("success")]
+    votes = Counter(r["disease"] for r in ok)
+    confidences = defaultdict(list)
+    for r in ok:
+        confidences[r["disease"]].append(r["confidence"])
+
+    classified = [(count, sum(confidences[label]) / count, label)
+                  for label, count in votes.items() if label != "Unclassified"]
+    if classified:
+        count, _, diagnosis = max(classified)
+    else:
+        diagnosis, count = "Unclassified", votes.get("Unclassified", 0)
+
+    summary = {
+        "summary": True,
+        "images": len(results),
+        "scored": len(ok),
+        "failed": len(results) - len(ok),
+        "diagnosis": diagnosis,
+        "diagnosis_share": (count / len(ok)) if ok else 0.0,
+        "votes": dict(votes),
+        "mean_confidence": {label: sum(v) / len(v) for label, v in confidences.items()},
+    }
+
+    # average full distributions when the per-image results carry them
+    if ok and all("probabilities" in r for r in ok):
+        labels = ok[0]["probabilities"].keys()
+        summary["mean_probabilities"] = {
+            label: sum(r["probabilities"][label] for r in ok) / len(ok) for label in labels
+        }
+    return summary
+
+
+async def stream_batch(items, score_one):
+    """
+    Async generator of NDJSON lines.
+
+    score_one: async callable(bytes) -> result dict (raises on bad input).
+    Lines are emitted as soon as each image finishes; the last line is the
+    plot summary.
+    """
+    limiter = asyncio.Semaphore(MAX_CONCURRENT_DECODES)
+
+    async def run(index, filename, data):
+        async with limiter:
+            try:
+                result = await score_one(data)
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+        return {"index": index, "filename": filename, **result}
+
+    tasks = [asyncio.create_task(run(i, name, data)) for i, (name, data) in enumerate(items)]
+    results = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            results.append(result)
+            yield json.dumps(result) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield json.dumps(summarize_plot(results)) + "\n"
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Dynamic micro-batching for the disease models.
+
+Each crop gets its own queue. The first image to arrive opens a window of
+`max_wait_ms`; everything that arrives for that crop before the window closes
+(or until `max_batch_size` images are waiting) is stacked into one tensor and
+run through the model in a single forward pass on a worker thread. Results are
+fanned back to the awaiting requests, and the event loop never runs torch.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from preprocessing import to_float_batch
+
+
+class BatcherClosedError(RuntimeError):
+    """The batcher is stopped or draining; the caller should fetch a fresh one."""
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10.0, executor=None, max_inflight=1, name="inference"):
+        """
+        predict_fn: callable taking a list of items and returning a list of results (same order).
+            If a batch call raises, its items are retried one at a time so only the failing
+            item's request sees the error.
+        max_batch_size: upper bound on items per predict_fn call.
+        max_wait_ms: how long the first item of a batch waits for company.
+        executor: thread pool to run predict_fn on (shared between crops is fine).
+        max_inflight: batches allowed to run concurrently for this queue.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_inflight = max(1, int(max_inflight))
+        self.name = name
+
+        self._executor = executor
+        self._queue = None
+        self._slots = None
+        self._worker = None
+        self._inflight = set()
+        self._closing = False
+        self.pending = 0
+
+        # counters
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.largest_batch = 0
+        self.cancelled = 0
+        self.started_at = None
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._worker = asyncio.create_task(self._collect_loop())
+        self._closing = False
+        self.started_at = time.monotonic()
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._closing
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        self._worker = None
+
+    async def drain(self, poll_seconds=0.005):
+        """Refuse new items, wait for every submitted item to finish, then stop."""
+        self._closing = True
+        while self.pending:
+            await asyncio.sleep(poll_seconds)
+        await self.stop()
+
+    def enqueue(self, items):
+        """
+        Queue items back to back (so they land in the same batch when they fit)
+        and return one future per item without waiting.
+        """
+        if not self.running:
+            raise BatcherClosedError(f"{self.name} batcher is not running")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self.pending += 1
+            future.add_done_callback(self._item_done)
+            self._queue.put_nowait((item, future))
+            futures.append(future)
+        return futures
+
+    def _item_done(self, future):
+        self.pending -= 1
+
+    async def submit(self, item):
+        """Queue one item and wait for its result."""
+        return await self.enqueue([item])[0]
+
+    def estimated_seconds(self, extra_items=0):
+        """Rough time to clear everything pending plus `extra_items`, from the average cost per item so far."""
+        if not self.items:
+            return 0.0
+        return (self.pending + extra_items) * (self.busy_seconds / self.items)
+
+    def stats(self):
+        uptime = (time.monotonic() - self.started_at) if self.started_at else 0.0
+        return {
+            "batches": self.batches,
+            "images": self.items,
+            "avg_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "cancelled": self.cancelled,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "images_per_busy_second": round(self.items / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+            "images_per_second": round(self.items / uptime, 2) if uptime else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+    def _take(self, entry, batch):
+        """Add a queued (item, future) to `batch` unless its caller has already cancelled it."""
+        if entry[1].cancelled():
+            self.cancelled += 1
+        else:
+            batch.append(entry)
+
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            while not batch:
+                self._take(await self._queue.get(), batch)
+
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    self._take(self._queue.get_nowait(), batch)
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._take(await asyncio.wait_for(self._queue.get(), timeout), batch)
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run_batch(self, batch):
+        # items cancelled while this batch waited for a slot are dropped too
+        live = []
+        for entry in batch:
+            self._take(entry, live)
+        if not live:
+            self._slots.release()
+            return
+        batch = live
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self.predict_fn, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: predict_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                # one bad image must not fail the requests batched with it: score each
+                # item still awaited on its own
+                batch = [(item, future) for item, future in batch if not future.done()]
+                if len(items) == 1 or not batch:
+                    raise
+                print(f"[WARN] {self.name}: batch of {len(items)} failed ({e}); retrying items one at a time")
+                items = [item for item, _ in batch]
+                futures = [future for _, future in batch]
+                results = await loop.run_in_executor(self._executor, self._predict_each, items)
+            self.busy_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.items += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+            for future, result in zip(futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # never leave a caller waiting forever
+            for future in futures:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"{self.name}: no result for this item"))
+            self._slots.release()
+
+    def _predict_each(self, items):
+        """Fallback after a failed batch: one predict_fn call per item; failures are returned, not raised."""
+        results = []
+        for item in items:
+            try:
+                result = self.predict_fn([item])
+                if len(result) != 1:
+                    raise RuntimeError(f"{self.name}: predict_fn returned {len(result)} results for 1 item")
+                results.append(result[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def logits_from_output(output):
+    """Some timm variants return a dict; always hand back an (N, C) tensor."""
+    logits = output["logits"] if isinstance(output, dict) and "logits" in output else output
+    if logits.ndim == 1:
+        logits = logits.unsqueeze(0)
+    return logits
+
+
+def make_forward_fn(model, device, observe=None):
+    """
+    Build a batcher callback: list of (3, H, W) tensors (uint8 or float) ->
+    list of probability rows (numpy float32), computed with one forward pass.
+    observe: optional callable(stage, seconds) fed "batch_prep", "forward" and
+    "softmax" timings per batch.
+    """
+    if observe is None:
+        def forward(images):
+            batch = to_float_batch(images).to(device)
+            with torch.inference_mode():
+                probs = torch.softmax(logits_from_output(model(batch)), dim=1).cpu().numpy()
+            return list(probs)
+        return forward
+
+    def timed_forward(images):
+        t0 = time.perf_counter()
+        batch = to_float_batch(images).to(device)
+        with torch.inference_mode():
+            t1 = time.perf_counter()
+            logits = logits_from_output(model(batch))
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            t2 = time.perf_counter()
+            probs = torch.softmax(logits, dim=1).cpu().numpy()
+        t3 = time.perf_counter()
+        observe("batch_prep", t1 - t0)
+        observe("forward", t2 - t1)
+        observe("softmax", t3 - t2)
+        return list(probs)
+    return timed_forward
+
+
+class CropBatchers:
+    """One MicroBatcher per crop, sharing a single inference thread pool."""
+
+    def __init__(self, max_batch_size=16, max_wait_ms=10.0, workers=1, observe=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.observe = observe
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="disease-infer")
+        self.batchers = {}
+
+    async def add(self, crop, model, device):
+        batcher = MicroBatcher(
+            make_forward_fn(model, device, self.observe),
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait_ms,
+            executor=self.executor,
+            name=f"{crop}-infer",
+        )
+        await batcher.start()
+        self.batchers[crop] = batcher
+        return batcher
+
+    async def predict(self, crop, image_tensor):
+        """Probabilities (numpy row) for one preprocessed (3, H, W) image."""
+        return await self.batchers[crop].submit(image_tensor)
+
+    async def remove(self, crop, batcher=None):
+        """
+        Drop a crop's batcher once the images already queued for it are scored.
+        With `batcher`, only that instance is drained (a newer one for the same
+        crop stays registered).
+        """
+        if batcher is None or self.batchers.get(crop) is batcher:
+            batcher = self.batchers.pop(crop, batcher)
+        if batcher is not None:
+            await batcher.drain()
+
+    async def stop(self):
+        for batcher in self.batchers.values():
+            await batcher.stop()
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return {crop: batcher.stats() for crop, batcher in self.batchers.items()}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Decode + preprocess cost per image: the original PIL/torchvision path
+(full decode, convert("RGB"), Resize, ToTensor) vs preprocessing.py
+(reduced-size JPEG decode, uint8 tensor, batched /255).
+
+    python benchmark_preprocess.py --images ../../../data_preprocessing/data/CornDataset_1/Blight --limit 50
+    python benchmark_preprocess.py --images <dir> --megapixels 12   # re-encode as 12MP phone-sized JPEGs
+"""
+import argparse
+import glob
+import io
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocessing import load_image_tensor, to_float_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+LEGACY_TRANSFORM = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+])
+
+
+def legacy_preprocess(data: bytes) -> torch.Tensor:
+    return LEGACY_TRANSFORM(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+def fast_preprocess(data: bytes) -> torch.Tensor:
+    return to_float_batch([load_image_tensor(data)])[0]
+
+
+def load_samples(folder, limit, megapixels):
+    paths = sorted(p for p in glob.glob(os.path.join(folder, "**", "*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    samples = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        if megapixels:
+            img = Image.open(io.BytesIO(data)).convert("RGB")
+            scale = (megapixels * 1e6 / (img.width * img.height)) ** 0.5
+            img = img.resize((int(img.width * scale), int(img.height * scale)), Image.BICUBIC)
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=90)
+            data = buf.getvalue()
+        samples.append(data)
+    return samples
+
+
+def time_per_image(fn, samples, repeats):
+    fn(samples[0])  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for data in samples:
+            fn(data)
+    return (time.perf_counter() - start) * 1000.0 / (repeats * len(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark disease image preprocessing")
+    parser.add_argument("--images", required=True, help="folder of images (searched recursively)")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--megapixels", type=float, default=0.0, help="re-encode samples at this size first")
+    args = parser.parse_args()
+
+    samples = load_samples(args.images, args.limit, args.megapixels)
+    if not samples:
+        raise SystemExit(f"No images found under {args.images}")
+
+    legacy_ms = time_per_image(legacy_preprocess, samples, args.repeats)
+    fast_ms = time_per_image(fast_preprocess, samples, args.repeats)
+    diffs = [float((legacy_preprocess(d) - fast_preprocess(d)).abs().mean()) for d in samples]
+
+    print(f"{len(samples)} images, mean size {np.mean([len(d) for d in samples]) / 1024:.0f} KB")
+    print(f"  legacy (PIL full decode + torchvision): {legacy_ms:.2f} ms/image")
+    print(f"  reduced decode + batched scaling:      {fast_ms:.2f} ms/image  ({legacy_ms / fast_ms:.1f}x)")
+    print(f"  mean |pixel difference|: {np.mean(diffs):.4f} (0-1 scale)")
+
+
+if __name__ == "__main__":
+    main()
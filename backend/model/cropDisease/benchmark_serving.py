@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Find the best worker-process / torch-thread split for this machine.
+
+Each configuration "WxT" starts `serving.py --workers W --threads T` on a free
+port (prediction cache off, crop preloaded), warms it up, then drives it with
+concurrent /predict uploads for a fixed time. "default" is a single plain
+uvicorn process with torch's default threading, i.e. how check.py runs today.
+
+    python benchmark_serving.py --images ../../../data_preprocessing/data/CornDataset_1/Blight \
+        --configs default 1x4 2x2 4x1 --clients 16 --seconds 20 --pin
+
+Reports throughput, p50/p99 latency, errors and the summed PSS of the worker
+processes (shared checkpoint pages are split between the workers that map
+them, so PSS shows what sharing saves).
+"""
+import argparse
+import glob
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def post_image(url, crop, data):
+    body, content_type = multipart({"cropType": crop}, {"image": ("leaf.jpg", data)})
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return response.status
+
+
+def wait_ready(base_url, process, timeout=180.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + "/health", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("server did not become ready")
+
+
+def process_tree(pid):
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def pss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024.0 if total else float("nan")
+
+
+def server_command(config, app, port, pin):
+    if config == "default":
+        return [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    workers, threads = (int(x) for x in config.lower().split("x"))
+    command = [sys.executable, os.path.join(HERE, "serving.py"), "--app", app, "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--threads", str(threads), "--log-level", "warning"]
+    return command + (["--pin"] if pin else [])
+
+
+def drive(url, crop, payloads, clients, seconds):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def client(offset):
+        i = offset
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                post_image(url, crop, payloads[i % len(payloads)])
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            i += clients
+
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(client, range(clients)))
+    return sorted(latencies), errors[0]
+
+
+def run_config(config, args, payloads):
+    port = free_port()
+    env = dict(os.environ, DISEASE_CACHE_SIZE="0", DISEASE_PRELOAD_CROPS=args.crop)
+    process = subprocess.Popen(server_command(config, args.app, port, args.pin), cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, process)
+        drive(base_url + "/predict", args.crop, payloads, args.clients, args.warmup)
+        latencies, errors = drive(base_url + "/predict", args.crop, payloads, args.clients, args.seconds)
+        memory = pss_mb(process_tree(process.pid))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    if not latencies:
+        return {"config": config, "rps": 0.0, "p50": float("nan"), "p99": float("nan"), "errors": errors, "pss": memory}
+    return {
+        "config": config,
+        "rps": len(latencies) / args.seconds,
+        "p50": latencies[len(latencies) // 2] * 1000.0,
+        "p99": latencies[int(0.99 * (len(latencies) - 1))] * 1000.0,
+        "errors": errors,
+        "pss": memory,
+    }
+
+
+def default_configs():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    configs = ["default", f"1x{cores}"]
+    workers = 2
+    while workers <= cores:
+        configs.append(f"{workers}x{cores // workers}")
+        workers *= 2
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker/thread configurations of the disease API")
+    parser.add_argument("--app", default="check:app")
+    parser.add_argument("--crop", default="corn")
+    parser.add_argument("--images", required=True, help="folder of sample images")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--configs", nargs="+", help='e.g. default 1x4 2x2 4x1 (default: derived from core count)')
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--pin", action="store_true", help="pin workers to core slices")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in glob.glob(os.path.join(args.images, "**", "*"), recursive=True) if os.path.isfile(p))
+    payloads = []
+    for path in paths[: args.samples]:
+        with open(path, "rb") as f:
+            payloads.append(f.read())
+    if not payloads:
+        raise SystemExit(f"No images found under {args.images}")
+
+    configs = args.configs or default_configs()
+    print(f"{len(payloads)} images, {args.clients} clients, {args.seconds:.0f}s per config, crop={args.crop}")
+    print(f"{'config':<10} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} {'PSS MB':>8}")
+    results = []
+    for config in configs:
+        r = run_config(config, args, payloads)
+        results.append(r)
+        print(f"{r['config']:<10} {r['rps']:>8.1f} {r['p50']:>8.1f} {r['p99']:>8.1f} {r['errors']:>7d} {r['pss']:>8.0f}")
+
+    best = max(results, key=lambda r: (r["errors"] == 0, r["rps"]))
+    print(f"✅ Best on this machine: {best['config']} ({best['rps']:.1f} req/s, p99 {best['p99']:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Training throughput per trainer mode (see trainer.py): fp32 eager vs bf16
+autocast vs channels_last vs torch.compile, and combinations.
+
+Each mode trains a fresh mobilevit_xxs for `--steps` batches after
+`--warmup` batches (compile happens in the warm-up) and reports images/sec
+and time per step. Batches are random uint8 images by default, so this
+measures compute only; pass --root to use a cached ImageFolder split instead.
+
+    python benchmark_training.py --modes fp32 bf16 fp32+cl bf16+cl bf16+cl+compile --batch-size 32 --steps 20
+
+--world-sizes runs the first mode data-parallel instead (distributed.py):
+each size spawns that many gloo processes with cores / size threads each,
+every process trains --steps batches of its own, and the report shows total
+images/sec and speedup over one process (ideal = the world size).
+
+    python benchmark_training.py --modes fp32+cl --world-sizes 1 2 4 --batch-size 32 --steps 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import timm
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import Subset, TensorDataset
+
+from distributed import is_main, launch
+from train_data import image_dataset, make_loader
+from trainer import TrainSettings, train_one_epoch
+
+
+def parse_mode(mode, device):
+    parts = mode.lower().split("+")
+    amp = "bf16" if "bf16" in parts else ("fp16" if "fp16" in parts else "off")
+    return TrainSettings(device, amp=amp, channels_last="cl" in parts, compile="compile" in parts)
+
+
+def synthetic_dataset(images, num_classes, size=224):
+    generator = torch.Generator().manual_seed(0)
+    pixels = torch.randint(0, 256, (images, 3, size, size), dtype=torch.uint8, generator=generator)
+    labels = torch.randint(0, num_classes, (images,), generator=generator)
+    return TensorDataset(pixels, labels)
+
+
+def run_mode(mode, args, dataset, device):
+    settings = parse_mode(mode, device)
+    torch.manual_seed(0)
+    model = timm.create_model("mobilevit_xxs", pretrained=False, num_classes=args.num_classes)
+    train_model, model = settings.prepare_model(model)
+    optimizer = optim.Adam(model.parameters(), lr=1e-4)
+    criterion = nn.CrossEntropyLoss()
+
+    def loader(batches):
+        subset = Subset(dataset, range(min(len(dataset), batches * args.batch_size)))
+        return make_loader(subset, args.batch_size, shuffle=False, workers=args.workers)
+
+    start = time.perf_counter()
+    train_one_epoch(train_model, loader(args.warmup), criterion, optimizer, settings, settings.grad_scaler())
+    warmup_seconds = time.perf_counter() - start
+    stats = train_one_epoch(train_model, loader(args.steps), criterion, optimizer, settings, settings.grad_scaler())
+    return {
+        "mode": mode,
+        "images_per_sec": stats["images_per_sec"],
+        "ms_per_step": stats["seconds"] * 1000.0 / max(1, stats["optimizer_steps"]),
+        "warmup_seconds": warmup_seconds,
+    }
+
+
+def scaling_worker(args, dataset, result_path):
+    # per-process loop, so the global batch is batch_size x world size
+    r = run_mode(args.modes[0], args, dataset, torch.device("cpu"))
+    if is_main():
+        torch.save(r, result_path)
+
+
+def run_world_size(nproc, args, dataset):
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = os.path.join(tmp, "result.pt")
+        launch(scaling_worker, nproc, args.threads, (args, dataset, result_path))
+        r = torch.load(result_path)
+    # images_per_sec already counts every process's images (train_one_epoch sums them)
+    r["mode"] = f"{args.modes[0]} x{nproc}"
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare trainer modes on training throughput")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "fp32+cl", "bf16+cl"],
+                        help="'+'-joined: fp32 | bf16 | fp16, cl (channels_last), compile")
+    parser.add_argument("--root", help="ImageFolder split to train on (cached); default: random images")
+    parser.add_argument("--cache-dir", default="data_cache")
+    parser.add_argument("--num-classes", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=0,
+                        help="torch intra-op threads (0 = default; per process with --world-sizes)")
+    parser.add_argument("--world-sizes", type=int, nargs="+",
+                        help="DDP scaling run of the first mode over these process counts, e.g. 1 2 4")
+    args = parser.parse_args()
+
+    if args.threads and not args.world_sizes:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.root:
+        dataset = image_dataset(args.root, args.cache_dir)
+        args.num_classes = len(dataset.classes)
+    else:
+        dataset = synthetic_dataset(max(args.steps, args.warmup) * args.batch_size, args.num_classes)
+
+    print(f"batch {args.batch_size}, {args.steps} steps, device {device}, {torch.get_num_threads()} threads")
+    print(f"{'mode':<20} {'img/s':>8} {'ms/step':>9} {'warmup s':>9}")
+    results = []
+    if args.world_sizes:
+        for nproc in args.world_sizes:
+            r = run_world_size(nproc, args, dataset)
+            results.append(r)
+            speedup = r["images_per_sec"] / results[0]["images_per_sec"]
+            print(f"{r['mode']:<20} {r['images_per_sec']:>8.1f} {r['ms_per_step']:>9.1f} {r['warmup_seconds']:>9.1f}"
+                  f"  {speedup:.2f}x")
+        return
+
+    for mode in args.modes:
+        r = run_mode(mode, args, dataset, device)
+        results.append(r)
+        print(f"{r['mode']:<20} {r['images_per_sec']:>8.1f} {r['ms_per_step']:>9.1f} {r['warmup_seconds']:>9.1f}")
+
+    base = results[0]["images_per_sec"]
+    best = max(results, key=lambda r: r["images_per_sec"])
+    print(f"✅ Fastest: {best['mode']} ({best['images_per_sec'] / base:.2f}x {results[0]['mode']})")
+
+
+if __name__ == "__main__":
+    main()
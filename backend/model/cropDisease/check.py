@@ -1,25 +1,99 @@
 #!/usr/bin/env python3
+import asyncio
 import os
-import io
+import time
 import torch
 import timm
 import uvicorn
-from PIL import Image
 from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
-from torchvision import transforms
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_upload import collect_uploads, stream_batch
+from batching import CropBatchers
+from instrumentation import Metrics, RequestProfiler, instrument_app
+from model_registry import LazyModelRegistry, file_signature
+from prediction_cache import PredictionCache, image_digest
+from model_variants import build_variant
+from serving import apply_torch_threads
+from shared_backbone import SharedBackboneModel
+from tta import make_views, parse_tta, predict_views
+from preprocessing import decode_image, image_to_uint8_tensor
 
 # -------------------------------
 # App
 # -------------------------------
-app = FastAPI(title="Crop Disease Prediction API")
+# Per-stage timings (read, decode, preprocess, forward, softmax, format,
+# serialize, ...) go to /metrics; see instrumentation.py.
+METRICS = Metrics("disease")
+app = FastAPI(title="Crop Disease Prediction API", default_response_class=METRICS.json_response_class())
+
+# Opt-in sampling profiler: DISEASE_PROFILE_RATE of requests (e.g. 0.01), plus
+# any request sending `X-Profile: 1` when DISEASE_PROFILE_HEADER=1. Folded
+# stacks are written to DISEASE_PROFILE_DIR.
+PROFILER = RequestProfiler(
+    os.environ.get("DISEASE_PROFILE_DIR", "profiles"),
+    sample_rate=float(os.environ.get("DISEASE_PROFILE_RATE", "0")),
+    allow_header=os.environ.get("DISEASE_PROFILE_HEADER", "0") == "1",
+    interval_ms=float(os.environ.get("DISEASE_PROFILE_INTERVAL_MS", "5")),
+)
+instrument_app(app, METRICS, PROFILER)
 
 # -------------------------------
 # Device
 # -------------------------------
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# torch intra-op / inter-op threads from DISEASE_TORCH_THREADS /
+# DISEASE_TORCH_INTEROP_THREADS (set per worker by serving.py)
+apply_torch_threads()
+
+# Checkpoints are mmap'ed and assigned into the model, so worker processes
+# share one page-cache copy of the weights
+SHARE_WEIGHTS = DEVICE.type == "cpu" and os.environ.get("DISEASE_SHARE_WEIGHTS", "1") != "0"
+
+# -------------------------------
+# Micro-batching: concurrent uploads for the same crop are stacked into one
+# forward pass (up to MAX_BATCH_SIZE images, waiting at most BATCH_WAIT_MS).
+MAX_BATCH_SIZE = int(os.environ.get("DISEASE_MAX_BATCH_SIZE", "16"))
+BATCH_WAIT_MS = float(os.environ.get("DISEASE_BATCH_WAIT_MS", "10"))
+INFERENCE_WORKERS = int(os.environ.get("DISEASE_INFERENCE_WORKERS", "1"))
+
+# Image decode/preprocess runs on its own pool so uploads decode in parallel
+DECODE_WORKERS = int(os.environ.get("DISEASE_DECODE_WORKERS", os.cpu_count() or 1))
+DECODE_EXECUTOR = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="disease-decode")
+
+# CPU-optimized serving variant: eager | int8 | torchscript | onnx | onnx-int8
+# (see model_variants.py). onnx-int8 is statically calibrated on the images in
+# DISEASE_CALIBRATION_DIR when set, dynamically quantized otherwise.
+MODEL_VARIANT = os.environ.get("DISEASE_MODEL_VARIANT", "eager").lower()
+CALIBRATION_DIR = os.environ.get("DISEASE_CALIBRATION_DIR")
+
+# Shared-backbone mode: set to a crop (e.g. "rice") to serve every crop from
+# that crop's feature extractor plus lazily loaded per-crop heads (see
+# shared_backbone.py). Unset = one full model per crop.
+SHARED_BACKBONE = os.environ.get("DISEASE_SHARED_BACKBONE", "").strip().lower() or None
+
+# Models load on the first request for their crop (single-flight). At most
+# MAX_RESIDENT_MODELS stay loaded (0 = no cap; least recently used is evicted).
+# PRELOAD_CROPS (comma-separated) are loaded during startup instead.
+MAX_RESIDENT_MODELS = int(os.environ.get("DISEASE_MAX_RESIDENT_MODELS", "0"))
+PRELOAD_CROPS = [c.strip().lower() for c in os.environ.get("DISEASE_PRELOAD_CROPS", "").split(",") if c.strip()]
+
+# Repeated uploads of the same photo are answered from a cache keyed on the
+# image bytes, crop and model version (see prediction_cache.py). Set
+# DISEASE_CACHE_SIZE=0 to disable; DISEASE_CACHE_DB adds an SQLite disk tier.
+CACHE_SIZE = int(os.environ.get("DISEASE_CACHE_SIZE", "2048"))
+CACHE_DB = os.environ.get("DISEASE_CACHE_DB") or None
+CACHE_DB_MAX_ENTRIES = int(os.environ.get("DISEASE_CACHE_DB_MAX_ENTRIES", "100000"))
+
+# Test-time augmentation (see tta.py): e.g. DISEASE_TTA="flips+rot". Off by
+# default; a request can also ask for it with the `tta` form field. Views that
+# would not finish within the budget are skipped (single-view result).
+DEFAULT_TTA = os.environ.get("DISEASE_TTA", "")
+TTA_BUDGET_MS = float(os.environ.get("DISEASE_TTA_BUDGET_MS", "300"))
+
 # -------------------------------
 # EXACT class orders (must match what you want the API to return)
 # Keep these human-friendly labels in the exact order you expect the model outputs to map to.
@@ -75,16 +149,10 @@ CROP_MODELS = {
 }
 
 # -------------------------------
-# Preprocessing - NOTE: use same mean/std as training
-# Typical ImageNet mean/std (change if your training used different stats)
-preprocess_transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-])
-
-
-def preprocess_image(pil_img: Image.Image) -> torch.Tensor:
-    return preprocess_transform(pil_img.convert("RGB")).unsqueeze(0).to(DEVICE)
+# Preprocessing - NOTE: must match training (Resize((224, 224)) + ToTensor(), no mean/std)
+# Images become uint8 (3, 224, 224) tensors here; the batcher scales the whole
+# batch to [0, 1] in one step (see preprocessing.py).
+IMAGE_SIZE = (224, 224)
 
 
 def get_advice_safe(advice_dict, label):
@@ -98,7 +166,10 @@ def get_advice_safe(advice_dict, label):
 
 # -------------------------------
 # GLOBAL model storage
-LOADED_MODELS = {}
+MODEL_REGISTRY = None
+SHARED_MODEL = None
+PREDICTION_CACHE = None
+CHECKPOINT_CLASSES = {}  # crop -> classifier rows found in its checkpoint (load_crop_model)
 
 # -------------------------------
 # Utility: find classifier weight key in checkpoint
@@ -133,126 +204,338 @@ def find_classifier_weight_key(state_dict):
     return None, None, None, None
 
 # -------------------------------
-# Load models ONCE during app startup
+# Load one crop model from its checkpoint, adapting the classifier head
+def load_crop_model(crop, cfg, device=DEVICE):
+    """Build mobilevit_xxs for `cfg["classes"]` and load `cfg["weights"]` into it (eval mode, on `device`)."""
+    weights_path = cfg["weights"]
+    desired_classes = cfg["classes"]
+    print(f"→ Loading {crop} model from '{weights_path}' ... (desired classes = {len(desired_classes)})")
+
+    if not os.path.isfile(weights_path):
+        raise FileNotFoundError(f"Weights file for '{crop}' not found at: {weights_path}")
+
+    # load checkpoint (could be state_dict or dict containing 'state_dict')
+    # mmap: tensors stay backed by the file's page cache, shared by every worker process
+    ckpt = torch.load(weights_path, map_location="cpu", mmap=SHARE_WEIGHTS)
+
+    if isinstance(ckpt, dict) and "state_dict" in ckpt and isinstance(ckpt["state_dict"], dict):
+        state = ckpt["state_dict"]
+    elif isinstance(ckpt, dict) and all(isinstance(v, torch.Tensor) for v in ckpt.values()):
+        state = ckpt
+    else:
+        # sometimes checkpoints contain nested model keys, try to extract the largest tensor map
+        raise ValueError(f"Unexpected checkpoint format for '{weights_path}'. Expected state_dict-like dict.")
+
+    # Remove DataParallel prefix if present
+    if any(k.startswith("module.") for k in list(state.keys())):
+        state = {k.replace("module.", "", 1): v for k, v in state.items()}
+
+    # find classifier weight key info
+    weight_key, bias_key, checkpoint_num_classes, feat_dim = find_classifier_weight_key(state)
+    if weight_key is None:
+        raise ValueError(f"Could not determine classifier size from checkpoint '{weights_path}'. Keys found: {list(state.keys())[:20]}...")
+
+    print(f"Detected checkpoint classifier key '{weight_key}' with {checkpoint_num_classes} classes (feature dim {feat_dim}).")
+    CHECKPOINT_CLASSES[crop] = checkpoint_num_classes
+
+    # Create model with desired number of classes
+    num_desired = len(desired_classes)
+    model = timm.create_model("mobilevit_xxs", pretrained=False, num_classes=num_desired)
+
+    # Acquire model state_dict for shapes/keys
+    model_state = model.state_dict()
+
+    # Helper to determine model classifier keys (prefer checkpoint key if exists in model_state)
+    if weight_key in model_state:
+        model_weight_key = weight_key
+    else:
+        # fallback: find first 2D weight in model_state (likely classifier)
+        model_weight_key = None
+        for k, v in model_state.items():
+            if "weight" in k and hasattr(v, "dim") and v.dim() == 2:
+                model_weight_key = k
+                break
+        if model_weight_key is None:
+            raise RuntimeError("Could not find classifier weight key in model state_dict to adapt head.")
+
+    bias_key_model = model_weight_key.replace("weight", "bias")
+    model_w = model_state[model_weight_key]
+    model_b = model_state[bias_key_model] if bias_key_model in model_state else None
+
+    # Now adapt/load depending on checkpoint vs desired class counts
+    ckpt_w = state[weight_key]
+    ckpt_b = state[bias_key] if (bias_key in state and state[bias_key].ndim == 1) else None
+
+    # Ensure feature dims match
+    if ckpt_w.shape[1] != model_w.shape[1]:
+        raise RuntimeError(f"Checkpoint head feature-dim ({ckpt_w.shape[1]}) != model head feature-dim ({model_w.shape[1]}). Can't adapt automatically.")
+
+    # Build a load-state dict starting from model_state (so all keys exist), take every
+    # matching backbone tensor from the checkpoint, then override with the adapted head
+    load_state = model_state.copy()
+    load_state.update({
+        k: v for k, v in state.items()
+        if k in model_state and k not in (weight_key, bias_key) and v.shape == model_state[k].shape
+    })
+
+    if checkpoint_num_classes is not None and checkpoint_num_classes < num_desired:
+        # copy checkpoint rows into the first rows of model classifier, keep rest as model init
+        print(f"[INFO] Adapting checkpoint head: checkpoint classes={checkpoint_num_classes} < desired={num_desired}.")
+        new_w = model_w.clone()  # model init
+        new_w[: ckpt_w.shape[0], :] = ckpt_w.clone().to(new_w.device)
+        load_state[model_weight_key] = new_w
+
+        if model_b is not None:
+            new_b = model_b.clone()
+            if ckpt_b is not None:
+                new_b[: ckpt_b.shape[0]] = ckpt_b.clone().to(new_b.device)
+            load_state[bias_key_model] = new_b
+        elif ckpt_b is not None:
+            # model has no bias but ckpt does — ignore ckpt bias
+            pass
+
+        # backbone comes from the checkpoint (see load_state above)
+        try:
+            model.load_state_dict(load_state, assign=SHARE_WEIGHTS)
+            print(f"[OK] Adapted checkpoint head and loaded into model for '{crop}'.")
+        except RuntimeError as e:
+            print(f"[WARN] Adapted load failed with RuntimeError: {e}. Trying non-strict load (strict=False).")
+            model.load_state_dict(load_state, strict=False, assign=SHARE_WEIGHTS)
+
+    elif checkpoint_num_classes is not None and checkpoint_num_classes == num_desired:
+        # same class count — try direct load
+        print(f"[INFO] Checkpoint classes match desired ({num_desired}). Attempting direct load.")
+        try:
+            model.load_state_dict(state, assign=SHARE_WEIGHTS)
+            print(f"[OK] Strict load succeeded for '{crop}'.")
+        except RuntimeError as e:
+            print(f"[WARN] Strict load failed: {e}. Trying strict=False.")
+            model.load_state_dict(state, strict=False, assign=SHARE_WEIGHTS)
+
+    else:
+        # checkpoint has more classes or unknown — best-effort non-strict load
+        if checkpoint_num_classes is not None and checkpoint_num_classes > num_desired:
+            print(f"[WARN] Checkpoint has {checkpoint_num_classes} classes but desired model has {num_desired}. Loading with strict=False (this will ignore mismatched params).")
+        try:
+            model.load_state_dict(state, strict=False, assign=SHARE_WEIGHTS)
+            print(f"[INFO] Loaded checkpoint into model for '{crop}' with strict=False.")
+        except Exception as e:
+            raise RuntimeError(f"Failed to load checkpoint for '{crop}': {e}")
+
+    return model.to(device).eval()
+
+# -------------------------------
+# Build the model served for one crop (runs on the registry's loader thread)
+def load_serving_model(crop):
+    cfg = CROP_MODELS[crop]
+    if SHARED_MODEL is not None:
+        # head (or dedicated fallback model) loads on the first forward for this crop
+        return SHARED_MODEL.view(crop)
+    model = load_crop_model(crop, cfg)
+    if MODEL_VARIANT != "eager":
+        if DEVICE.type == "cpu":
+            model = build_variant(model, MODEL_VARIANT, cfg["weights"], CALIBRATION_DIR)
+        else:
+            print(f"[WARN] Model variant '{MODEL_VARIANT}' is CPU-only; serving eager model on {DEVICE}.")
+    print(f"→ Model for '{crop}' ready. Using {len(cfg['classes'])} classes (labels preserved as provided).")
+    return model
+
+
+def release_model(crop, model):
+    if SHARED_MODEL is not None:
+        SHARED_MODEL.unload(crop)
+
+
+def load_shared_model():
+    """SharedBackboneModel over every crop in CROP_MODELS, backbone from DISEASE_SHARED_BACKBONE."""
+    if MODEL_VARIANT != "eager":
+        print(f"[WARN] DISEASE_MODEL_VARIANT='{MODEL_VARIANT}' is ignored in shared-backbone mode.")
+    return SharedBackboneModel(
+        SHARED_BACKBONE,
+        {crop: (cfg["weights"], len(cfg["classes"])) for crop, cfg in CROP_MODELS.items()},
+        lambda crop: load_crop_model(crop, CROP_MODELS[crop], torch.device("cpu")),
+        DEVICE,
+    ).load()
+
+
+def model_version(crop):
+    """Identity of what `load_serving_model(crop)` serves; part of every cache key."""
+    files = SHARED_MODEL.version_files(crop) if SHARED_MODEL is not None else [CROP_MODELS[crop]["weights"]]
+    mode = f"shared-{SHARED_BACKBONE}" if SHARED_MODEL is not None else MODEL_VARIANT
+    return "|".join([file_signature(path) for path in files] + [mode])
+
+# -------------------------------
+# Set up the lazy model registry during app startup
 @app.on_event("startup")
 async def load_all_models():
-    global LOADED_MODELS
-    print("Loading models at startup...")
+    global MODEL_REGISTRY, SHARED_MODEL, PREDICTION_CACHE
+
+    if SHARED_BACKBONE:
+        SHARED_MODEL = load_shared_model()
+
+    MODEL_REGISTRY = LazyModelRegistry(
+        load_serving_model,
+        CropBatchers(max_batch_size=MAX_BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS, workers=INFERENCE_WORKERS,
+                     observe=METRICS.observe_stage),
+        DEVICE,
+        max_resident=MAX_RESIDENT_MODELS,
+        on_evict=release_model,
+        version_fn=model_version,
+    )
+    PREDICTION_CACHE = PredictionCache(CACHE_SIZE, CACHE_DB, CACHE_DB_MAX_ENTRIES)
+
+    for crop in PRELOAD_CROPS:
+        if crop not in CROP_MODELS:
+            print(f"[WARN] DISEASE_PRELOAD_CROPS: unknown crop '{crop}' skipped.")
+            continue
+        try:
+            await MODEL_REGISTRY.get(crop)
+        except Exception as e:
+            print(f"[WARN] Preloading '{crop}' failed: {e}")
 
-    for crop, cfg in CROP_MODELS.items():
-        weights_path = cfg["weights"]
-        desired_classes = cfg["classes"]
-        print(f"→ Loading {crop} model from '{weights_path}' ... (desired classes = {len(desired_classes)})")
+    print(f"✅ Ready: {len(CROP_MODELS)} crops available, models load on first request "
+          f"(max resident: {MAX_RESIDENT_MODELS or 'unlimited'}).")
 
-        if not os.path.isfile(weights_path):
-            raise FileNotFoundError(f"Weights file for '{crop}' not found at: {weights_path}")
 
-        # load checkpoint (could be state_dict or dict containing 'state_dict')
-        ckpt = torch.load(weights_path, map_location="cpu")
+@app.on_event("shutdown")
+async def stop_batchers():
+    if MODEL_REGISTRY is not None:
+        await MODEL_REGISTRY.stop()
+    if PREDICTION_CACHE is not None:
+        PREDICTION_CACHE.close()
 
-        if isinstance(ckpt, dict) and "state_dict" in ckpt and isinstance(ckpt["state_dict"], dict):
-            state = ckpt["state_dict"]
-        elif isinstance(ckpt, dict) and all(isinstance(v, torch.Tensor) for v in ckpt.values()):
-            state = ckpt
-        else:
-            # sometimes checkpoints contain nested model keys, try to extract the largest tensor map
-            raise ValueError(f"Unexpected checkpoint format for '{weights_path}'. Expected state_dict-like dict.")
+# -------------------------------
+# Shared prediction path (single and batch endpoints)
+# -------------------------------
+class ImageDecodeError(ValueError):
+    """Upload is empty or not a readable image (reported as HTTP 400)."""
 
-        # Remove DataParallel prefix if present
-        if any(k.startswith("module.") for k in list(state.keys())):
-            state = {k.replace("module.", "", 1): v for k, v in state.items()}
 
-        # find classifier weight key info
-        weight_key, bias_key, checkpoint_num_classes, feat_dim = find_classifier_weight_key(state)
-        if weight_key is None:
-            raise ValueError(f"Could not determine classifier size from checkpoint '{weights_path}'. Keys found: {list(state.keys())[:20]}...")
+def decode_and_preprocess(data: bytes) -> torch.Tensor:
+    if not data:
+        raise ImageDecodeError("Empty file uploaded.")
+    try:
+        # reduced-size JPEG decode + resize in one go
+        with METRICS.stage("decode"):
+            pil_img = decode_image(data, IMAGE_SIZE)
+    except Exception as e:
+        raise ImageDecodeError(f"Unable to open image file: {e}")
+    with METRICS.stage("preprocess"):
+        return image_to_uint8_tensor(pil_img)
 
-        print(f"Detected checkpoint classifier key '{weight_key}' with {checkpoint_num_classes} classes (feature dim {feat_dim}).")
 
-        # Create model with desired number of classes
-        num_desired = len(desired_classes)
-        model = timm.create_model("mobilevit_xxs", pretrained=False, num_classes=num_desired)
+def decode_views(data: bytes, views) -> list:
+    """decode_and_preprocess for TTA: one decode, one uint8 tensor per view."""
+    if not data:
+        raise ImageDecodeError("Empty file uploaded.")
+    try:
+        with METRICS.stage("decode_views"):
+            return make_views(data, views, IMAGE_SIZE)
+    except Exception as e:
+        raise ImageDecodeError(f"Unable to open image file: {e}")
 
-        # Acquire model state_dict for shapes/keys
-        model_state = model.state_dict()
 
-        # Helper to determine model classifier keys (prefer checkpoint key if exists in model_state)
-        if weight_key in model_state:
-            model_weight_key = weight_key
-        else:
-            # fallback: find first 2D weight in model_state (likely classifier)
-            model_weight_key = None
-            for k, v in model_state.items():
-                if "weight" in k and hasattr(v, "dim") and v.dim() == 2:
-                    model_weight_key = k
-                    break
-            if model_weight_key is None:
-                raise RuntimeError("Could not find classifier weight key in model state_dict to adapt head.")
-
-        bias_key_model = model_weight_key.replace("weight", "bias")
-        model_w = model_state[model_weight_key]
-        model_b = model_state[bias_key_model] if bias_key_model in model_state else None
-
-        # Now adapt/load depending on checkpoint vs desired class counts
-        ckpt_w = state[weight_key]
-        ckpt_b = state[bias_key] if (bias_key in state and state[bias_key].ndim == 1) else None
-
-        # Ensure feature dims match
-        if ckpt_w.shape[1] != model_w.shape[1]:
-            raise RuntimeError(f"Checkpoint head feature-dim ({ckpt_w.shape[1]}) != model head feature-dim ({model_w.shape[1]}). Can't adapt automatically.")
-
-        # Build a load-state dict starting from model_state (so all keys exist) and then override with adapted head
-        load_state = model_state.copy()
-
-        if checkpoint_num_classes is not None and checkpoint_num_classes < num_desired:
-            # copy checkpoint rows into the first rows of model classifier, keep rest as model init
-            print(f"[INFO] Adapting checkpoint head: checkpoint classes={checkpoint_num_classes} < desired={num_desired}.")
-            new_w = model_w.clone()  # model init
-            new_w[: ckpt_w.shape[0], :] = ckpt_w.clone().to(new_w.device)
-            load_state[model_weight_key] = new_w
-
-            if model_b is not None:
-                new_b = model_b.clone()
-                if ckpt_b is not None:
-                    new_b[: ckpt_b.shape[0]] = ckpt_b.clone().to(new_b.device)
-                load_state[bias_key_model] = new_b
-            elif ckpt_b is not None:
-                # model has no bias but ckpt does — ignore ckpt bias
-                pass
-
-            # keep other model parameters as-is (backbone etc)
-            try:
-                model.load_state_dict(load_state)
-                print(f"[OK] Adapted checkpoint head and loaded into model for '{crop}'.")
-            except RuntimeError as e:
-                print(f"[WARN] Adapted load failed with RuntimeError: {e}. Trying non-strict load (strict=False).")
-                model.load_state_dict(load_state, strict=False)
-
-        elif checkpoint_num_classes is not None and checkpoint_num_classes == num_desired:
-            # same class count — try direct load
-            print(f"[INFO] Checkpoint classes match desired ({num_desired}). Attempting direct load.")
-            try:
-                model.load_state_dict(state)
-                print(f"[OK] Strict load succeeded for '{crop}'.")
-            except RuntimeError as e:
-                print(f"[WARN] Strict load failed: {e}. Trying strict=False.")
-                model.load_state_dict(state, strict=False)
+def format_prediction(crop: str, probs, threshold: float, top_k: int) -> dict:
+    model_info = CROP_MODELS[crop]
+    CLASSES: List[str] = model_info["classes"]
+    advice_dict = model_info["advice"]
 
-        else:
-            # checkpoint has more classes or unknown — best-effort non-strict load
-            if checkpoint_num_classes is not None and checkpoint_num_classes > num_desired:
-                print(f"[WARN] Checkpoint has {checkpoint_num_classes} classes but desired model has {num_desired}. Loading with strict=False (this will ignore mismatched params).")
-            try:
-                model.load_state_dict(state, strict=False)
-                print(f"[INFO] Loaded checkpoint into model for '{crop}' with strict=False.")
-            except Exception as e:
-                raise RuntimeError(f"Failed to load checkpoint for '{crop}': {e}")
+    # clamp top_k
+    k = max(1, int(top_k))
+    k = min(k, len(CLASSES))
+
+    # indices sorted by probability desc
+    topk_idx = probs.argsort()[::-1][:k]
+    topk = [(CLASSES[int(i)], float(probs[int(i)])) for i in topk_idx]
+
+    # primary prediction is first entry
+    primary_label, primary_conf = topk[0]
+
+    # If confidence < threshold -> Unclassified (use label if 'Unclassified' exists else 'Unclassified')
+    if primary_conf < float(threshold):
+        predicted_class = "Unclassified"
+        confidence = primary_conf
+    else:
+        predicted_class = primary_label
+        confidence = primary_conf
 
-        model = model.to(DEVICE).eval()
-        LOADED_MODELS[crop] = {"model": model, "classes": desired_classes, "advice": cfg["advice"]}
-        print(f"→ Model for '{crop}' ready. Using {len(desired_classes)} classes (labels preserved as provided).")
+    # prepare probabilities map (label -> prob)
+    probs_map = {label: float(probs[idx]) for idx, label in enumerate(CLASSES)}
 
-    print("✅ All models loaded successfully!")
+    info = get_advice_safe(advice_dict, predicted_class)
+
+    return {
+        "success": True,
+        "crop": crop,
+        "confidence": confidence,
+        "disease": predicted_class,
+        "description": info.get("description", ""),
+        "treatment": info.get("advice", ""),
+        "top_k": topk,
+        "probabilities": probs_map,
+    }
+
+
+async def score_image(crop: str, data: bytes, threshold: float, top_k: int, views=("base",), tta_budget_ms=None) -> dict:
+    """
+    Cached probabilities for these exact bytes if we have them; otherwise decode
+    on the decode pool and infer as part of a micro-batch (all TTA views in the
+    same batch). Then format the result.
+    """
+    loop = asyncio.get_running_loop()
+    tta = "+".join(views[1:])
+    digest = image_digest(data) if (data and PREDICTION_CACHE.enabled) else None
+    if digest is not None:
+        start = time.perf_counter()
+        key = PREDICTION_CACHE.key(crop, model_version(crop) + (f"|tta={tta}" if tta else ""), digest)
+        probs = PREDICTION_CACHE.get(key)
+        if probs is None and PREDICTION_CACHE.disk is not None:
+            probs = await loop.run_in_executor(DECODE_EXECUTOR, PREDICTION_CACHE.get_disk, key)
+        METRICS.observe_stage("cache_lookup", time.perf_counter() - start)
+        if probs is not None:
+            with METRICS.stage("format"):
+                result = format_prediction(crop, probs, threshold, top_k)
+            if tta:
+                result["tta"] = {"views": len(views), "requested": len(views), "fallback": False}
+            return result
+
+    # "infer" is the request's wait for its batch: queueing + the batched forward
+    if tta:
+        tensors = await loop.run_in_executor(DECODE_EXECUTOR, decode_views, data, views)
+        budget = (tta_budget_ms if tta_budget_ms is not None else TTA_BUDGET_MS) / 1000.0
+        start = time.perf_counter()
+        probs, version, used = await predict_views(MODEL_REGISTRY, crop, tensors, budget)
+    else:
+        inp = await loop.run_in_executor(DECODE_EXECUTOR, decode_and_preprocess, data)
+        start = time.perf_counter()
+        probs, version = await MODEL_REGISTRY.predict_versioned(crop, inp)
+        used = 1
+    METRICS.observe_stage("infer", time.perf_counter() - start)
+
+    if digest is not None:
+        # keyed on the version that actually produced the result; a TTA request
+        # that fell back to one view is cached as a plain prediction
+        key = PREDICTION_CACHE.key(crop, version + (f"|tta={tta}" if used > 1 else ""), digest)
+        PREDICTION_CACHE.put(key, probs)
+        if PREDICTION_CACHE.disk is not None:
+            await loop.run_in_executor(DECODE_EXECUTOR, PREDICTION_CACHE.put_disk, key, probs)
+
+    with METRICS.stage("format"):
+        result = format_prediction(crop, probs, threshold, top_k)
+    if tta:
+        result["tta"] = {"views": used, "requested": len(views), "fallback": used < len(views)}
+    return result
+
+
+async def check_crop(crop: str):
+    """Return an error JSONResponse if the crop can't be served, else None (loads its model if needed)."""
+    if crop not in CROP_MODELS:
+        return JSONResponse(status_code=400, content={"success": False, "error": f"Unsupported crop type '{crop}'. Choose from: {list(CROP_MODELS.keys())}"})
+    try:
+        await MODEL_REGISTRY.get(crop)
+    except Exception:
+        return JSONResponse(status_code=500, content={"success": False, "error": f"Model for '{crop}' failed to load on server. Check server logs."})
+    return None
 
 # -------------------------------
 # Prediction endpoint
@@ -263,93 +546,119 @@ async def predict(
     cropType: str = Form(...),
     threshold: Optional[float] = Form(0.70),
     top_k: Optional[int] = Form(1),
+    tta: Optional[str] = Form(None),
+    tta_budget_ms: Optional[float] = Form(None),
 ):
     """
     Predict disease from uploaded image.
 
     - threshold: float between 0 and 1. If top prediction confidence < threshold, returns 'Unclassified'.
     - top_k: number of top predictions to return (1 returns single best). Maximum will be clamped to number of classes.
+    - tta: test-time augmentation views to average, e.g. "flip" or "flips+rot" (see tta.py); "none" turns it off.
+    - tta_budget_ms: time allowed for the extra views before falling back to the single-view result.
     """
     try:
         crop = cropType.strip().lower()
-        if crop not in LOADED_MODELS:
-            return JSONResponse(status_code=400, content={"success": False, "error": f"Unsupported crop type '{crop}'. Choose from: {list(LOADED_MODELS.keys())}"})
-
-        model_info = LOADED_MODELS[crop]
-        model = model_info["model"]
-        CLASSES: List[str] = model_info["classes"]
-        advice_dict = model_info["advice"]
-
-        if model is None:
-            return JSONResponse(status_code=500, content={"success": False, "error": f"Model for '{crop}' failed to load on server. Check server logs."})
+        error = await check_crop(crop)
+        if error is not None:
+            return error
+        try:
+            views = parse_tta(DEFAULT_TTA if tta is None else tta)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
 
         # Read and validate upload
-        data = await image.read()
-        if not data:
-            return JSONResponse(status_code=400, content={"success": False, "error": "Empty file uploaded."})
-
+        with METRICS.stage("read"):
+            data = await image.read()
         try:
-            pil_img = Image.open(io.BytesIO(data)).convert("RGB")
-        except Exception as e:
-            return JSONResponse(status_code=400, content={"success": False, "error": f"Unable to open image file: {e}"})
-
-        # Preprocess and infer
-        with torch.no_grad():
-            inp = preprocess_image(pil_img)
-            output = model(inp)
-
-            # handle some timm variants that return dicts
-            if isinstance(output, dict) and "logits" in output:
-                logits = output["logits"]
-            else:
-                logits = output
-
-            # ensure logits shape is (N, C)
-            if logits.ndim == 1:
-                logits = logits.unsqueeze(0)
-
-            probs_tensor = torch.softmax(logits, dim=1).cpu()
-            probs = probs_tensor.numpy()[0]
-
-            # clamp top_k
-            k = max(1, int(top_k))
-            k = min(k, len(CLASSES))
-
-            # indices sorted by probability desc
-            topk_idx = probs.argsort()[::-1][:k]
-            topk = [(CLASSES[int(i)], float(probs[int(i)])) for i in topk_idx]
-
-            # primary prediction is first entry
-            primary_label, primary_conf = topk[0]
-
-            # If confidence < threshold -> Unclassified (use label if 'Unclassified' exists else 'Unclassified')
-            if primary_conf < float(threshold):
-                predicted_class = "Unclassified"
-                confidence = primary_conf
-            else:
-                predicted_class = primary_label
-                confidence = primary_conf
-
-        # prepare probabilities map (label -> prob)
-        probs_map = {label: float(probs[idx]) for idx, label in enumerate(CLASSES)}
-
-        info = get_advice_safe(advice_dict, predicted_class)
-
-        return {
-            "success": True,
-            "crop": crop,
-            "confidence": confidence,
-            "disease": predicted_class,
-            "description": info.get("description", ""),
-            "treatment": info.get("advice", ""),
-            "top_k": topk,
-            "probabilities": probs_map,
-        }
+            return await score_image(crop, data, threshold, top_k, views, tta_budget_ms)
+        except ImageDecodeError as e:
+            return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
 
     except Exception as e:
         # server error
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
 
+# -------------------------------
+# Batch prediction endpoint
+# -------------------------------
+@app.post("/predict/batch")
+async def predict_batch(
+    cropType: str = Form(...),
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    threshold: Optional[float] = Form(0.70),
+    top_k: Optional[int] = Form(1),
+    tta: Optional[str] = Form(None),
+    tta_budget_ms: Optional[float] = Form(None),
+):
+    """
+    Predict many images of one crop (e.g. every leaf photographed in a plot).
+
+    Send repeated `images` files and/or one zip/tar `archive`. The response is
+    NDJSON: one line per image as soon as it is scored (with `index` and
+    `filename`), then a final `"summary": true` line with the plot diagnosis.
+    """
+    crop = cropType.strip().lower()
+    error = await check_crop(crop)
+    if error is not None:
+        return error
+    try:
+        views = parse_tta(DEFAULT_TTA if tta is None else tta)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+
+    try:
+        with METRICS.stage("read"):
+            items = await collect_uploads(images, archive)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    if not items:
+        return JSONResponse(status_code=400, content={"success": False, "error": "No images uploaded."})
+
+    async def score_one(data):
+        return await score_image(crop, data, threshold, top_k, views, tta_budget_ms)
+
+    return StreamingResponse(stream_batch(items, score_one), media_type="application/x-ndjson")
+
+# -------------------------------
+# Scrape-time gauges for /metrics
+# -------------------------------
+def _registry_gauge(fn):
+    return lambda: fn(MODEL_REGISTRY) if MODEL_REGISTRY is not None else None
+
+
+def _cache_gauge(fn):
+    return lambda: fn(PREDICTION_CACHE) if PREDICTION_CACHE is not None else None
+
+
+METRICS.gauge("models_resident", "Crop models currently loaded", _registry_gauge(lambda r: len(r.stats()["resident"])))
+METRICS.gauge("model_loads_total", "Model loads since start", _registry_gauge(lambda r: r.loads), kind="counter")
+METRICS.gauge("batch_queue_depth", "Images waiting for a batch", labelnames=["crop"], fn=_registry_gauge(
+    lambda r: {(crop,): b["queue_depth"] for crop, b in r.batchers.stats().items()}))
+METRICS.gauge("batch_images_total", "Images scored in batches", labelnames=["crop"], kind="counter", fn=_registry_gauge(
+    lambda r: {(crop,): b["images"] for crop, b in r.batchers.stats().items()}))
+METRICS.gauge("batches_total", "Batched forward passes", labelnames=["crop"], kind="counter", fn=_registry_gauge(
+    lambda r: {(crop,): b["batches"] for crop, b in r.batchers.stats().items()}))
+METRICS.gauge("cache_lookups_total", "Prediction cache lookups", labelnames=["result"], kind="counter", fn=_cache_gauge(
+    lambda c: {("hit",): c.hits, ("disk_hit",): c.disk_hits, ("miss",): c.misses}))
+
+# -------------------------------
+# Health / batching stats
+# -------------------------------
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "crops": list(CROP_MODELS.keys()),
+        "models_loaded": MODEL_REGISTRY.stats()["resident"] if MODEL_REGISTRY is not None else [],
+        "registry": MODEL_REGISTRY.stats() if MODEL_REGISTRY is not None else None,
+        "batching": MODEL_REGISTRY.batchers.stats() if MODEL_REGISTRY is not None else None,
+        "shared_backbone": SHARED_MODEL.stats() if SHARED_MODEL is not None else None,
+        "cache": PREDICTION_CACHE.stats() if PREDICTION_CACHE is not None else None,
+        "tta": {"default": "+".join(parse_tta(DEFAULT_TTA)[1:]) or None, "budget_ms": TTA_BUDGET_MS},
+    }
+
 # -------------------------------
 # Run with uvicorn when executed directly
 # -------------------------------
@@ -1,34 +1,92 @@
 #!/usr/bin/env python3
-import io
+import asyncio
+import os
+import time
 import torch
 import timm
-from PIL import Image
 from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
-from torchvision import transforms
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_upload import collect_uploads, stream_batch
+from batching import CropBatchers
+from instrumentation import Metrics, RequestProfiler, instrument_app
+from model_registry import LazyModelRegistry, file_signature
+from prediction_cache import PredictionCache, image_digest
+from model_variants import build_variant
+from serving import apply_torch_threads
+from shared_backbone import SharedBackboneModel
+from preprocessing import decode_image, image_to_uint8_tensor
 
 # -------------------------------
 # Minimal Crop Disease Prediction API - Rice + Corn
 # -------------------------------
 
-app = FastAPI(title="Crop Disease Prediction API - Minimal (Rice + Corn)")
+# Stage timings on /metrics; opt-in sampling profiler via DISEASE_PROFILE_*
+# (see instrumentation.py)
+METRICS = Metrics("disease")
+app = FastAPI(title="Crop Disease Prediction API - Minimal (Rice + Corn)",
+              default_response_class=METRICS.json_response_class())
+instrument_app(app, METRICS, RequestProfiler(
+    os.environ.get("DISEASE_PROFILE_DIR", "profiles"),
+    sample_rate=float(os.environ.get("DISEASE_PROFILE_RATE", "0")),
+    allow_header=os.environ.get("DISEASE_PROFILE_HEADER", "0") == "1",
+    interval_ms=float(os.environ.get("DISEASE_PROFILE_INTERVAL_MS", "5")),
+))
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 CONF_THRESHOLD = 0.70  # 70% confidence threshold
 
+# Thread counts come from serving.py when running multi-process
+apply_torch_threads()
+# mmap + assign: worker processes share the checkpoint pages
+SHARE_WEIGHTS = DEVICE.type == "cpu" and os.environ.get("DISEASE_SHARE_WEIGHTS", "1") != "0"
+
+# Concurrent uploads per crop are stacked into one forward pass
+MAX_BATCH_SIZE = int(os.environ.get("DISEASE_MAX_BATCH_SIZE", "16"))
+BATCH_WAIT_MS = float(os.environ.get("DISEASE_BATCH_WAIT_MS", "10"))
+INFERENCE_WORKERS = int(os.environ.get("DISEASE_INFERENCE_WORKERS", "1"))
+
+# Uploads are decoded/preprocessed in parallel on their own pool
+DECODE_WORKERS = int(os.environ.get("DISEASE_DECODE_WORKERS", os.cpu_count() or 1))
+DECODE_EXECUTOR = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="disease-decode")
+
+SUPPORTED_CROPS = ("rice", "corn")
+
+# CPU-optimized serving variant: eager | int8 | torchscript | onnx | onnx-int8
+MODEL_VARIANT = os.environ.get("DISEASE_MODEL_VARIANT", "eager").lower()
+CALIBRATION_DIR = os.environ.get("DISEASE_CALIBRATION_DIR")
+
+# Shared-backbone mode: "rice" or "corn" serves both crops from that model's
+# feature extractor with per-crop heads (see shared_backbone.py)
+SHARED_BACKBONE = os.environ.get("DISEASE_SHARED_BACKBONE", "").strip().lower() or None
+
+# Models load on the first request for their crop; see model_registry.py
+MAX_RESIDENT_MODELS = int(os.environ.get("DISEASE_MAX_RESIDENT_MODELS", "0"))
+PRELOAD_CROPS = [c.strip().lower() for c in os.environ.get("DISEASE_PRELOAD_CROPS", "").split(",") if c.strip()]
+
+# Re-uploads of the same photo skip decode + inference; see prediction_cache.py
+CACHE_SIZE = int(os.environ.get("DISEASE_CACHE_SIZE", "2048"))
+CACHE_DB = os.environ.get("DISEASE_CACHE_DB") or None
+CACHE_DB_MAX_ENTRIES = int(os.environ.get("DISEASE_CACHE_DB_MAX_ENTRIES", "100000"))
+
 # -------------------------------
 # MODEL PATHS
 # -------------------------------
 RICE_WEIGHTS = "mobilevit_rice2.pth"
 CORN_WEIGHTS = "mobilevit_corn1.pth"
 
+def load_model(weights, num_classes):
+    model = timm.create_model("mobilevit_xxs", pretrained=False, num_classes=num_classes)
+    state = torch.load(weights, map_location="cpu" if SHARE_WEIGHTS else DEVICE, mmap=SHARE_WEIGHTS)
+    model.load_state_dict(state, assign=SHARE_WEIGHTS)
+    return model.to(DEVICE).eval()
+
 # -------------------------------
 # RICE MODEL
 # -------------------------------
 RICE_NUM_CLASSES = 6
-RICE_MODEL = timm.create_model("mobilevit_xxs", pretrained=False, num_classes=RICE_NUM_CLASSES)
-RICE_MODEL.load_state_dict(torch.load(RICE_WEIGHTS, map_location=DEVICE))
-RICE_MODEL.to(DEVICE).eval()
 
 RICE_CLASSES = [
     "Bacterial_leaf_blight",
@@ -79,9 +137,6 @@ RICE_ADVICE = {
 # CORN MODEL
 # -------------------------------
 CORN_NUM_CLASSES = 5
-CORN_MODEL = timm.create_model("mobilevit_xxs", pretrained=False, num_classes=CORN_NUM_CLASSES)
-CORN_MODEL.load_state_dict(torch.load(CORN_WEIGHTS, map_location=DEVICE))
-CORN_MODEL.to(DEVICE).eval()
 
 CORN_CLASSES = [
     "Corn_Blight",
@@ -115,88 +170,233 @@ CORN_ADVICE = {
 }
 
 # -------------------------------
-# IMAGE TRANSFORM
+# IMAGE PREPROCESSING
 # -------------------------------
-TRANSFORM = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-])
-
+# Same as Resize((224, 224)) + ToTensor(), but JPEGs are decoded at reduced
+# size and the /255 scaling happens once per batch (see preprocessing.py).
 def preprocess_image_bytes(img_bytes: bytes):
-    return (
-        TRANSFORM(Image.open(io.BytesIO(img_bytes)).convert("RGB"))
-        .unsqueeze(0)
-        .to(DEVICE)
-    )
+    # uint8 (3, 224, 224) on CPU; the batcher stacks, scales and moves it to DEVICE
+    with METRICS.stage("decode"):
+        img = decode_image(img_bytes, (224, 224))
+    with METRICS.stage("preprocess"):
+        return image_to_uint8_tensor(img)
 
 # -------------------------------
-# PREDICT ENDPOINT
+# SHARED BACKBONE (optional)
 # -------------------------------
-@app.post("/predict")
-async def predict(
-    image: UploadFile = File(...),
-    cropType: str = Form(...),
-):
-    try:
-        crop = cropType.strip().lower()
-        content = await image.read()
+MODEL_FILES = {"rice": (RICE_WEIGHTS, RICE_NUM_CLASSES), "corn": (CORN_WEIGHTS, CORN_NUM_CLASSES)}
 
-        if not content:
-            return JSONResponse(status_code=400, content={"success": False, "error": "Empty image file."})
+SHARED_MODEL = None
+if SHARED_BACKBONE:
+    SHARED_MODEL = SharedBackboneModel(
+        SHARED_BACKBONE,
+        MODEL_FILES,
+        lambda crop: load_model(*MODEL_FILES[crop]),
+        DEVICE,
+    ).load()
 
-        inp = preprocess_image_bytes(content)
+# -------------------------------
+# LAZY MODEL LOADING + BATCHED INFERENCE
+# -------------------------------
+def load_serving_model(crop):
+    if SHARED_MODEL is not None:
+        return SHARED_MODEL.view(crop)
+    weights, num_classes = MODEL_FILES[crop]
+    model = load_model(weights, num_classes)
+    if MODEL_VARIANT == "eager":
+        return model
+    if DEVICE.type != "cpu":
+        print(f"[WARN] Model variant '{MODEL_VARIANT}' is CPU-only; serving eager model on {DEVICE}.")
+        return model
+    return build_variant(model, MODEL_VARIANT, weights, CALIBRATION_DIR)
 
-        # ---------- RICE ----------
-        if crop == "rice":
-            with torch.no_grad():
-                logits = RICE_MODEL(inp)
-                probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
+def release_model(crop, model):
+    if SHARED_MODEL is not None:
+        SHARED_MODEL.unload(crop)
 
-            idx = int(probs.argmax())
-            conf = float(probs[idx])
+def model_version(crop):
+    files = SHARED_MODEL.version_files(crop) if SHARED_MODEL is not None else [MODEL_FILES[crop][0]]
+    mode = f"shared-{SHARED_BACKBONE}" if SHARED_MODEL is not None else MODEL_VARIANT
+    return "|".join([file_signature(path) for path in files] + [mode])
 
-            if conf < CONF_THRESHOLD:
-                label = "Unclassified"
-            else:
-                label = RICE_CLASSES[idx]
+MODEL_REGISTRY = LazyModelRegistry(
+    load_serving_model,
+    CropBatchers(max_batch_size=MAX_BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS, workers=INFERENCE_WORKERS,
+                 observe=METRICS.observe_stage),
+    DEVICE,
+    max_resident=MAX_RESIDENT_MODELS,
+    on_evict=release_model,
+    version_fn=model_version,
+)
 
-            advice_key = RICE_LABEL_MAP[label]
-            info = RICE_ADVICE[advice_key]
+PREDICTION_CACHE = PredictionCache(CACHE_SIZE, CACHE_DB, CACHE_DB_MAX_ENTRIES)
 
-        # ---------- CORN ----------
-        elif crop == "corn":
-            with torch.no_grad():
-                logits = CORN_MODEL(inp)
-                probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
+@app.on_event("startup")
+async def preload_models():
+    for crop in PRELOAD_CROPS:
+        if crop not in SUPPORTED_CROPS:
+            print(f"[WARN] DISEASE_PRELOAD_CROPS: unknown crop '{crop}' skipped.")
+            continue
+        try:
+            await MODEL_REGISTRY.get(crop)
+        except Exception as e:
+            print(f"[WARN] Preloading '{crop}' failed: {e}")
 
-            idx = int(probs.argmax())
-            conf = float(probs[idx])
+@app.on_event("shutdown")
+async def stop_batchers():
+    await MODEL_REGISTRY.stop()
+    PREDICTION_CACHE.close()
 
-            if conf < CONF_THRESHOLD:
-                label = "Unclassified"
-            else:
-                label = CORN_CLASSES[idx]
+# -------------------------------
+# SHARED PREDICTION PATH
+# -------------------------------
+def label_prediction(crop: str, probs) -> dict:
+    idx = int(probs.argmax())
+    conf = float(probs[idx])
+
+    # ---------- RICE ----------
+    if crop == "rice":
+        if conf < CONF_THRESHOLD:
+            label = "Unclassified"
+        else:
+            label = RICE_CLASSES[idx]
 
-            info = CORN_ADVICE[label]
+        advice_key = RICE_LABEL_MAP[label]
+        info = RICE_ADVICE[advice_key]
 
+    # ---------- CORN ----------
+    else:
+        if conf < CONF_THRESHOLD:
+            label = "Unclassified"
         else:
+            label = CORN_CLASSES[idx]
+
+        info = CORN_ADVICE[label]
+
+    return {
+        "success": True,
+        "crop": crop,
+        "disease": label,
+        "confidence": conf,
+        "description": info["description"],
+        "treatment": info["advice"],
+    }
+
+async def score_image(crop: str, content: bytes) -> dict:
+    if not content:
+        raise ValueError("Empty image file.")
+    loop = asyncio.get_running_loop()
+
+    # same bytes + crop + model version -> cached probabilities, no decode or inference
+    digest = image_digest(content) if PREDICTION_CACHE.enabled else None
+    if digest is not None:
+        start = time.perf_counter()
+        key = PREDICTION_CACHE.key(crop, model_version(crop), digest)
+        probs = PREDICTION_CACHE.get(key)
+        if probs is None and PREDICTION_CACHE.disk is not None:
+            probs = await loop.run_in_executor(DECODE_EXECUTOR, PREDICTION_CACHE.get_disk, key)
+        METRICS.observe_stage("cache_lookup", time.perf_counter() - start)
+        if probs is not None:
+            with METRICS.stage("format"):
+                return label_prediction(crop, probs)
+
+    inp = await loop.run_in_executor(DECODE_EXECUTOR, preprocess_image_bytes, content)
+    # queueing + the batched forward this image rides in
+    with METRICS.stage("infer"):
+        probs, version = await MODEL_REGISTRY.predict_versioned(crop, inp)
+    if digest is not None:
+        key = PREDICTION_CACHE.key(crop, version, digest)
+        PREDICTION_CACHE.put(key, probs)
+        if PREDICTION_CACHE.disk is not None:
+            await loop.run_in_executor(DECODE_EXECUTOR, PREDICTION_CACHE.put_disk, key, probs)
+    with METRICS.stage("format"):
+        return label_prediction(crop, probs)
+
+# -------------------------------
+# PREDICT ENDPOINT
+# -------------------------------
+@app.post("/predict")
+async def predict(
+    image: UploadFile = File(...),
+    cropType: str = Form(...),
+):
+    try:
+        crop = cropType.strip().lower()
+        with METRICS.stage("read"):
+            content = await image.read()
+
+        if not content:
+            return JSONResponse(status_code=400, content={"success": False, "error": "Empty image file."})
+
+        if crop not in SUPPORTED_CROPS:
             return JSONResponse(
                 status_code=400,
                 content={"success": False, "error": "Unsupported cropType. Use 'rice' or 'corn'."},
             )
 
-        return {
-            "success": True,
-            "crop": crop,
-            "disease": label,
-            "confidence": conf,
-            "description": info["description"],
-            "treatment": info["advice"],
-        }
+        return await score_image(crop, content)
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
 
+# -------------------------------
+# BATCH PREDICT ENDPOINT
+# -------------------------------
+@app.post("/predict/batch")
+async def predict_batch(
+    cropType: str = Form(...),
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+):
+    """
+    Many images for one crop, as repeated `images` files and/or a zip/tar
+    `archive`. Streams NDJSON: one line per image, then a plot summary line.
+    """
+    crop = cropType.strip().lower()
+    if crop not in SUPPORTED_CROPS:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "error": "Unsupported cropType. Use 'rice' or 'corn'."},
+        )
+
+    try:
+        with METRICS.stage("read"):
+            items = await collect_uploads(images, archive)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    if not items:
+        return JSONResponse(status_code=400, content={"success": False, "error": "No images uploaded."})
+
+    return StreamingResponse(stream_batch(items, lambda data: score_image(crop, data)), media_type="application/x-ndjson")
+
+# -------------------------------
+# METRICS GAUGES (read at scrape time)
+# -------------------------------
+METRICS.gauge("models_resident", "Crop models currently loaded", lambda: len(MODEL_REGISTRY.stats()["resident"]))
+METRICS.gauge("model_loads_total", "Model loads since start", lambda: MODEL_REGISTRY.loads, kind="counter")
+METRICS.gauge("batch_queue_depth", "Images waiting for a batch", labelnames=["crop"],
+              fn=lambda: {(crop,): b["queue_depth"] for crop, b in MODEL_REGISTRY.batchers.stats().items()})
+METRICS.gauge("batch_images_total", "Images scored in batches", labelnames=["crop"], kind="counter",
+              fn=lambda: {(crop,): b["images"] for crop, b in MODEL_REGISTRY.batchers.stats().items()})
+METRICS.gauge("batches_total", "Batched forward passes", labelnames=["crop"], kind="counter",
+              fn=lambda: {(crop,): b["batches"] for crop, b in MODEL_REGISTRY.batchers.stats().items()})
+METRICS.gauge("cache_lookups_total", "Prediction cache lookups", labelnames=["result"], kind="counter",
+              fn=lambda: {("hit",): PREDICTION_CACHE.hits, ("disk_hit",): PREDICTION_CACHE.disk_hits,
+                          ("miss",): PREDICTION_CACHE.misses})
+
+# -------------------------------
+# HEALTH / BATCHING STATS
+# -------------------------------
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "registry": MODEL_REGISTRY.stats(),
+        "batching": MODEL_REGISTRY.batchers.stats(),
+        "cache": PREDICTION_CACHE.stats(),
+        "shared_backbone": SHARED_MODEL.stats() if SHARED_MODEL is not None else None,
+    }
+
 # -------------------------------
 # RUN
 # -------------------------------
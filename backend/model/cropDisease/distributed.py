@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Data-parallel (DDP, gloo backend) helpers for CPU training.
+
+Two ways to start N training processes:
+
+- one machine: `--nproc N` spawns N local processes, each with
+  cores / N torch threads;
+- several machines (or one): torchrun, which sets RANK / WORLD_SIZE /
+  MASTER_ADDR / MASTER_PORT for every process, e.g. on each of 2 nodes
+      torchrun --nnodes 2 --nproc-per-node 4 --node-rank <0|1> \\
+          --master-addr <node0> --master-port 29500 mobilevit_rice2.py ...
+
+Each process trains on its own shard of every epoch. Gradients are averaged
+in backward by DistributedDataParallel, and epoch metrics are summed over
+all processes. Only rank 0 prints, writes checkpoints and saves the model.
+Checkpoints and the data cache must be on storage every node can see.
+"""
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import Sampler
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def add_distributed_args(parser):
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="local DDP processes to spawn (use torchrun instead for several nodes)")
+    parser.add_argument("--threads-per-proc", type=int, default=0, help="torch threads per process (0 = cores / nproc)")
+    return parser
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main():
+    return rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def init_from_env(backend="gloo", threads=0):
+    """Join the process group described by RANK / WORLD_SIZE (torchrun or launch()); no-op for one process."""
+    if int(os.environ.get("WORLD_SIZE", "1")) <= 1 or is_distributed():
+        return False
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", os.environ["WORLD_SIZE"]))
+    threads = threads or max(1, (os.cpu_count() or 1) // local_world)
+    torch.set_num_threads(threads)
+    dist.init_process_group(backend, init_method="env://")
+    if is_main():
+        print(f"[INFO] DDP ({backend}): {world_size()} processes, {threads} torch thread(s) each")
+    return True
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawned(local_rank, fn, nproc, threads, port, fn_args):
+    os.environ.update({
+        "RANK": str(local_rank), "LOCAL_RANK": str(local_rank),
+        "WORLD_SIZE": str(nproc), "LOCAL_WORLD_SIZE": str(nproc),
+        "MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port),
+    })
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    init_from_env(threads=threads)
+    try:
+        fn(*fn_args)
+    finally:
+        cleanup()
+
+
+def launch(fn, nproc, threads=0, args=()):
+    """Run fn(*args) in `nproc` local processes joined into one gloo group."""
+    threads = threads or max(1, (os.cpu_count() or 1) // nproc)
+    mp.spawn(_spawned, args=(fn, nproc, threads, free_port(), args), nprocs=nproc, join=True)
+
+
+def all_reduce_sum(values, group=None):
+    """Sum a list of numbers / 0-d tensors over all processes (one collective); returns python floats."""
+    tensor = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM, group=group)
+    return tensor.tolist()
+
+
+def all_gather_object(obj):
+    if not is_distributed():
+        return [obj]
+    out = [None] * world_size()
+    dist.all_gather_object(out, obj)
+    return out
+
+
+class ShardSampler(Sampler):
+    """This process's share of 0..size-1 in order (evaluation; no padding, shards may differ by one)."""
+
+    def __init__(self, size):
+        self.indices = list(range(rank(), size, world_size()))
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
@@ -1,54 +1,110 @@
+import argparse
+import os
+
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, transforms
-from torch.utils.data import DataLoader
 import timm
 
+from distributed import ShardSampler, add_distributed_args, barrier, init_from_env, is_main, launch, world_size
+from train_augment import BatchAugment, add_augment_args, class_balance_weights
+from train_data import image_dataset, make_loader
+from train_runner import TrainingRunner, add_runner_args
+from trainer import TrainSettings, add_performance_args, evaluate
+
 # Device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Image preprocessing
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-])
-
 # Dataset paths
-train_dataset = datasets.ImageFolder("/home/p_sivraj/smart agri/rice_2_split/train/", transform=transform)
-val_dataset   = datasets.ImageFolder("/home/p_sivraj/smart agri/rice_2_split/val/", transform=transform)
-test_dataset  = datasets.ImageFolder("/home/p_sivraj/smart agri/rice_2_split/test/", transform=transform)
-
-# Data loaders
-train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-val_loader   = DataLoader(val_dataset, batch_size=32)
-test_loader  = DataLoader(test_dataset, batch_size=32)
-
-# Model
-num_classes = len(train_dataset.classes)
-model = timm.create_model('mobilevit_xxs', pretrained=True, num_classes=num_classes)
-model = model.to(device)
-
-# Loss and optimizer
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=1e-4)
-
-# Training loop
-epochs = 5  # adjust as needed
-
-for epoch in range(epochs):
-    model.train()
-    total_loss = 0
-    for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
-        total_loss += loss.item()
-    print(f"Epoch {epoch+1}/{epochs}, Loss: {total_loss/len(train_loader)}")
-
-# Save model
-torch.save(model.state_dict(), "mobilevit_rice.pth")
+DATA_ROOT = "/home/p_sivraj/smart agri/rice_2_split/"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train MobileViT-XXS on the rice disease dataset")
+    parser.add_argument("--data", default=DATA_ROOT, help="folder with train/ val/ test/ ImageFolder splits")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1), help="DataLoader worker processes")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches prefetched per worker")
+    parser.add_argument("--cache-dir", default="data_cache",
+                        help="pre-resized uint8 cache of each split, built on first run ('' = decode every epoch)")
+    parser.add_argument("--no-pretrained", action="store_true", help="start from random weights (offline machines)")
+    parser.add_argument("--output", default="mobilevit_rice.pth")
+    add_performance_args(parser)
+    add_runner_args(parser)
+    add_distributed_args(parser)
+    add_augment_args(parser)
+    return parser.parse_args()
+
+
+def load_splits(args):
+    # Images are decoded and resized to 224x224 once (see train_data.py); batches
+    # arrive as uint8 and are scaled to [0, 1] here, i.e. Resize + ToTensor().
+    train_dataset = image_dataset(os.path.join(args.data, "train"), args.cache_dir)
+    val_dir, test_dir = os.path.join(args.data, "val"), os.path.join(args.data, "test")
+    val_dataset = image_dataset(val_dir, args.cache_dir) if os.path.isdir(val_dir) else None
+    test_dataset = image_dataset(test_dir, args.cache_dir) if os.path.isdir(test_dir) else None
+    return train_dataset, val_dataset, test_dataset
+
+
+def eval_loader(dataset, args):
+    # under DDP every process scores its own slice; evaluate() sums the results
+    sampler = ShardSampler(len(dataset)) if world_size() > 1 else None
+    return make_loader(dataset, args.batch_size, workers=args.workers, prefetch_factor=args.prefetch, sampler=sampler)
+
+
+def train(args):
+    # rank 0 builds the caches; the other processes wait, then map them
+    if is_main():
+        load_splits(args)
+    barrier()
+    train_dataset, val_dataset, test_dataset = load_splits(args)
+
+    # Data loaders (the runner builds the resumable training loader)
+    val_loader = eval_loader(val_dataset, args) if val_dataset is not None else None
+
+    # Model (channels_last / compile / autocast per --amp etc., see trainer.py)
+    torch.manual_seed(args.seed)
+    settings = TrainSettings.from_args(args, device)
+    num_classes = len(train_dataset.classes)
+    model = timm.create_model('mobilevit_xxs', pretrained=not args.no_pretrained, num_classes=num_classes)
+    train_model, model = settings.prepare_model(model)
+    if is_main():
+        print(f"[INFO] Training on {len(train_dataset)} images, {num_classes} classes, "
+              f"{world_size()} process(es) ({settings.describe()})")
+
+    # Loss and optimizer
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+
+    # Training loop: checkpoints, resume, background validation and early
+    # stopping (see train_runner.py). The best weights land in --output.
+    # --balance / --augment: class balance and augmentation at load time, no extra files (see train_augment.py)
+    sample_weights = class_balance_weights(train_dataset.targets) if args.balance else None
+    runner = TrainingRunner(model, train_model, optimizer, criterion, settings, train_dataset, val_loader, args,
+                            scaler=settings.grad_scaler(), output=args.output,
+                            sample_weights=sample_weights, augment=BatchAugment.from_args(args))
+    if args.resume:
+        runner.resume()
+    runner.run(args.epochs)
+
+    if test_dataset is not None:
+        barrier()  # rank 0 has written --output
+        model.load_state_dict(torch.load(args.output, map_location="cpu"))
+        test_stats = evaluate(model, eval_loader(test_dataset, args), settings)
+        if is_main():
+            print(f"Test loss {test_stats['loss']:.4f}, test acc {test_stats['accuracy']:.4f} (best weights)")
+
+
+def main():
+    args = parse_args()
+    if args.nproc > 1:
+        launch(train, args.nproc, args.threads_per_proc, (args,))
+    else:
+        # plain run, or one process of a torchrun launch (RANK / WORLD_SIZE set)
+        init_from_env(threads=args.threads_per_proc)
+        train(args)
 
+if __name__ == "__main__":
+    main()
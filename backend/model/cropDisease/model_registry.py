@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Lazy per-crop model registry for the disease services.
+
+Nothing is loaded at startup unless asked for (DISEASE_PRELOAD_CROPS). The
+first request for a crop loads its model on a dedicated loader thread, and
+every concurrent request for that crop waits on the same load (single-flight).
+At most `max_resident` models are kept; loading one more evicts the least
+recently used crop once the images already queued for it are scored.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import BatcherClosedError
+
+
+def file_signature(path):
+    """"name@mtime_ns:size" of a file, or "name@missing"; cheap enough to call per request."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return f"{os.path.basename(path)}@missing"
+    return f"{os.path.basename(path)}@{st.st_mtime_ns}:{st.st_size}"
+
+
+class ResidentModel:
+    def __init__(self, crop, model, batcher, load_seconds, version=None):
+        self.crop = crop
+        self.model = model
+        self.batcher = batcher
+        self.load_seconds = load_seconds
+        self.version = version
+        self.loaded_at = time.time()
+        self.requests = 0
+
+
+class LazyModelRegistry:
+    def __init__(self, loader, batchers, device, max_resident=0, on_evict=None, version_fn=None):
+        """
+        loader:       blocking callable(crop) -> model ready to serve (runs on the loader thread)
+        batchers:     CropBatchers that owns the per-crop micro-batchers
+        max_resident: cap on loaded models; 0 = no cap
+        on_evict:     optional callable(crop, model) after a model is dropped
+        version_fn:   optional callable(crop) -> version string of what the loader would load now
+        """
+        self.loader = loader
+        self.version_fn = version_fn
+        self.batchers = batchers
+        self.device = device
+        self.max_resident = max(0, int(max_resident))
+        self.on_evict = on_evict
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disease-load")
+
+        self._resident = OrderedDict()  # crop -> ResidentModel, least recently used first
+        self._loading = {}  # crop -> asyncio.Task (single-flight)
+        self._evicting = set()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_failures = 0
+        self.evictions = 0
+        self.load_seconds_total = 0.0
+        self.last_load_seconds = {}
+        self.last_error = {}
+
+    def is_resident(self, crop):
+        return crop in self._resident
+
+    async def get(self, crop) -> ResidentModel:
+        entry = self._resident.get(crop)
+        if entry is not None:
+            self._resident.move_to_end(crop)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        task = self._loading.get(crop)
+        if task is None:
+            task = asyncio.create_task(self._load(crop))
+            # mark a failure as retrieved even if every waiter was cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._loading[crop] = task
+        # shield: one cancelled request must not cancel the load everyone else waits on
+        return await asyncio.shield(task)
+
+    async def _load(self, crop):
+        loop = asyncio.get_running_loop()
+        try:
+            start = time.perf_counter()
+            version = self.version_fn(crop) if self.version_fn is not None else None
+            model = await loop.run_in_executor(self.executor, self.loader, crop)
+            seconds = time.perf_counter() - start
+            batcher = await self.batchers.add(crop, model, self.device)
+        except Exception as e:
+            self.load_failures += 1
+            self.last_error[crop] = str(e)
+            print(f"[WARN] Loading model for '{crop}' failed: {e}")
+            raise
+        finally:
+            self._loading.pop(crop, None)
+
+        entry = ResidentModel(crop, model, batcher, seconds, version)
+        self._resident[crop] = entry
+        self.loads += 1
+        self.load_seconds_total += seconds
+        self.last_load_seconds[crop] = seconds
+        self.last_error.pop(crop, None)
+        print(f"[OK] Model for '{crop}' loaded on demand in {seconds:.2f}s ({len(self._resident)} resident).")
+        self._evict_over_cap()
+        return entry
+
+    def _evict_over_cap(self):
+        while self.max_resident and len(self._resident) > self.max_resident:
+            crop, entry = self._resident.popitem(last=False)
+            self.evictions += 1
+            task = asyncio.create_task(self._retire(crop, entry))
+            self._evicting.add(task)
+            task.add_done_callback(self._evicting.discard)
+
+    async def _retire(self, crop, entry):
+        # queued images still finish on the old batcher; new requests reload
+        await self.batchers.remove(crop, entry.batcher)
+        if self.on_evict is not None:
+            self.on_evict(crop, entry.model)
+        print(f"[INFO] Evicted model for '{crop}' (least recently used).")
+
+    async def predict(self, crop, image_tensor):
+        """Probabilities for one preprocessed image, loading the crop's model if needed."""
+        probs, _ = await self.predict_versioned(crop, image_tensor)
+        return probs
+
+    async def predict_versioned(self, crop, image_tensor):
+        """(probabilities, version of the model that produced them)."""
+        while True:
+            entry = await self.get(crop)
+            try:
+                entry.requests += 1
+                return await entry.batcher.submit(image_tensor), entry.version
+            except BatcherClosedError:
+                # evicted between lookup and submit; fetch (reload) and retry
+                continue
+
+    async def preload(self, crops):
+        for crop in crops:
+            await self.get(crop)
+
+    async def stop(self):
+        for task in list(self._loading.values()) + list(self._evicting):
+            try:
+                await task
+            except Exception:
+                pass
+        await self.batchers.stop()
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            "resident": list(self._resident),
+            "loading": sorted(self._loading),
+            "max_resident": self.max_resident,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "load_failures": self.load_failures,
+            "evictions": self.evictions,
+            "load_seconds_total": round(self.load_seconds_total, 3),
+            "last_load_seconds": {c: round(s, 3) for c, s in self.last_load_seconds.items()},
+            "requests": {c: e.requests for c, e in self._resident.items()},
+            "versions": {c: e.version for c, e in self._resident.items()},
+            "last_error": dict(self.last_error),
+        }
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+CPU-optimized variants of the MobileViT disease models.
+
+Variants (pick one at startup with DISEASE_MODEL_VARIANT):
+
+- "eager"        the fp32 timm module as loaded (default)
+- "int8"         torch dynamic int8 quantization of the Linear layers
+                 (the MobileViT transformer blocks)
+- "torchscript"  traced, frozen and optimize_for_inference'd TorchScript
+- "onnx"         ONNX Runtime session (needs the optional `onnxruntime` package)
+- "onnx-int8"    ONNX Runtime with int8 MatMuls; statically calibrated on real
+                 images when a calibration folder is given, dynamic otherwise
+
+Exported artifacts (.ts.pt / .onnx / .int8.onnx) are written next to the
+weights file and reused on later startups while they are newer than the
+weights.
+
+Parity + benchmark:
+    python model_variants.py --crop rice --variants eager int8 torchscript onnx onnx-int8 \
+        --images ../../../data_preprocessing/data/CornDataset_1/Blight
+"""
+import argparse
+import contextlib
+import glob
+import os
+import time
+
+import torch
+
+VARIANTS = ("eager", "int8", "torchscript", "onnx", "onnx-int8")
+IMAGE_SIZE = (224, 224)
+
+
+def artifact_path(weights_path, suffix, model=None):
+    """
+    Artifact file next to the weights. The head size is part of the name, since
+    the same checkpoint can be served with different class counts (check.py
+    adapts corn1 to 6 classes, diseasePrediction.py keeps 5).
+    """
+    base = os.path.splitext(weights_path)[0]
+    classifier = model.get_classifier() if hasattr(model, "get_classifier") else None
+    if isinstance(classifier, torch.nn.Linear):
+        base += f".{classifier.out_features}cls"
+    return base + suffix
+
+
+def _is_fresh(artifact, weights_path):
+    return os.path.isfile(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(weights_path)
+
+
+@contextlib.contextmanager
+def _writing(path):
+    """
+    Yield a temporary path next to `path` and move it into place once written.
+    Serving workers build artifacts concurrently; none may load (or take as
+    fresh) a half-written file.
+    """
+    base, ext = os.path.splitext(path)
+    tmp = f"{base}.tmp{os.getpid()}{ext}"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _example_input(batch=1):
+    return torch.rand(batch, 3, *IMAGE_SIZE)
+
+
+# -------------------------------
+# Builders
+# -------------------------------
+def build_int8(model, **_):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def build_torchscript(model, weights_path=None, **_):
+    # The traced module is what gets cached: frozen + optimize_for_inference
+    # graphs do not survive a save/load round trip, so those passes run on every load.
+    path = artifact_path(weights_path, ".ts.pt", model) if weights_path else None
+    if path and _is_fresh(path, weights_path):
+        traced = torch.jit.load(path, map_location="cpu").eval()
+    else:
+        with torch.no_grad():
+            traced = torch.jit.trace(model, _example_input())
+        if path:
+            with _writing(path) as tmp:
+                torch.jit.save(traced, tmp)
+    with torch.no_grad():
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def export_onnx(model, path):
+    with _writing(path) as tmp:
+        torch.onnx.export(
+            model, _example_input(), tmp,
+            input_names=["images"], output_names=["logits"],
+            dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=17, dynamo=False,
+        )
+    return path
+
+
+class OnnxModel:
+    """Callable with the same contract as the torch module: (N, 3, H, W) tensor -> logits tensor."""
+
+    def __init__(self, path, intra_op_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def build_onnx(model, weights_path=None, **_):
+    path = artifact_path(weights_path, ".onnx", model)
+    if not _is_fresh(path, weights_path):
+        export_onnx(model, path)
+    return OnnxModel(path)
+
+
+class _CalibrationReader:
+    """Feeds preprocessed images to onnxruntime's static quantizer."""
+
+    def __init__(self, input_name, image_paths):
+        from preprocessing import load_image_tensor, to_float_batch
+
+        def batches():
+            for path in image_paths:
+                with open(path, "rb") as f:
+                    tensor = load_image_tensor(f.read())
+                yield {input_name: to_float_batch([tensor]).numpy().copy()}
+
+        self._batches = batches()
+
+    def get_next(self):
+        return next(self._batches, None)
+
+
+def build_onnx_int8(model, weights_path=None, calibration_dir=None, calibration_images=64, **_):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    fp32_path = artifact_path(weights_path, ".onnx", model)
+    int8_path = artifact_path(weights_path, ".int8.onnx", model)
+    if not _is_fresh(fp32_path, weights_path):
+        export_onnx(model, fp32_path)
+    if not _is_fresh(int8_path, weights_path):
+        # Only the MatMuls (transformer projections/MLPs) are quantized: int8
+        # depthwise/pointwise convs in the MobileNet stages cost far too much accuracy.
+        images = list_images(calibration_dir)[:calibration_images] if calibration_dir else []
+        with _writing(int8_path) as tmp:
+            if images:
+                quantize_static(fp32_path, tmp, _CalibrationReader("images", images),
+                                quant_format=QuantFormat.QDQ, op_types_to_quantize=["MatMul"], per_channel=True,
+                                calibrate_method=CalibrationMethod.Percentile,
+                                activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+            else:
+                quantize_dynamic(fp32_path, tmp, op_types_to_quantize=["MatMul"], per_channel=True,
+                                 weight_type=QuantType.QInt8)
+    return OnnxModel(int8_path)
+
+
+BUILDERS = {
+    "eager": lambda model, **_: model,
+    "int8": build_int8,
+    "torchscript": build_torchscript,
+    "onnx": build_onnx,
+    "onnx-int8": build_onnx_int8,
+}
+
+
+def build_variant(model, variant="eager", weights_path=None, calibration_dir=None):
+    """
+    Turn a loaded fp32 eager model (CPU, eval mode) into the requested variant.
+    Falls back to eager with a warning if the variant cannot be built here
+    (e.g. onnxruntime not installed).
+    """
+    variant = (variant or "eager").lower()
+    if variant not in BUILDERS:
+        raise ValueError(f"Unknown model variant '{variant}'. Choose from: {list(VARIANTS)}")
+    try:
+        built = BUILDERS[variant](model.eval(), weights_path=weights_path, calibration_dir=calibration_dir)
+    except ImportError as e:
+        print(f"[WARN] Model variant '{variant}' unavailable ({e}); serving eager fp32.")
+        return model
+    print(f"[OK] Built '{variant}' model variant from '{weights_path}'.")
+    return built
+
+
+# -------------------------------
+# Parity + benchmark
+# -------------------------------
+def list_images(folder):
+    extensions = (".jpg", ".jpeg", ".png", ".bmp")
+    return sorted(p for p in glob.glob(os.path.join(folder, "**", "*"), recursive=True)
+                  if p.lower().endswith(extensions))
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return float("nan")
+
+
+def _logits(model, batch):
+    from batching import logits_from_output
+
+    with torch.inference_mode():
+        return logits_from_output(model(batch)).float()
+
+
+def compare_variants(eager_model, variants, weights_path, batch, calibration_dir=None, repeats=10, batch_sizes=(1, 8)):
+    """Print top-1 agreement / max prob difference vs eager, latency and RSS growth per variant."""
+    reference = torch.softmax(_logits(eager_model, batch), dim=1)
+    print(f"{'variant':<12} {'top1 agree':>10} {'max |dp|':>9} {'build s':>8} {'rss +MB':>8}  latency ms/batch")
+    for variant in variants:
+        before = rss_mb()
+        start = time.perf_counter()
+        model = build_variant(eager_model, variant, weights_path, calibration_dir)
+        build_s = time.perf_counter() - start
+        grown = rss_mb() - before
+
+        probs = torch.softmax(_logits(model, batch), dim=1)
+        agree = float((probs.argmax(1) == reference.argmax(1)).float().mean())
+        max_dp = float((probs - reference).abs().max())
+
+        latencies = []
+        for size in batch_sizes:
+            x = batch[:size] if size <= len(batch) else batch.repeat((size + len(batch) - 1) // len(batch), 1, 1, 1)[:size]
+            _logits(model, x)  # warm-up
+            t = time.perf_counter()
+            for _ in range(repeats):
+                _logits(model, x)
+            latencies.append(f"bs{size}={(time.perf_counter() - t) * 1000.0 / repeats:.1f}")
+        print(f"{variant:<12} {agree:>10.3f} {max_dp:>9.4f} {build_s:>8.2f} {grown:>8.1f}  {' '.join(latencies)}")
+
+
+def main():
+    from check import CROP_MODELS, load_crop_model
+    from preprocessing import load_image_tensor, to_float_batch
+
+    parser = argparse.ArgumentParser(description="Build and compare CPU model variants for a crop")
+    parser.add_argument("--crop", default="rice", choices=sorted(CROP_MODELS))
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=VARIANTS)
+    parser.add_argument("--images", help="folder of sample images for parity (random tensors if omitted)")
+    parser.add_argument("--calibration-dir", help="images for onnx-int8 static calibration")
+    parser.add_argument("--samples", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    cfg = CROP_MODELS[args.crop]
+    eager = load_crop_model(args.crop, cfg, torch.device("cpu"))
+    if args.images:
+        paths = list_images(args.images)[: args.samples]
+        tensors = []
+        for path in paths:
+            with open(path, "rb") as f:
+                tensors.append(load_image_tensor(f.read()))
+        batch = to_float_batch(tensors).clone()
+    else:
+        batch = _example_input(args.samples)
+    print(f"Crop '{args.crop}', {len(batch)} samples, torch threads={torch.get_num_threads()}")
+    compare_variants(eager, args.variants, cfg["weights"], batch, args.calibration_dir or args.images, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
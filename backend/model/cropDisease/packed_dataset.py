@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Packed image datasets: class-labeled images in a few large tar shards plus a
+label / offset index. This file is the source; backend/model/cropDisease/
+holds a verbatim copy so the disease service's Docker context is
+self-contained (data_preprocessing/test_packed_dataset.py fails when the
+two differ).
+
+    <out>/shard-00000.tar   members named by their path under the packed root,
+    <out>/shard-00001.tar   e.g. CornDataset_1/Healthy/<name>.<ext>
+                            (WebDataset-style tars; any tar tool can list or
+                            extract them)
+    <out>/index.json        classes, shards and one [shard, offset, size,
+                            label, sha1, name] row per image
+
+Readers never parse the tars: an image is `size` bytes at `offset` of its
+shard. `stream()` reads shards front to back in large sequential chunks,
+which is what network and overlay filesystems are good at. The balancer
+(dataaugument.py) and training (train_data.py) both accept a packed
+directory wherever they take an image root. Inside a packed directory an
+image keeps its path, <out>/<path under the root>, which `open_source()`,
+`read_bytes()` and `source_stat()` resolve through the index, so code that
+works with file paths needs no other change.
+
+    python packed_dataset.py pack --root data_preprocessing/data --out data_preprocessing/data_packed
+    python packed_dataset.py bench --root data_preprocessing/data --packed data_preprocessing/data_packed
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
+INDEX_NAME = "index.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+SHARD_BYTES = 256 << 20
+READ_CHUNK = 8 << 20
+
+
+def is_packed(path):
+    return os.path.isfile(os.path.join(path, INDEX_NAME)) and os.path.isfile(os.path.join(path, "shard-00000.tar"))
+
+
+def scan_classes(root, image_extensions=IMAGE_EXTENSIONS):
+    """Every folder under `root` that directly holds images, by folder name: {class: sorted paths} (one walk)."""
+    classes = {}
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        images = sorted(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(image_extensions))
+        if images:
+            classes.setdefault(os.path.basename(dirpath), []).extend(images)
+    return dict(sorted(classes.items()))
+
+
+def pack_classes(classes, out_dir, root, shard_bytes=SHARD_BYTES):
+    """
+    Write {class: [image paths under `root`]} as tar shards of about
+    `shard_bytes` each. Members are named by their path relative to `root`,
+    so folders of the same name in different corpora stay apart. Images are
+    stored as-is (no re-encoding). Returns the index.
+    """
+    names = sorted(classes)
+    members = {}
+    for name in names:
+        for path in classes[name]:
+            member = os.path.relpath(path, root).replace(os.sep, "/")
+            if member.startswith("../"):
+                raise ValueError(f"{path} is not under {root}")
+            if member in members:
+                raise ValueError(f"{path} and {members[member]} would both be packed as {member}")
+            members[member] = path
+    os.makedirs(out_dir, exist_ok=True)
+    index = {"version": 1, "classes": names, "shards": [], "samples": []}
+    tar = None
+    shard_size = 0
+    start = time.perf_counter()
+    total_bytes = 0
+    for label, name in enumerate(names):
+        for path in classes[name]:
+            if tar is None or shard_size >= shard_bytes:
+                if tar is not None:
+                    tar.close()
+                shard = f"shard-{len(index['shards']):05d}.tar"
+                index["shards"].append(shard)
+                tar = tarfile.open(os.path.join(out_dir, shard + ".tmp"), "w", format=tarfile.GNU_FORMAT)
+                shard_size = 0
+            with open(path, "rb") as f:
+                data = f.read()
+            member = os.path.relpath(path, root).replace(os.sep, "/")
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = int(os.path.getmtime(path))
+            tar.addfile(info, io.BytesIO(data))
+            # the data sits just before the padding to the next 512-byte block
+            offset = tar.offset - (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+            index["samples"].append([len(index["shards"]) - 1, offset, len(data), label,
+                                     hashlib.sha1(data).hexdigest(), member])
+            shard_size = tar.offset
+            total_bytes += len(data)
+    if tar is not None:
+        tar.close()
+    for shard in index["shards"]:
+        os.replace(os.path.join(out_dir, shard + ".tmp"), os.path.join(out_dir, shard))
+    with open(os.path.join(out_dir, INDEX_NAME + ".tmp"), "w") as f:
+        json.dump(index, f)
+    os.replace(os.path.join(out_dir, INDEX_NAME + ".tmp"), os.path.join(out_dir, INDEX_NAME))
+    seconds = time.perf_counter() - start
+    print(f"✅ Packed {len(index['samples'])} images ({total_bytes / 1e6:.0f} MB, {len(names)} classes) into "
+          f"{len(index['shards'])} shard(s) in {seconds:.1f}s -> {out_dir}")
+    return index
+
+
+class PackedDataset:
+    """Reader for a pack_classes() directory: random access by position, or sequential streaming."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            index = json.load(f)
+        self.classes = index["classes"]
+        self.shards = index["shards"]
+        self.samples = index["samples"]
+        self.labels = [row[3] for row in self.samples]
+        self.mtime_ns = os.stat(os.path.join(path, INDEX_NAME)).st_mtime_ns
+        self._fds = {}  # shard -> fd, opened per process
+        self._positions = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_fds"] = {}
+        return state
+
+    def close(self):
+        """Close the shard files opened by read()."""
+        fds, self._fds = getattr(self, "_fds", {}), {}
+        for fd in fds.values():
+            os.close(fd)
+
+    def __del__(self):
+        self.close()
+
+    def name(self, i):
+        return self.samples[i][5]
+
+    def position(self, name):
+        """Sample position of member `name` (its path under the packed root, '/'-separated)."""
+        if self._positions is None:
+            self._positions = {row[5]: i for i, row in enumerate(self.samples)}
+        return self._positions[name]
+
+    def member_paths(self):
+        """{folder under the packed root: [<dir>/<folder>/<name> paths]} in shard order."""
+        out = {}
+        for row in self.samples:
+            out.setdefault(os.path.dirname(row[5]), []).append(os.path.join(self.path, row[5]))
+        return out
+
+    def sha1(self, i):
+        return self.samples[i][4]
+
+    def read(self, i):
+        """Bytes of image `i` (one positional read; safe from several threads)."""
+        shard, offset, size = self.samples[i][:3]
+        fd = self._fds.get(shard)
+        if fd is None:
+            fd = self._fds[shard] = os.open(os.path.join(self.path, self.shards[shard]), os.O_RDONLY)
+        return os.pread(fd, size, offset)
+
+    def stream(self, indices=None):
+        """
+        Yield (i, bytes) for `indices` (default: all) in shard / offset order,
+        reading each shard sequentially in READ_CHUNK pieces.
+        """
+        order = sorted(range(len(self.samples)) if indices is None else indices, key=lambda i: self.samples[i][:2])
+        pos = 0
+        while pos < len(order):
+            shard = self.samples[order[pos]][0]
+            with open(os.path.join(self.path, self.shards[shard]), "rb", buffering=0) as f:
+                buf, buf_start = b"", 0
+                while pos < len(order) and self.samples[order[pos]][0] == shard:
+                    i = order[pos]
+                    offset, size = self.samples[i][1:3]
+                    if offset < buf_start or offset + size > buf_start + len(buf):
+                        if buf_start <= offset <= buf_start + len(buf):
+                            keep = buf[offset - buf_start:]  # the file is already positioned after it
+                        else:
+                            keep = b""
+                            f.seek(offset)
+                        buf, buf_start = keep + f.read(max(READ_CHUNK, size) - len(keep)), offset
+                    yield i, buf[offset - buf_start: offset - buf_start + size]
+                    pos += 1
+
+
+# -------------------------------
+# paths inside packed directories
+# -------------------------------
+_OPENED = {}
+
+
+def open_packed(path):
+    """PackedDataset for `path`, opened once per process."""
+    dataset = _OPENED.get(path)
+    if dataset is None:
+        dataset = _OPENED[path] = PackedDataset(path)
+    return dataset
+
+
+def _parents(path):
+    parent = os.path.dirname(path)
+    while parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
+
+
+def packed_root(path):
+    """The packed directory `path` lies in (nearest enclosing one), else None."""
+    return next((parent for parent in _parents(path) if parent in _OPENED or is_packed(parent)), None)
+
+
+def packed_member(path):
+    """(PackedDataset, position) when `path` is <packed dir>/<member name>, else None."""
+    # inside an already opened packed directory: resolved without touching the filesystem
+    root = next((parent for parent in _parents(path) if parent in _OPENED), None) if _OPENED else None
+    if root is None:
+        if os.path.exists(path):
+            return None
+        root = packed_root(path)
+        if root is None:
+            return None
+    dataset = open_packed(root)
+    return dataset, dataset.position(os.path.relpath(path, root).replace(os.sep, "/"))
+
+
+def read_bytes(path):
+    member = packed_member(path)
+    if member is None:
+        with open(path, "rb") as f:
+            return f.read()
+    dataset, i = member
+    return dataset.read(i)
+
+
+def open_source(path):
+    """Something Image.open() takes: the path itself, or the packed image's bytes."""
+    member = packed_member(path)
+    if member is None:
+        return path
+    dataset, i = member
+    return io.BytesIO(dataset.read(i))
+
+
+def source_stat(path):
+    """(size, mtime_ns) of a file, or of a packed image (the index mtime)."""
+    member = packed_member(path)
+    if member is None:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    dataset, i = member
+    return dataset.samples[i][2], dataset.mtime_ns
+
+
+# -------------------------------
+# CLI: pack / loose-vs-packed read benchmark
+# -------------------------------
+def evict_page_cache(paths):
+    """Ask the kernel to drop cached pages of `paths` (no root needed), so reads hit the disk."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack class folders into tar shards, or compare read speed")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pack = sub.add_parser("pack", help="pack every image folder under --root (folder name = class)")
+    pack.add_argument("--root", required=True)
+    pack.add_argument("--out", required=True)
+    pack.add_argument("--shard-mb", type=int, default=SHARD_BYTES >> 20)
+    bench = sub.add_parser("bench", help="walk + read the loose files vs stream the packed copy")
+    bench.add_argument("--root", required=True)
+    bench.add_argument("--packed", required=True)
+    bench.add_argument("--cold", action="store_true", help="drop both copies from the page cache first")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack_classes(scan_classes(args.root), args.out, args.root, args.shard_mb << 20)
+        return
+
+    if args.cold:
+        dataset = PackedDataset(args.packed)
+        evict_page_cache([p for paths in scan_classes(args.root).values() for p in paths] +
+                         [os.path.join(args.packed, shard) for shard in dataset.shards])
+    start = time.perf_counter()
+    files = [p for paths in scan_classes(args.root).values() for p in paths]
+    total = 0
+    for path in files:
+        with open(path, "rb") as f:
+            total += len(f.read())
+    loose = time.perf_counter() - start
+    start = time.perf_counter()
+    dataset = PackedDataset(args.packed)
+    packed_total = sum(len(data) for _, data in dataset.stream())
+    packed = time.perf_counter() - start
+    print(f"loose  {len(files)} files, {total / 1e6:.0f} MB in {loose:.2f}s ({len(files) / loose:.0f} img/s)")
+    print(f"packed {len(dataset)} images, {packed_total / 1e6:.0f} MB in {packed:.2f}s ({len(dataset) / packed:.0f} img/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Content-addressed prediction cache for the disease services.
+
+Farmers often re-send the exact same photo (retries on a flaky connection).
+Entries are keyed on a BLAKE2b digest of the raw upload bytes plus the crop
+and the model version. The value is the probability row, so the response is
+formatted again per request (threshold / top_k still apply) and a hit never
+touches PIL or torch.
+
+Memory tier: LRU-evicted OrderedDict, `max_entries` rows.
+Disk tier (optional): one SQLite file, so hits survive restarts and are
+shared between worker processes on the same host; trimmed to
+`disk_max_entries` by least recent access.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def image_digest(data: bytes) -> str:
+    """128-bit BLAKE2b of the upload bytes (hashlib releases the GIL on large inputs)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class DiskTier:
+    TRIM_EVERY = 256  # puts between size checks
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, probs BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)")
+        self._conn.commit()
+        self._puts = 0
+        self.trimmed = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT probs FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def put(self, key, probs):
+        blob = np.asarray(probs, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)", (key, blob, time.time()))
+            self._puts += 1
+            if self._puts % self.TRIM_EVERY == 0:
+                self._trim()
+            self._conn.commit()
+
+    def _trim(self):
+        size = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        excess = size - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY accessed LIMIT ?)", (excess,)
+            )
+            self.trimmed += excess
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PredictionCache:
+    def __init__(self, max_entries=2048, disk_path=None, disk_max_entries=100000):
+        """
+        max_entries:      in-memory LRU capacity (0 disables the cache entirely).
+        disk_path:        SQLite file for the optional disk tier (None = memory only).
+        disk_max_entries: rows kept on disk.
+        """
+        self.max_entries = max(0, int(max_entries))
+        self.disk = DiskTier(disk_path, disk_max_entries) if (disk_path and self.max_entries) else None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(crop, version, digest):
+        return f"{crop}|{version}|{digest}"
+
+    def get(self, key):
+        """Memory tier only: cached probability row, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            probs = self._entries.get(key)
+            if probs is None:
+                if self.disk is None:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return probs
+
+    def get_disk(self, key):
+        """Disk tier lookup after a memory miss (blocking; run it off the event loop)."""
+        probs = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if probs is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, probs)
+        return probs
+
+    def put(self, key, probs):
+        """Memory tier only; pair with put_disk when the disk tier is on."""
+        if self.enabled:
+            self._remember(key, np.array(probs, dtype=np.float32))
+
+    def put_disk(self, key, probs):
+        if self.disk is not None:
+            self.disk.put(key, probs)
+
+    def _remember(self, key, probs):
+        with self._lock:
+            self._entries[key] = probs
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "disk": {"path": self.disk.path, "size": self.disk.size(), "max_entries": self.disk.max_entries,
+                     "trimmed": self.disk.trimmed} if self.disk is not None else None,
+        }
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Allocation-light image decode + preprocessing for disease inference.
+
+Equivalent to `Resize((224, 224)) + ToTensor()` on an RGB PIL image, but:
+
+- JPEGs are decoded at reduced size with PIL's `draft()` (libjpeg DCT scaling
+  by 1/2, 1/4 or 1/8), so a 12MP phone photo never gets fully decoded;
+- preprocessing stops at a uint8 (3, H, W) tensor. The float conversion and
+  /255 scaling happen once per batch in `to_float_batch`, into a per-thread
+  buffer that is reused across batches.
+"""
+import io
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGE_SIZE = (224, 224)
+
+
+def decode_image(data: bytes, size=IMAGE_SIZE) -> Image.Image:
+    """Decode bytes to an RGB image resized to `size` (width, height)."""
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG":
+        # let libjpeg downscale while decoding; result is still >= size
+        img.draft("RGB", size)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != tuple(size):
+        img = img.resize(size, Image.BILINEAR)
+    return img
+
+
+def image_to_uint8_tensor(img: Image.Image) -> torch.Tensor:
+    """RGB PIL image -> contiguous uint8 (3, H, W) tensor."""
+    arr = np.asarray(img, dtype=np.uint8)
+    return torch.from_numpy(np.ascontiguousarray(arr.transpose(2, 0, 1)))
+
+
+def load_image_tensor(data: bytes, size=IMAGE_SIZE) -> torch.Tensor:
+    """Bytes -> uint8 (3, H, W) tensor ready for `to_float_batch`."""
+    return image_to_uint8_tensor(decode_image(data, size))
+
+
+_buffers = threading.local()
+
+
+def _buffer(name, shape, dtype):
+    """Per-thread scratch tensor, grown as needed and sliced to `shape`."""
+    buf = getattr(_buffers, name, None)
+    if buf is None or buf.dtype != dtype or buf.shape[1:] != shape[1:] or buf.shape[0] < shape[0]:
+        buf = torch.empty(shape, dtype=dtype)
+        setattr(_buffers, name, buf)
+    return buf[: shape[0]]
+
+
+def to_float_batch(images) -> torch.Tensor:
+    """
+    Stack images into one (N, 3, H, W) float32 batch in [0, 1].
+
+    uint8 inputs are stacked into a reused uint8 buffer and scaled with one
+    vectorized divide into a reused float buffer. The returned tensor is only
+    valid until the same thread builds its next batch. Float inputs (already
+    ToTensor()-style) are simply stacked.
+    """
+    first = images[0]
+    if first.dtype != torch.uint8:
+        return torch.stack(images)
+    shape = (len(images),) + tuple(first.shape)
+    stacked = torch.stack(images, out=_buffer("uint8", shape, torch.uint8))
+    return torch.div(stacked, 255.0, out=_buffer("float32", shape, torch.float32))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Multi-process launcher for the disease API.
+
+One listening socket is opened here and handed to N worker processes, each
+running its own uvicorn server (the same arrangement `uvicorn --workers` uses),
+but every worker also gets:
+
+- a fixed torch intra-op / inter-op thread count, so N workers x T threads
+  never oversubscribe the machine (torch defaults to one thread per core
+  in every process);
+- an optional CPU affinity slice (worker i gets cores [i*T, (i+1)*T)), so
+  each worker's threads stay on their own cores and caches;
+- a decode pool sized to its share of the cores.
+
+Checkpoints are loaded with torch.load(mmap=True) + load_state_dict(assign=True)
+(DISEASE_SHARE_WEIGHTS, on by default on CPU), so the weight tensors of every
+worker point into the same page-cache pages instead of N private copies.
+
+    python serving.py --app check:app --workers 4 --threads 2 --pin --port 8001
+
+Find the best workers/threads split for a machine with benchmark_serving.py.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def apply_torch_threads(threads=None, interop_threads=None):
+    """
+    Apply DISEASE_TORCH_THREADS / DISEASE_TORCH_INTEROP_THREADS (or the given
+    values) to torch. Must run before the first parallel torch op; 0/unset keeps
+    torch's defaults.
+    """
+    import torch
+
+    threads = int(threads if threads is not None else os.environ.get("DISEASE_TORCH_THREADS", "0"))
+    interop_threads = int(interop_threads if interop_threads is not None
+                          else os.environ.get("DISEASE_TORCH_INTEROP_THREADS", "0"))
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # can only be set once per process, before any inter-op work
+            pass
+    return torch.get_num_threads()
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_slices(workers, threads, cores=None):
+    """Worker i -> its list of cores (wraps around when workers x threads > cores)."""
+    cores = cores or available_cores()
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+
+
+def worker_environment(threads, interop_threads):
+    """Env for a worker: thread counts must be in place before torch is imported."""
+    env = {name: str(threads) for name in THREAD_ENV_VARS}
+    env["DISEASE_TORCH_THREADS"] = str(threads)
+    env["DISEASE_TORCH_INTEROP_THREADS"] = str(interop_threads)
+    env["DISEASE_DECODE_WORKERS"] = os.environ.get("DISEASE_DECODE_WORKERS", str(threads))
+    return env
+
+
+def run_worker(index, app_path, sock, cores, env, log_level):
+    os.environ.update(env)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    apply_torch_threads()
+
+    import uvicorn
+
+    config = uvicorn.Config(app_path, log_level=log_level, timeout_keep_alive=30)
+    server = uvicorn.Server(config)
+    print(f"[INFO] Worker {index} (pid {os.getpid()}) threads={env['DISEASE_TORCH_THREADS']} "
+          f"cores={cores or 'any'}")
+    server.run(sockets=[sock])
+
+
+def serve(app_path, host, port, workers, threads, interop_threads, pin, log_level="info"):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    slices = core_slices(workers, threads) if pin else [None] * workers
+    env = worker_environment(threads, interop_threads)
+    context = multiprocessing.get_context("spawn")
+
+    def start(i):
+        process = context.Process(target=run_worker, args=(i, app_path, sock, slices[i], env, log_level),
+                                  name=f"disease-worker-{i}")
+        process.start()
+        return process
+
+    processes = [start(i) for i in range(workers)]
+    print(f"✅ Serving {app_path} on http://{host}:{port} with {workers} worker(s) x {threads} torch thread(s)"
+          f"{' (pinned)' if pin else ''}")
+
+    stopping = []
+
+    def shutdown(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    # supervise: restart workers that die unexpectedly
+    while not stopping:
+        time.sleep(0.5)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                print(f"[WARN] Worker {i} exited with code {process.exitcode}; restarting.")
+                processes[i] = start(i)
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout=10)
+    sock.close()
+
+
+def main():
+    cores = len(available_cores())
+    parser = argparse.ArgumentParser(description="Run the disease API with N tuned worker processes")
+    parser.add_argument("--app", default=os.environ.get("DISEASE_APP", "check:app"))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("DISEASE_WORKERS", "1")))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("DISEASE_WORKER_THREADS", "0")),
+                        help="torch intra-op threads per worker (0 = cores / workers)")
+    parser.add_argument("--interop-threads", type=int, default=1)
+    parser.add_argument("--pin", action="store_true", default=os.environ.get("DISEASE_PIN_WORKERS") == "1",
+                        help="pin each worker to its own slice of cores")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, cores // max(1, args.workers))
+    # the app modules load weights by relative path
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    serve(args.app, args.host, args.port, max(1, args.workers), threads, args.interop_threads, args.pin, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
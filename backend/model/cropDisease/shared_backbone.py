@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Serve several crops from ONE mobilevit_xxs feature extractor with a small
+per-crop classifier head (Linear, 320 -> n_classes).
+
+The backbone comes from one crop's checkpoint (DISEASE_SHARED_BACKBONE, e.g.
+"rice") and is loaded once. Heads are loaded lazily the first time a crop is
+scored:
+
+- the backbone crop uses its own head;
+- another crop uses a head refitted on the shared backbone's features
+  (`<weights>.<backbone id>.<n>cls.head.pt`, written by `fit-head` below);
+- a crop with no refitted head falls back to its own full model, loaded
+  on first use, with a warning. Its checkpoint was trained end-to-end, so
+  its original head is meaningless on another backbone's features.
+
+Refit a head from an ImageFolder-style directory (one subfolder per class).
+Folders are matched to the crop's served classes (CROP_MODELS[crop]["classes"])
+by name, optionally through a {folder: class} JSON map; a folder that maps to
+no served class is an error. Part of each class is held out and the held-out
+accuracy is reported:
+    python shared_backbone.py fit-head --backbone rice --crop corn --images /data/corn/train --class-map corn_map.json
+"""
+import argparse
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+
+import torch
+
+HEAD_SUFFIX = ".head.pt"
+
+
+def backbone_signature(backbone) -> str:
+    """Short content hash of a backbone (classifier already reset) to key fitted heads."""
+    digest = hashlib.sha1()
+    for name, tensor in backbone.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+
+def split_model(model):
+    """Full timm classifier -> (backbone returning pooled features, copy of its Linear head)."""
+    head = copy.deepcopy(model.get_classifier())
+    model.reset_classifier(0)
+    return model, head
+
+
+def head_path(weights_path, signature, num_classes):
+    return f"{os.path.splitext(weights_path)[0]}.{signature}.{num_classes}cls{HEAD_SUFFIX}"
+
+
+def save_head(head, path, crop, signature):
+    torch.save({"crop": crop, "backbone": signature, "state_dict": head.state_dict()}, path)
+
+
+def load_head(path):
+    saved = torch.load(path, map_location="cpu")
+    weight = saved["state_dict"]["weight"]
+    head = torch.nn.Linear(weight.shape[1], weight.shape[0])
+    head.load_state_dict(saved["state_dict"])
+    return head
+
+
+class SharedBackboneModel:
+    """
+    crops:           {crop: (checkpoint path, number of classes served)}
+    load_full_model: callable(crop) -> fp32 eager classifier for that crop on CPU
+                     (checkpoint adaptation already applied, e.g. check.load_crop_model)
+    """
+
+    def __init__(self, backbone_crop, crops, load_full_model, device):
+        if backbone_crop not in crops:
+            raise ValueError(f"Shared backbone crop '{backbone_crop}' is not one of {list(crops)}")
+        self.backbone_crop = backbone_crop
+        self.crops = dict(crops)
+        self.load_full_model = load_full_model
+        self.device = device
+        self.backbone = None
+        self.signature = None
+        self.heads = {}
+        self.dedicated = {}
+        self.load_seconds = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        start = time.perf_counter()
+        backbone, head = split_model(self.load_full_model(self.backbone_crop))
+        self.signature = backbone_signature(backbone)
+        self.backbone = backbone.to(self.device).eval()
+        self.heads[self.backbone_crop] = head.to(self.device).eval()
+        self.load_seconds[self.backbone_crop] = time.perf_counter() - start
+        print(f"[OK] Shared backbone from '{self.backbone_crop}' loaded (id {self.signature}).")
+        return self
+
+    def _load_crop(self, crop):
+        start = time.perf_counter()
+        weights_path, num_classes = self.crops[crop]
+        path = head_path(weights_path, self.signature, num_classes)
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(weights_path):
+            self.heads[crop] = load_head(path).to(self.device).eval()
+            print(f"[OK] Loaded '{crop}' head for the shared backbone from '{path}'.")
+        else:
+            print(f"[WARN] No head fitted for '{crop}' on the shared '{self.backbone_crop}' backbone ({path}); "
+                  f"serving its dedicated model. Run `python shared_backbone.py fit-head --crop {crop} ...` to share.")
+            self.dedicated[crop] = self.load_full_model(crop).to(self.device).eval()
+        self.load_seconds[crop] = time.perf_counter() - start
+
+    def ensure_loaded(self, crop):
+        if crop in self.heads or crop in self.dedicated:
+            return
+        with self._lock:
+            if crop not in self.heads and crop not in self.dedicated:
+                # real (non-inference) tensors even when first hit from an inference_mode forward
+                with torch.inference_mode(False):
+                    self._load_crop(crop)
+
+    def forward(self, crop, x):
+        self.ensure_loaded(crop)
+        if crop in self.dedicated:
+            return self.dedicated[crop](x)
+        return self.heads[crop](self.backbone(x))
+
+    def version_files(self, crop):
+        """Files whose contents decide this crop's outputs in shared mode."""
+        weights_path, num_classes = self.crops[crop]
+        files = [self.crops[self.backbone_crop][0]]
+        if crop != self.backbone_crop:
+            files += [weights_path, head_path(weights_path, self.signature, num_classes)]
+        return files
+
+    def unload(self, crop):
+        """Drop a crop's head or dedicated model (the backbone crop's own head stays)."""
+        with self._lock:
+            if crop != self.backbone_crop:
+                self.heads.pop(crop, None)
+            self.dedicated.pop(crop, None)
+
+    def view(self, crop):
+        return CropView(self, crop)
+
+    def stats(self):
+        return {
+            "backbone_crop": self.backbone_crop,
+            "backbone_id": self.signature,
+            "shared_heads": sorted(self.heads),
+            "dedicated_models": sorted(self.dedicated),
+            "not_loaded": sorted(c for c in self.crops if c not in self.heads and c not in self.dedicated),
+            "load_seconds": {c: round(s, 3) for c, s in self.load_seconds.items()},
+        }
+
+
+class CropView(torch.nn.Module):
+    """nn.Module facade for one crop so the batcher can call it like a regular model."""
+
+    def __init__(self, shared, crop):
+        super().__init__()
+        self.shared = shared
+        self.crop = crop
+
+    def forward(self, x):
+        return self.shared.forward(self.crop, x)
+
+
+# -------------------------------
+# Head refitting
+# -------------------------------
+def image_folder_samples(root):
+    """(path, class index) pairs; classes are the sorted subfolder names, as torchvision's ImageFolder does."""
+    from model_variants import list_images
+
+    classes = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    samples = [(path, index) for index, name in enumerate(classes) for path in list_images(os.path.join(root, name))]
+    return classes, samples
+
+
+def served_class_samples(root, served_classes, class_map=None):
+    """
+    (path, head row) pairs with each class folder mapped to its row in
+    `served_classes` by name (through `class_map` first). Folders that map to
+    no served class raise ValueError.
+    """
+    class_map = class_map or {}
+    folders, samples = image_folder_samples(root)
+    rows = {}
+    for name in folders:
+        target = class_map.get(name, name)
+        if target in served_classes:
+            rows[name] = served_classes.index(target)
+    unmapped = [name for name in folders if name not in rows]
+    if unmapped:
+        raise ValueError(f"Class folders {unmapped} match none of the served classes {list(served_classes)}; "
+                         f"rename them or map them with --class-map")
+    return {name: rows[name] for name in folders}, [(path, rows[folders[index]]) for path, index in samples]
+
+
+def holdout_split(labels, fraction, seed=0):
+    """Indices (train, held out): `fraction` of every class (at least one image if it has two) is held out."""
+    generator = torch.Generator().manual_seed(seed)
+    train, held_out = [], []
+    for label in labels.unique().tolist():
+        members = (labels == label).nonzero().flatten()
+        members = members[torch.randperm(len(members), generator=generator)]
+        n = int(round(len(members) * fraction))
+        if fraction > 0 and len(members) > 1:
+            n = max(n, 1)
+        held_out.append(members[:n])
+        train.append(members[n:])
+    return torch.cat(train), torch.cat(held_out)
+
+
+@torch.no_grad()
+def extract_features(backbone, paths, batch_size=32):
+    from preprocessing import load_image_tensor, to_float_batch
+
+    features = []
+    for i in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[i: i + batch_size]:
+            with open(path, "rb") as f:
+                tensors.append(load_image_tensor(f.read()))
+        features.append(backbone(to_float_batch(tensors)))
+    return torch.cat(features)
+
+
+def fit_head(head, features, labels, epochs=200, lr=1e-2, weight_decay=1e-4):
+    """Full-batch Adam on cached backbone features. Returns train accuracy."""
+    head = head.train()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=weight_decay)
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = torch.nn.functional.cross_entropy(head(features), labels)
+        loss.backward()
+        optimizer.step()
+    head.eval()
+    with torch.no_grad():
+        return float((head(features).argmax(1) == labels).float().mean())
+
+
+def main():
+    from check import CROP_MODELS, load_crop_model
+
+    parser = argparse.ArgumentParser(description="Shared-backbone heads for the disease models")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit = sub.add_parser("fit-head", help="refit a crop's head on another crop's backbone")
+    fit.add_argument("--backbone", default="rice", choices=sorted(CROP_MODELS))
+    fit.add_argument("--crop", required=True, choices=sorted(CROP_MODELS))
+    fit.add_argument("--images", required=True, help="ImageFolder-style directory of labeled images")
+    fit.add_argument("--class-map", default="", help="JSON {folder name: served class} for folders named differently")
+    fit.add_argument("--holdout", type=float, default=0.2, help="fraction of each class held out for evaluation")
+    fit.add_argument("--seed", type=int, default=0)
+    fit.add_argument("--epochs", type=int, default=200)
+    fit.add_argument("--lr", type=float, default=1e-2)
+    args = parser.parse_args()
+
+    cpu = torch.device("cpu")
+    backbone, _ = split_model(load_crop_model(args.backbone, CROP_MODELS[args.backbone], cpu))
+    signature = backbone_signature(backbone)
+    _, head = split_model(load_crop_model(args.crop, CROP_MODELS[args.crop], cpu))
+
+    served = CROP_MODELS[args.crop]["classes"]
+    class_map = {}
+    if args.class_map:
+        with open(args.class_map) as f:
+            class_map = json.load(f)
+    try:
+        rows, samples = served_class_samples(args.images, served, class_map)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if not samples:
+        raise SystemExit(f"No images found under {args.images}")
+    if len(served) != head.out_features:
+        raise SystemExit(f"'{args.crop}' serves {len(served)} classes but its head has {head.out_features} outputs")
+    print(f"Class folders -> head row: {', '.join(f'{name} -> {row} ({served[row]})' for name, row in rows.items())}")
+
+    start = time.perf_counter()
+    features = extract_features(backbone, [p for p, _ in samples])
+    labels = torch.tensor([label for _, label in samples])
+    print(f"Extracted {len(samples)} feature vectors in {time.perf_counter() - start:.1f}s")
+
+    train, held_out = holdout_split(labels, args.holdout, args.seed)
+    torch.manual_seed(args.seed)
+    head.reset_parameters()
+    accuracy = fit_head(head, features[train], labels[train], epochs=args.epochs, lr=args.lr)
+    print(f"Train accuracy {accuracy:.3f} on {len(train)} images")
+    if len(held_out):
+        with torch.no_grad():
+            predicted = head(features[held_out]).argmax(1)
+        correct = predicted == labels[held_out]
+        for name, row in rows.items():
+            mask = labels[held_out] == row
+            if mask.any():
+                print(f"   - {name} ({served[row]}): {float(correct[mask].float().mean()):.3f} on {int(mask.sum())} held out")
+        print(f"Held-out accuracy {float(correct.float().mean()):.3f} on {len(held_out)} images")
+    path = head_path(CROP_MODELS[args.crop]["weights"], signature, head.out_features)
+    save_head(head, path, args.crop, signature)
+    print(f"✅ '{args.crop}' head fitted on the '{args.backbone}' backbone -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Resume checks of the training runner: checkpoint, resume, and the sample
+order of the rest of the epoch.
+
+    python -m pytest backend/model/cropDisease/test_train_runner.py
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import train_runner  # noqa: E402
+from train_runner import EarlyStopping, EpochSampler, TrainingRunner  # noqa: E402
+
+SIZE = 30
+SEED = 1
+
+
+def epoch_order(world_size, epoch, start=0):
+    """The epoch's global sample order as the ranks consume it from `start` (per rank) on."""
+    per_rank = []
+    for r in range(world_size):
+        sampler = EpochSampler(SIZE, seed=SEED, rank=r, world_size=world_size)
+        sampler.set_epoch(epoch, start)
+        per_rank.append(list(sampler))
+    return [i for step in zip(*per_rank) for i in step]
+
+
+def make_runner(tmp_path, monkeypatch, world_size):
+    monkeypatch.setattr(train_runner, "world_size", lambda: world_size)
+    runner = TrainingRunner.__new__(TrainingRunner)
+    runner.model = torch.nn.Linear(4, 2)
+    runner.optimizer = torch.optim.SGD(runner.model.parameters(), lr=0.1)
+    runner.scaler = None
+    runner.early_stopping = EarlyStopping()
+    runner.history = []
+    runner.pending_eval = runner.pending_eval_state = runner.eval_model = None
+    runner.args = SimpleNamespace(checkpoint_dir=str(tmp_path), keep_checkpoints=2, seed=SEED)
+    runner.sampler = EpochSampler(SIZE, seed=SEED, world_size=world_size)
+    runner.epoch, runner.epoch_offset, runner.global_step = 0, 0, 0
+    return runner
+
+
+def interrupt(tmp_path, monkeypatch, world_size, epoch, offset):
+    """Train `offset` samples per rank into `epoch`, checkpoint, and return what was consumed globally."""
+    runner = make_runner(tmp_path, monkeypatch, world_size)
+    runner.epoch, runner.epoch_offset, runner.global_step = epoch, offset, 7
+    runner.save_checkpoint()
+    return epoch_order(world_size, epoch)[: offset * world_size]
+
+
+def resume(tmp_path, monkeypatch, world_size):
+    runner = make_runner(tmp_path, monkeypatch, world_size)
+    assert runner.resume()
+    return runner
+
+
+def test_resume_same_world_size(tmp_path, monkeypatch):
+    torch.manual_seed(123)
+    done = interrupt(tmp_path, monkeypatch, world_size=2, epoch=3, offset=4)
+    expected_rng = torch.rand(3)
+
+    torch.manual_seed(999)
+    runner = resume(tmp_path, monkeypatch, world_size=2)
+    assert (runner.epoch, runner.epoch_offset, runner.global_step) == (3, 4, 7)
+    assert torch.equal(torch.rand(3), expected_rng)  # RNG streams continue where they stopped
+    assert done + epoch_order(2, 3, runner.epoch_offset) == epoch_order(2, 3)
+
+
+@pytest.mark.parametrize("old, offset, new", [(2, 6, 3), (4, 3, 2), (1, 12, 4), (3, 0, 2)])
+def test_resume_after_world_size_change(tmp_path, monkeypatch, old, offset, new):
+    done = interrupt(tmp_path, monkeypatch, world_size=old, epoch=1, offset=offset)
+    runner = resume(tmp_path, monkeypatch, world_size=new)
+    assert runner.epoch_offset * new == offset * old
+    # every sample of the epoch exactly once, in the order an uninterrupted run at the new size sees them
+    assert done + epoch_order(new, 1, runner.epoch_offset) == epoch_order(new, 1)
+
+
+def test_resume_refuses_an_unreachable_position(tmp_path, monkeypatch):
+    interrupt(tmp_path, monkeypatch, world_size=2, epoch=0, offset=5)
+    with pytest.raises(ValueError, match="resume with 2"):
+        resume(tmp_path, monkeypatch, world_size=3)
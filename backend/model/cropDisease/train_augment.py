@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Load-time class balancing and batch augmentation for training, instead of
+writing augmented JPEGs with data_preprocessing/dataaugument.py.
+
+- Class balance: the training sampler (train_runner.EpochSampler) draws each
+  epoch with replacement, weighting every image by 1 / (its class size), so
+  each class is drawn equally often in expectation. No files are written and
+  nothing is recompressed.
+- Augmentation runs on whole batches, after the uint8 -> float step, on the
+  training device:
+    random resized crop + flip / 90-degree rotation   one affine_grid + grid_sample per batch
+    color jitter (brightness, contrast, saturation)   per-sample factors, broadcast
+  Parameters are drawn per sample from the global torch RNG, which the
+  runner's checkpoints already save, so resumed runs augment identically.
+
+    python mobilevit_rice2.py --balance --augment
+    python train_augment.py --batch-size 32   # augment throughput
+"""
+import argparse
+import math
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# 2x2 output -> input maps: identity and the four dataaugument.py ops
+DIHEDRAL = torch.tensor([
+    [[1.0, 0.0], [0.0, 1.0]],    # identity
+    [[-1.0, 0.0], [0.0, 1.0]],   # horizontal flip
+    [[1.0, 0.0], [0.0, -1.0]],   # vertical flip
+    [[0.0, -1.0], [1.0, 0.0]],   # rotate 90
+    [[0.0, 1.0], [-1.0, 0.0]],   # rotate -90
+])
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def add_augment_args(parser):
+    parser.add_argument("--balance", action="store_true",
+                        help="draw training images with class-balanced weights (with replacement)")
+    parser.add_argument("--augment", action="store_true", help="random resized crop, flips/rotations and color jitter")
+    parser.add_argument("--crop-scale", type=float, default=0.6, help="smallest crop area (fraction of the image)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="brightness / contrast / saturation jitter strength")
+    return parser
+
+
+def class_balance_weights(targets):
+    """Per-sample weights 1 / (size of its class): every class gets the same total weight."""
+    targets = torch.as_tensor(targets, dtype=torch.long)
+    counts = torch.bincount(targets).double()
+    return (1.0 / counts)[targets]
+
+
+class BatchAugment(nn.Module):
+    """Random resized crop, flip / rotation and color jitter on a float [0, 1] (N, 3, H, W) batch."""
+
+    def __init__(self, crop_scale=0.6, ratio=(3 / 4, 4 / 3), jitter=0.2, dihedral=True):
+        super().__init__()
+        self.crop_scale = float(crop_scale)
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.jitter = float(jitter)
+        self.dihedral = bool(dihedral)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(crop_scale=args.crop_scale, jitter=args.jitter) if args.augment else None
+
+    def extra_repr(self):
+        return f"crop_scale={self.crop_scale}, jitter={self.jitter}, dihedral={self.dihedral}"
+
+    def sample_theta(self, n):
+        """(n, 2, 3) affine maps: flip/rotate the output grid, then scale it into a random crop."""
+        area = torch.empty(n).uniform_(self.crop_scale, 1.0)
+        ratio = torch.empty(n).uniform_(*self.log_ratio).exp()
+        width = (area * ratio).sqrt().clamp(max=1.0)
+        height = (area / ratio).sqrt().clamp(max=1.0)
+        # crop centers keep the crop inside the image (grid coordinates are in [-1, 1])
+        cx = (torch.rand(n) * 2 - 1) * (1 - width)
+        cy = (torch.rand(n) * 2 - 1) * (1 - height)
+        ops = torch.randint(len(DIHEDRAL) if self.dihedral else 1, (n,))
+        theta = torch.zeros(n, 2, 3)
+        theta[:, :, :2] = torch.stack([width, height], dim=1).unsqueeze(2) * DIHEDRAL[ops]
+        theta[:, 0, 2], theta[:, 1, 2] = cx, cy
+        return theta
+
+    def color_jitter(self, images):
+        n = images.size(0)
+        factors = (1 + (torch.rand(n, 3) * 2 - 1) * self.jitter).to(images.device, images.dtype)
+        brightness, contrast, saturation = (factors[:, i].view(n, 1, 1, 1) for i in range(3))
+        images = images * brightness
+        gray = (images * images.new_tensor(GRAY_WEIGHTS).view(1, 3, 1, 1)).sum(dim=1, keepdim=True)
+        mean = gray.mean(dim=(2, 3), keepdim=True)
+        images = (images - mean) * contrast + mean
+        gray = gray * contrast + mean * (1 - contrast)
+        images = (images - gray) * saturation + gray
+        return images.clamp_(0.0, 1.0)
+
+    @torch.no_grad()
+    def forward(self, images):
+        theta = self.sample_theta(images.size(0)).to(images.device, images.dtype)
+        grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+        images = F.grid_sample(images, grid, mode="bilinear", padding_mode="reflection", align_corners=False)
+        if self.jitter > 0:
+            images = self.color_jitter(images)
+        return images
+
+
+# -------------------------------
+# Throughput check
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Measure batch augmentation throughput")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--crop-scale", type=float, default=0.6)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    augment = BatchAugment(args.crop_scale, jitter=args.jitter)
+    images = torch.rand(args.batch_size, 3, args.size, args.size, device=device)
+    augment(images)  # warm-up
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        augment(images)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+    per_batch = seconds * 1000.0 / args.batches
+    print(f"✅ {augment}: {per_batch:.1f} ms/batch, {args.batch_size * args.batches / seconds:.0f} img/s on {device}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Training data pipeline for the MobileViT disease models.
+
+Decoding full-size phone JPEGs every epoch is what starves training, so each
+ImageFolder split is decoded once into a pre-resized cache:
+
+    <cache_dir>/<split>-<signature>-224px/
+        images.npy    uint8 (N, 3, H, W) array, memory-mapped when read
+        labels.npy    int64 class index per row (-1 = unreadable source)
+        meta.json     classes, source files, signature
+
+The decode runs on a process pool with the same reduced-size JPEG decode and
+bilinear resize the API uses (preprocessing.decode_image), so training sees
+the pixels serving sees. The signature covers every source path, size and
+mtime: adding or editing a photo makes a new cache, and reruns with an
+unchanged folder reuse the old one.
+
+The split may also be a packed directory (packed_dataset.py): the cache is
+then built from one sequential pass over its shards, decoded on the pool.
+
+Batches leave the loader as uint8 (4x less worker -> trainer traffic); the
+trainer scales them to [0, 1] floats on its side (`to_device_batch`), i.e.
+`Resize((224, 224)) + ToTensor()` as before.
+
+    python train_data.py --root "/data/rice_2_split/train" --cache-dir data_cache
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from packed_dataset import is_packed, open_packed, read_bytes, source_stat
+from preprocessing import IMAGE_SIZE, load_image_tensor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+
+def scan_image_folder(root):
+    """ImageFolder layout (or packed directory) -> (classes, [(path, class index)]), sorted like torchvision."""
+    if is_packed(root):
+        dataset = open_packed(root)
+        return dataset.classes, [(os.path.join(root, row[5]), row[3]) for row in dataset.samples]
+    classes = sorted(e.name for e in os.scandir(root) if e.is_dir())
+    samples = []
+    for index, name in enumerate(classes):
+        for dirpath, _, filenames in sorted(os.walk(os.path.join(root, name))):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(dirpath, filename), index))
+    return classes, samples
+
+
+def folder_signature(root, samples, size):
+    h = hashlib.sha1(repr(tuple(size)).encode())
+    for path, label in samples:
+        size, mtime_ns = source_stat(path)
+        h.update(f"{os.path.relpath(path, root)}|{label}|{size}|{mtime_ns}\n".encode())
+    return h.hexdigest()[:12]
+
+
+def _decode_row(args):
+    path, size = args
+    try:
+        return load_image_tensor(_read(path), size).numpy()
+    except Exception as e:
+        return str(e)
+
+
+def _decode_bytes(args):
+    data, size = args
+    try:
+        return load_image_tensor(data, size).numpy()
+    except Exception as e:
+        return str(e)
+
+
+def _read(path):
+    return read_bytes(path)
+
+
+def _decoded_rows(pool, root, samples, size, window=256, indices=None):
+    """
+    (row, decoded image or error) for every sample (or only the `indices`
+    rows). Packed splits are streamed shard by shard here and only
+    decoded on the pool; folders are read and decoded on the pool. Either
+    way at most `window` images are in flight, so memory stays bounded
+    however slowly the caller consumes them.
+    """
+    if is_packed(root):
+        jobs = ((i, _decode_bytes, data) for i, data in open_packed(root).stream(indices))
+    else:
+        rows = range(len(samples)) if indices is None else indices
+        jobs = ((i, _decode_row, samples[i][0]) for i in rows)
+    pending = collections.deque()
+    for i, fn, source in jobs:
+        pending.append((i, pool.submit(fn, (source, size))))
+        if len(pending) >= window:
+            i, future = pending.popleft()
+            yield i, future.result()
+    while pending:
+        i, future = pending.popleft()
+        yield i, future.result()
+
+
+def cache_path(root, cache_dir, signature, size):
+    split = os.path.basename(os.path.normpath(root)).replace(" ", "_")
+    return os.path.join(cache_dir, f"{split}-{signature}-{size[0]}px")
+
+
+def build_cache(root, cache_dir, size=IMAGE_SIZE, workers=None, rebuild=False):
+    """Decode `root` once into a uint8 memmap cache (or reuse a fresh one); returns the cache directory."""
+    size = tuple(size)
+    classes, samples = scan_image_folder(root)
+    if not samples:
+        raise ValueError(f"No images found under {root}")
+    signature = folder_signature(root, samples, size)
+    out = cache_path(root, cache_dir, signature, size)
+    if not rebuild and os.path.exists(os.path.join(out, "meta.json")):
+        return out
+
+    os.makedirs(out, exist_ok=True)
+    width, height = size
+    tmp = os.path.join(out, "images.tmp.npy")
+    images = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=(len(samples), 3, height, width))
+    labels = np.array([label for _, label in samples], dtype=np.int64)
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    failed = 0
+    print(f"[INFO] Caching {len(samples)} images from {root} at {width}x{height} ({workers} processes) ...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for done, (i, row) in enumerate(_decoded_rows(pool, root, samples, size), 1):
+            if isinstance(row, str):
+                print(f"[WARN] Skipping unreadable image {samples[i][0]}: {row}")
+                labels[i] = -1
+                failed += 1
+            else:
+                images[i] = row
+            if done % 1000 == 0:
+                print(f"  {done}/{len(samples)} ({done / (time.perf_counter() - start):.0f} img/s)")
+    images.flush()
+    del images
+
+    np.save(os.path.join(out, "labels.npy"), labels)
+    os.replace(tmp, os.path.join(out, "images.npy"))
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump({"root": os.path.abspath(root), "signature": signature, "size": list(size), "classes": classes,
+                   "files": [os.path.relpath(p, root) for p, _ in samples]}, f)
+    seconds = time.perf_counter() - start
+    print(f"✅ Cached {len(samples) - failed} images in {seconds:.1f}s -> {out}")
+    return out
+
+
+class CachedImageDataset(Dataset):
+    """Rows of a build_cache() directory as (uint8 (3, H, W) tensor, label)."""
+
+    def __init__(self, cache, transform=None):
+        with open(os.path.join(cache, "meta.json")) as f:
+            meta = json.load(f)
+        self.cache = cache
+        self.classes = meta["classes"]
+        self.labels = np.load(os.path.join(cache, "labels.npy"))
+        self.indices = np.flatnonzero(self.labels >= 0)
+        self.targets = self.labels[self.indices].tolist()
+        self.transform = transform
+        self._images = None  # opened lazily so every DataLoader worker maps the file itself
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _rows(self):
+        if self._images is None:
+            self._images = np.load(os.path.join(self.cache, "images.npy"), mmap_mode="r")
+        return self._images
+
+    def __getitem__(self, i):
+        row = int(self.indices[i])
+        image = torch.from_numpy(np.array(self._rows()[row]))
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.labels[row])
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_images"] = None
+        return state
+
+
+class FolderImageDataset(Dataset):
+    """Uncached fallback: decodes on the loader workers (reduced-size JPEG decode), same output as the cache."""
+
+    def __init__(self, root, size=IMAGE_SIZE, transform=None):
+        self.classes, self.samples = scan_image_folder(root)
+        self.targets = [label for _, label in self.samples]
+        self.size = tuple(size)
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, i):
+        path, label = self.samples[i]
+        image = load_image_tensor(_read(path), self.size)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, label
+
+
+def image_dataset(root, cache_dir=None, size=IMAGE_SIZE, workers=None, transform=None):
+    """Cached dataset when `cache_dir` is given (building it on first use), else decode-per-epoch."""
+    if cache_dir:
+        return CachedImageDataset(build_cache(root, cache_dir, size, workers), transform)
+    return FolderImageDataset(root, size, transform)
+
+
+def make_loader(dataset, batch_size=32, shuffle=False, workers=2, prefetch_factor=4, sampler=None, drop_last=False,
+                generator=None):
+    """
+    DataLoader with worker processes, prefetching and pinned memory when training on a GPU.
+    Loaders that do not shuffle get their own generator: starting them (e.g.
+    validation on its background thread) then never advances the global RNG
+    that training draws augmentations from.
+    """
+    workers = max(0, int(workers))
+    if generator is None and not shuffle:
+        generator = torch.Generator()
+    options = {}
+    if workers > 0:
+        options.update(persistent_workers=True, prefetch_factor=prefetch_factor)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=workers,
+        pin_memory=torch.cuda.is_available(),
+        drop_last=drop_last,
+        generator=generator,
+        **options,
+    )
+
+
+def to_device_batch(images, device):
+    """uint8 (N, 3, H, W) batch -> float32 in [0, 1] on `device` (ToTensor() scaling)."""
+    return images.to(device, non_blocking=True).float().div_(255.0)
+
+
+# -------------------------------
+# Cache build / loader throughput check
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Build the pre-resized training cache and measure loader speed")
+    parser.add_argument("--root", required=True, help="ImageFolder-style split directory or packed directory")
+    parser.add_argument("--cache-dir", default="data_cache")
+    parser.add_argument("--size", type=int, default=IMAGE_SIZE[0])
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader workers")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    size = (args.size, args.size)
+    build_cache(args.root, args.cache_dir, size, rebuild=args.rebuild)
+    for name, dataset in (("folder", FolderImageDataset(args.root, size)),
+                          ("cache", image_dataset(args.root, args.cache_dir, size))):
+        loader = make_loader(dataset, args.batch_size, shuffle=True, workers=args.workers)
+        start = time.perf_counter()
+        images = 0
+        for batch, _ in loader:
+            images += len(batch)
+        seconds = time.perf_counter() - start
+        print(f"{name:<7} {images} images in {seconds:.2f}s ({images / seconds:.0f} img/s, one epoch)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Resumable training runner for the disease models.
+
+- Checkpoints every `checkpoint_every` optimizer steps and at every epoch end.
+  A checkpoint holds the model, the optimizer (and GradScaler), the position
+  inside the epoch, the early-stopping state, and the python, numpy, torch
+  and CUDA RNG states. Files are written atomically and only the newest
+  `keep` are kept.
+- Resume is exact: each epoch's shuffle order comes from (seed, epoch), and
+  the sampler restarts at the sample where the checkpoint was taken.
+- Validation runs on a background thread on a snapshot of the weights, while
+  the next epoch trains. Early stopping acts on each result as it arrives,
+  at most one epoch late.
+- Whenever validation improves, the snapshot is written to `output` as a
+  plain state dict, the format check.py / diseasePrediction.py load.
+- Under DDP (distributed.py) every process trains its shard of the same
+  epoch order, validation runs on its own process group (so it never
+  interleaves with gradient all-reduces), and rank 0 alone writes files.
+  Checkpoints keep every rank's RNG state.
+"""
+import copy
+import glob
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+from distributed import all_gather_object, is_distributed, is_main, rank, world_size
+from train_data import make_loader
+from trainer import evaluate, format_epoch, train_one_epoch
+
+
+def add_runner_args(parser):
+    parser.add_argument("--checkpoint-dir", default="checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=200, help="optimizer steps between checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=2)
+    parser.add_argument("--resume", action="store_true", help="continue from the newest checkpoint in --checkpoint-dir")
+    parser.add_argument("--patience", type=int, default=3, help="epochs without improvement before stopping (0 = never)")
+    parser.add_argument("--min-delta", type=float, default=1e-3)
+    parser.add_argument("--monitor", choices=["val_loss", "val_acc"], default="val_loss")
+    parser.add_argument("--sync-eval", action="store_true", help="validate in the foreground instead of overlapping")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def atomic_save(obj, path):
+    tmp = f"{path}.tmp"
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def rng_state():
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class EpochSampler(Sampler):
+    """
+    Shuffled order fixed by (seed, epoch), optionally starting part-way through
+    (resume). With world_size > 1 each rank takes every world_size-th index;
+    the order is padded by wrapping so every rank gets the same count.
+    With `weights` (e.g. train_augment.class_balance_weights) each epoch is
+    `size` draws with replacement instead of a permutation.
+    """
+
+    def __init__(self, size, seed=0, shuffle=True, rank=0, world_size=1, weights=None):
+        self.size = size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.weights = torch.as_tensor(weights, dtype=torch.double) if weights is not None else None
+        self.rank = rank
+        self.world_size = max(1, world_size)
+        self.per_rank = math.ceil(size / self.world_size)
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def order(self):
+        generator = torch.Generator().manual_seed(self.seed * 100003 + self.epoch)
+        if self.weights is not None:
+            indices = torch.multinomial(self.weights, self.size, replacement=True, generator=generator).tolist()
+        elif self.shuffle:
+            indices = torch.randperm(self.size, generator=generator).tolist()
+        else:
+            indices = list(range(self.size))
+        total = self.per_rank * self.world_size
+        indices += indices[: total - self.size]
+        return indices[self.rank:total:self.world_size]
+
+    def __iter__(self):
+        return iter(self.order()[self.start:])
+
+    def __len__(self):
+        return self.per_rank - self.start
+
+
+class EarlyStopping:
+    def __init__(self, monitor="val_loss", patience=3, min_delta=1e-3):
+        self.monitor = monitor
+        self.patience = max(0, int(patience))
+        self.min_delta = float(min_delta)
+        self.best = None
+        self.best_epoch = None
+        self.bad_epochs = 0
+
+    def value(self, stats):
+        return stats["loss"] if self.monitor == "val_loss" else stats["accuracy"]
+
+    def update(self, epoch, stats):
+        """Record an epoch's validation stats; True if it is the new best."""
+        value = self.value(stats)
+        sign = -1.0 if self.monitor == "val_loss" else 1.0
+        if self.best is None or sign * (value - self.best) > self.min_delta:
+            self.best, self.best_epoch, self.bad_epochs = value, epoch, 0
+            return True
+        self.bad_epochs += 1
+        return False
+
+    @property
+    def should_stop(self):
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def state_dict(self):
+        return {"best": self.best, "best_epoch": self.best_epoch, "bad_epochs": self.bad_epochs}
+
+    def load_state_dict(self, state):
+        self.best, self.best_epoch, self.bad_epochs = state["best"], state["best_epoch"], state["bad_epochs"]
+
+
+class TrainingRunner:
+    def __init__(self, model, train_model, optimizer, criterion, settings, train_dataset, val_loader, args,
+                 scaler=None, output="model.pth", sample_weights=None, augment=None):
+        """
+        model:       the plain module (saved / evaluated)
+        train_model: what the loop calls (may be torch.compile(model))
+        args:        batch_size, workers, prefetch, epochs plus the add_runner_args() options
+        sample_weights / augment: class-balanced sampling and batch augmentation (train_augment.py)
+        """
+        self.model = model
+        self.train_model = train_model
+        self.optimizer = optimizer
+        self.criterion = criterion
+        self.settings = settings
+        self.scaler = scaler
+        self.val_loader = val_loader
+        self.output = output
+        self.args = args
+        self.augment = augment
+
+        self.sampler = EpochSampler(len(train_dataset), seed=args.seed, rank=rank(), world_size=world_size(),
+                                    weights=sample_weights)
+        # own generator for worker seeds, so starting the loader never shifts the global RNG
+        self.train_loader = make_loader(train_dataset, args.batch_size, workers=args.workers,
+                                        prefetch_factor=args.prefetch, sampler=self.sampler,
+                                        generator=torch.Generator().manual_seed(args.seed))
+        self.early_stopping = EarlyStopping(args.monitor, args.patience, args.min_delta)
+
+        self.epoch = 0          # current (0-based) epoch
+        self.epoch_offset = 0   # samples of the current epoch already trained
+        self.global_step = 0
+        self.history = []
+
+        # background validation on a snapshot of the weights
+        self.eval_model = copy.deepcopy(model) if val_loader is not None else None
+        self.eval_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="val") if val_loader is not None else None
+        self.pending_eval = None  # (epoch, future)
+        self.pending_eval_state = None
+        self.eval_group = dist.new_group(backend="gloo") if (is_distributed() and val_loader is not None) else None
+
+    def log(self, message):
+        if is_main():
+            print(message)
+
+    # -------------------------------
+    # checkpoints
+    # -------------------------------
+    def checkpoint_files(self):
+        return sorted(glob.glob(os.path.join(self.args.checkpoint_dir, "step-*.ckpt")))
+
+    def save_checkpoint(self):
+        """Collective under DDP (gathers every rank's RNG state); rank 0 writes."""
+        rng = all_gather_object(rng_state())
+        if not is_main():
+            return None
+        os.makedirs(self.args.checkpoint_dir, exist_ok=True)
+        path = os.path.join(self.args.checkpoint_dir, f"step-{self.global_step:09d}.ckpt")
+        atomic_save({
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scaler": self.scaler.state_dict() if self.scaler is not None else None,
+            "epoch": self.epoch,
+            "epoch_offset": self.epoch_offset,  # per rank
+            "world_size": world_size(),
+            "global_step": self.global_step,
+            "rng": rng,  # one entry per rank
+            "early_stopping": self.early_stopping.state_dict(),
+            "history": self.history,
+            # weights whose validation was still running, so resume can finish it
+            "pending_eval": (self.pending_eval[0], self.pending_eval_state) if self.pending_eval is not None else None,
+        }, path)
+        for old in self.checkpoint_files()[: -max(1, self.args.keep_checkpoints)]:
+            os.remove(old)
+        return path
+
+    def resume(self):
+        files = self.checkpoint_files()
+        if not files:
+            self.log(f"[INFO] No checkpoint in {self.args.checkpoint_dir}; starting fresh.")
+            return False
+        state = torch.load(files[-1], map_location="cpu", weights_only=False)
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        if self.scaler is not None and state["scaler"] is not None:
+            self.scaler.load_state_dict(state["scaler"])
+        self.epoch, self.epoch_offset = state["epoch"], state["epoch_offset"]
+        self.global_step = state["global_step"]
+        self.early_stopping.load_state_dict(state["early_stopping"])
+        self.history = state["history"]
+        rngs = state["rng"]
+        saved_world_size = state.get("world_size", len(rngs))
+        if saved_world_size != world_size():
+            self.epoch_offset = self.rescale_offset(self.epoch_offset, saved_world_size)
+            self.log(f"[WARN] Checkpoint was taken with {saved_world_size} process(es), now {world_size()}; "
+                     "RNG streams are not kept.")
+        set_rng_state(rngs[rank() % len(rngs)])
+        if state["pending_eval"] is not None and self.eval_model is not None:
+            epoch, weights = state["pending_eval"]
+            self.start_eval(epoch, weights)
+        self.log(f"[OK] Resumed from {files[-1]} (epoch {self.epoch + 1}, sample {self.epoch_offset}, "
+                 f"step {self.global_step}).")
+        return True
+
+    def rescale_offset(self, offset, saved_world_size):
+        """
+        Per-rank epoch offset for this world size. Ranks take every
+        world_size-th index, so `offset` samples on each of `saved_world_size`
+        ranks are exactly the first offset * saved_world_size of the epoch's
+        order; that position only maps back when this world size divides it.
+        """
+        position = offset * saved_world_size
+        if position % world_size() == 0 and position < self.sampler.size:
+            return position // world_size()
+        raise ValueError(f"Checkpoint stopped at sample {position} of epoch {self.epoch + 1} with "
+                         f"{saved_world_size} process(es), which {world_size()} process(es) cannot continue "
+                         f"from without replaying or skipping samples; resume with {saved_world_size}.")
+
+    # -------------------------------
+    # validation
+    # -------------------------------
+    def start_eval(self, epoch, weights=None):
+        self.wait_eval()  # one snapshot at a time; its early-stop verdict is read by run()
+        self.eval_model.load_state_dict(weights if weights is not None else self.model.state_dict())
+        self.pending_eval_state = {k: v.detach().clone() for k, v in self.eval_model.state_dict().items()}
+        future = self.eval_executor.submit(evaluate, self.eval_model, self.val_loader, self.settings, self.criterion,
+                                           self.eval_group)
+        self.pending_eval = (epoch, future)
+        if self.args.sync_eval:
+            self.wait_eval()
+
+    def wait_eval(self):
+        """
+        Collect the running validation, if any, and apply it to early stopping
+        (on this thread, so checkpoints never see half-applied results).
+        Returns True when early stopping triggers.
+        """
+        if self.pending_eval is None:
+            return False
+        epoch, future = self.pending_eval
+        stats = future.result()
+        improved = self.early_stopping.update(epoch, stats)
+        if improved and is_main():
+            # eval_model still holds that epoch's snapshot
+            atomic_save(self.eval_model.state_dict(), self.output)
+        self.pending_eval = self.pending_eval_state = None
+        for entry in self.history:
+            if entry["epoch"] == epoch:
+                entry["val"] = stats
+        best = f" ✅ new best -> {self.output}" if improved else f" (no improvement x{self.early_stopping.bad_epochs})"
+        self.log(f"  val epoch {epoch}: loss {stats['loss']:.4f}, acc {stats['accuracy']:.4f} "
+                 f"({stats['seconds']:.1f}s){best}")
+        return self.early_stopping.should_stop
+
+    # -------------------------------
+    # main loop
+    # -------------------------------
+    def _on_step(self, epoch_start_offset):
+        def on_step(steps, images_seen):
+            self.global_step += 1
+            self.epoch_offset = epoch_start_offset + images_seen
+            if self.args.checkpoint_every and self.global_step % self.args.checkpoint_every == 0:
+                self.save_checkpoint()
+        return on_step
+
+    def run(self, epochs):
+        start = time.perf_counter()
+        stopped = False
+        while self.epoch < epochs and not stopped:
+            epoch_number = self.epoch + 1
+            self.sampler.set_epoch(self.epoch, self.epoch_offset)
+            stats = train_one_epoch(self.train_model, self.train_loader, self.criterion, self.optimizer,
+                                    self.settings, self.scaler, on_step=self._on_step(self.epoch_offset),
+                                    augment=self.augment)
+            self.history.append({"epoch": epoch_number, "train": stats, "val": None})
+            self.log(format_epoch(epoch_number, epochs, stats))
+
+            # an earlier epoch's validation may have finished meanwhile (single
+            # process only: under DDP every rank must decide at the same point)
+            if self.pending_eval is not None and self.pending_eval[1].done() and not is_distributed():
+                stopped = self.wait_eval()
+            self.epoch, self.epoch_offset = self.epoch + 1, 0
+            if self.eval_model is not None and not stopped:
+                self.start_eval(epoch_number)
+                stopped = self.early_stopping.should_stop
+            elif self.eval_model is None and is_main():
+                atomic_save(self.model.state_dict(), self.output)
+            self.save_checkpoint()
+
+        if self.eval_model is not None:
+            stopped = self.wait_eval() or stopped
+            self.eval_executor.shutdown(wait=True)
+            self.save_checkpoint()
+        if stopped:
+            self.log(f"[INFO] Early stop: no {self.early_stopping.monitor} improvement for "
+                     f"{self.early_stopping.bad_epochs} epoch(s); best was epoch {self.early_stopping.best_epoch}.")
+        self.log(f"✅ Finished in {time.perf_counter() - start:.1f}s; serving weights in {self.output}")
+        return self.history
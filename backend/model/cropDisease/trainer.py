@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Performance-oriented training loop for the MobileViT disease models.
+
+- bf16 autocast (CPU and GPU; fp16 + GradScaler is available on GPU);
+- channels_last activations and weights (better oneDNN / cuDNN conv kernels);
+- optional torch.compile;
+- gradient accumulation (effective batch = batch size x accumulation steps);
+- loss and accuracy are summed on the device and read back once per epoch,
+  so the hot loop never blocks on `loss.item()`;
+- under DDP (distributed.py) the model is wrapped in DistributedDataParallel,
+  accumulation steps skip the gradient all-reduce, and epoch metrics are
+  summed over all processes.
+
+Every epoch reports its wall time and images/sec.
+"""
+import contextlib
+import time
+
+import torch
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+
+from distributed import all_reduce_sum, is_distributed
+from train_data import to_device_batch
+
+AMP_DTYPES = {"off": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def add_performance_args(parser):
+    parser.add_argument("--amp", choices=sorted(AMP_DTYPES), default="off",
+                        help="autocast dtype; bf16 works on CPU, fp16 only on GPU")
+    parser.add_argument("--channels-last", action="store_true", help="channels_last memory format")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the model")
+    parser.add_argument("--accum-steps", type=int, default=1, help="gradient accumulation steps")
+    return parser
+
+
+class TrainSettings:
+    def __init__(self, device, amp="off", channels_last=False, compile=False, accum_steps=1):
+        if amp == "fp16" and device.type != "cuda":
+            raise ValueError("--amp fp16 needs a GPU; use bf16 on CPU")
+        self.device = device
+        self.amp = amp
+        self.amp_dtype = AMP_DTYPES[amp]
+        self.channels_last = bool(channels_last)
+        self.compile = bool(compile)
+        self.accum_steps = max(1, int(accum_steps))
+
+    @classmethod
+    def from_args(cls, args, device):
+        return cls(device, args.amp, args.channels_last, args.compile, args.accum_steps)
+
+    def describe(self):
+        return (f"amp={self.amp} channels_last={self.channels_last} compile={self.compile} "
+                f"accum_steps={self.accum_steps} device={self.device}")
+
+    def autocast(self):
+        if self.amp_dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=self.amp_dtype)
+
+    def prepare_model(self, model):
+        """
+        Move `model` to the device (channels_last if asked). Returns
+        (model to call, model to save): DDP and torch.compile wrap the
+        module, but checkpoints should keep plain state-dict keys.
+        """
+        model = model.to(self.device)
+        if self.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        train_model = model
+        if is_distributed():
+            train_model = DistributedDataParallel(model, device_ids=[self.device.index] if self.device.type == "cuda" else None)
+        if self.compile:
+            train_model = torch.compile(train_model)
+        return train_model, model
+
+    def inputs(self, images, augment=None):
+        images = to_device_batch(images, self.device)
+        if augment is not None:
+            images = augment(images)
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return images
+
+    def grad_scaler(self):
+        return torch.amp.GradScaler("cuda") if self.amp == "fp16" else None
+
+
+def train_one_epoch(model, loader, criterion, optimizer, settings, scaler=None, on_step=None, augment=None):
+    """
+    One pass over `loader`. Returns {"loss", "accuracy", "images", "seconds",
+    "images_per_sec", "optimizer_steps"}. `on_step(step, epoch_images)` runs
+    after every optimizer step (checkpointing hooks etc.). `augment` is
+    applied to each batch on the device (train_augment.BatchAugment).
+    """
+    model.train()
+    device = settings.device
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    images_seen = 0
+    steps = 0
+    accum = settings.accum_steps
+    batches = len(loader)
+    ddp = getattr(model, "_orig_mod", model)
+    no_sync = ddp.no_sync if isinstance(ddp, DistributedDataParallel) else contextlib.nullcontext
+
+    start = time.perf_counter()
+    optimizer.zero_grad(set_to_none=True)
+    for i, (images, labels) in enumerate(loader):
+        images = settings.inputs(images, augment)
+        labels = labels.to(device, non_blocking=True)
+        step_now = (i + 1) % accum == 0 or (i + 1) == batches
+        # gradients are only all-reduced on the micro-batch that steps
+        with (contextlib.nullcontext() if step_now else no_sync()):
+            with settings.autocast():
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+            scaled = loss / accum
+            if scaler is not None:
+                scaler.scale(scaled).backward()
+            else:
+                scaled.backward()
+
+        loss_sum += loss.detach() * labels.size(0)
+        correct += (outputs.detach().argmax(dim=1) == labels).sum()
+        images_seen += labels.size(0)
+
+        if step_now:
+            if scaler is not None:
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            steps += 1
+            if on_step is not None:
+                on_step(steps, images_seen)
+
+    # the only host sync (and, under DDP, the only metrics collective) of the epoch
+    local_images = images_seen
+    loss_total, correct_total, images_seen = all_reduce_sum([loss_sum, correct, images_seen])
+    seconds = time.perf_counter() - start
+    return {
+        "loss": loss_total / max(1, images_seen),
+        "accuracy": correct_total / max(1, images_seen),
+        "images": int(images_seen),
+        "local_images": local_images,
+        "seconds": seconds,
+        "images_per_sec": images_seen / seconds if seconds else 0.0,
+        "optimizer_steps": steps,
+    }
+
+
+@torch.no_grad()
+def evaluate(model, loader, settings, criterion=None, group=None):
+    """
+    Validation / test pass: {"loss", "accuracy", "images", "seconds", "images_per_sec"}.
+    Under DDP each process scores its shard and the sums are reduced over `group`.
+    """
+    model.eval()
+    device = settings.device
+    criterion = criterion or nn.CrossEntropyLoss()
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    images_seen = 0
+
+    start = time.perf_counter()
+    for images, labels in loader:
+        images = settings.inputs(images)
+        labels = labels.to(device, non_blocking=True)
+        with settings.autocast():
+            outputs = model(images)
+            loss_sum += criterion(outputs.float(), labels) * labels.size(0)
+        correct += (outputs.argmax(dim=1) == labels).sum()
+        images_seen += labels.size(0)
+    loss_total, correct_total, images_seen = all_reduce_sum([loss_sum, correct, images_seen], group)
+    seconds = time.perf_counter() - start
+    return {
+        "loss": loss_total / max(1, images_seen),
+        "accuracy": correct_total / max(1, images_seen),
+        "images": int(images_seen),
+        "seconds": seconds,
+        "images_per_sec": images_seen / seconds if seconds else 0.0,
+    }
+
+
+def format_epoch(epoch, epochs, train, val=None):
+    line = (f"Epoch {epoch}/{epochs}, Loss: {train['loss']:.4f}, Acc: {train['accuracy']:.4f} "
+            f"| {train['seconds']:.1f}s, {train['images_per_sec']:.1f} img/s")
+    if val is not None:
+        line += f" | val loss {val['loss']:.4f}, val acc {val['accuracy']:.4f} ({val['seconds']:.1f}s)"
+    return line
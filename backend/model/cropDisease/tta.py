@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Test-time augmentation (TTA) for the disease models.
+
+A TTA spec is a "+"-joined list of view groups, always on top of the plain
+resized image ("base"):
+
+    flip      horizontal flip                           (+1 view)
+    flips     horizontal + vertical flip                (+2)
+    rot       90 / 180 / 270 degree rotations           (+3)
+    center    center crop from a larger decode          (+1)
+    fivecrop  center + four corner crops                (+5)
+    all       flips+rot+fivecrop                        (+10)
+
+e.g. "flips+rot". The image is decoded once; all views are uint8 tensors that
+go into the crop's micro-batcher back to back, so they share one forward pass
+(with any other requests waiting) instead of running one after another.
+Probabilities are averaged over the views.
+
+Each request has a time budget. If the batcher's backlog already suggests the
+extra views would not finish in time, or they do not finish in time, the
+base view's result is returned alone.
+
+Accuracy / latency check on labeled images (ImageFolder layout):
+    python tta.py --crop corn --images ../../../data_preprocessing/data/CornDataset_1 --specs none flip flips+rot fivecrop
+"""
+import argparse
+import asyncio
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from batching import BatcherClosedError
+from preprocessing import IMAGE_SIZE, image_to_uint8_tensor
+
+VIEW_GROUPS = {
+    "flip": ("hflip",),
+    "flips": ("hflip", "vflip"),
+    "rot": ("rot90", "rot180", "rot270"),
+    "center": ("center",),
+    "fivecrop": ("center", "top_left", "top_right", "bottom_left", "bottom_right"),
+}
+VIEW_GROUPS["all"] = VIEW_GROUPS["flips"] + VIEW_GROUPS["rot"] + VIEW_GROUPS["fivecrop"]
+CROP_VIEWS = {"center", "top_left", "top_right", "bottom_left", "bottom_right"}
+
+# crops are taken from a decode this much larger than the model input (256 for 224)
+CROP_SOURCE_SCALE = 256 / 224
+
+
+def parse_tta(spec):
+    """"flips+rot" -> ("base", "hflip", "vflip", "rot90", ...); None / "" / "none" -> ("base",)."""
+    views = ["base"]
+    for group in (spec or "").lower().replace(" ", "").split("+"):
+        if group in ("", "none", "off"):
+            continue
+        if group not in VIEW_GROUPS:
+            raise ValueError(f"Unknown TTA view group '{group}'. Choose from: {sorted(VIEW_GROUPS)}")
+        views.extend(v for v in VIEW_GROUPS[group] if v not in views)
+    return tuple(views)
+
+
+def make_views(data: bytes, views, size=IMAGE_SIZE):
+    """Decode once and return one uint8 (3, H, W) tensor per view name, in order."""
+    crops = CROP_VIEWS.intersection(views)
+    source_size = tuple(int(round(s * CROP_SOURCE_SCALE)) for s in size) if crops else tuple(size)
+
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG":
+        img.draft("RGB", source_size)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    base = image_to_uint8_tensor(img if img.size == tuple(size) else img.resize(size, Image.BILINEAR))
+    large = image_to_uint8_tensor(img.resize(source_size, Image.BILINEAR)) if crops else None
+
+    width, height = size
+    top, left = (source_size[1] - height) // 2, (source_size[0] - width) // 2
+    bottom, right = source_size[1] - height, source_size[0] - width
+    offsets = {"center": (top, left), "top_left": (0, 0), "top_right": (0, right),
+               "bottom_left": (bottom, 0), "bottom_right": (bottom, right)}
+
+    out = []
+    for view in views:
+        if view == "base":
+            out.append(base)
+        elif view == "hflip":
+            out.append(base.flip(-1))
+        elif view == "vflip":
+            out.append(base.flip(-2))
+        elif view.startswith("rot"):
+            out.append(torch.rot90(base, int(view[3:]) // 90, dims=(1, 2)).contiguous())
+        else:
+            y, x = offsets[view]
+            out.append(large[:, y: y + height, x: x + width].contiguous())
+    return out
+
+
+async def predict_views(registry, crop, views, budget_seconds):
+    """
+    Score all views of one image in a shared batch and average them.
+    Returns (probs, model version, number of views actually averaged).
+    """
+    entry = await registry.get(crop)
+    batcher = entry.batcher
+    if len(views) == 1 or batcher.estimated_seconds(len(views)) > budget_seconds:
+        probs, version = await registry.predict_versioned(crop, views[0])
+        return probs, version, 1
+
+    start = time.perf_counter()
+    try:
+        futures = batcher.enqueue(views)
+    except BatcherClosedError:
+        probs, version = await registry.predict_versioned(crop, views[0])
+        return probs, version, 1
+
+    entry.requests += 1
+    try:
+        base = await futures[0]
+        remaining = budget_seconds - (time.perf_counter() - start)
+        others = await asyncio.wait_for(asyncio.gather(*futures[1:]), timeout=max(0.0, remaining))
+    except asyncio.TimeoutError:
+        return base, entry.version, 1
+    finally:
+        # views not scored yet are dropped from the queue instead of computed for nobody
+        for future in futures:
+            future.cancel()
+    return np.mean([base] + list(others), axis=0), entry.version, len(views)
+
+
+# -------------------------------
+# Offline accuracy / latency check
+# -------------------------------
+def main():
+    from check import CROP_MODELS, load_crop_model
+    from batching import logits_from_output
+    from preprocessing import to_float_batch
+    from shared_backbone import image_folder_samples
+
+    parser = argparse.ArgumentParser(description="Compare TTA specs on labeled images")
+    parser.add_argument("--crop", default="corn", choices=sorted(CROP_MODELS))
+    parser.add_argument("--images", required=True, help="ImageFolder-style directory (sorted folders = class index)")
+    parser.add_argument("--specs", nargs="+", default=["none", "flip", "flips+rot", "fivecrop"])
+    parser.add_argument("--per-class", type=int, default=25)
+    parser.add_argument("--threshold", type=float, default=0.70)
+    args = parser.parse_args()
+
+    model = load_crop_model(args.crop, CROP_MODELS[args.crop], torch.device("cpu"))
+    classes, samples = image_folder_samples(args.images)
+    picked = []
+    for index in range(len(classes)):
+        picked.extend([s for s in samples if s[1] == index][: args.per_class])
+    payloads = []
+    for path, label in picked:
+        with open(path, "rb") as f:
+            payloads.append((f.read(), label))
+    print(f"{len(payloads)} images from {classes}, threshold {args.threshold}")
+    print(f"{'spec':<12} {'views':>5} {'accuracy':>9} {'unclassified':>12} {'ms/image':>9}")
+
+    for spec in args.specs:
+        views = parse_tta(spec)
+        correct = unclassified = 0
+        start = time.perf_counter()
+        for data, label in payloads:
+            with torch.inference_mode():
+                batch = to_float_batch(make_views(data, views))
+                probs = torch.softmax(logits_from_output(model(batch)), dim=1).mean(0)
+            conf, idx = float(probs.max()), int(probs.argmax())
+            unclassified += conf < args.threshold
+            correct += conf >= args.threshold and idx == label
+        ms = (time.perf_counter() - start) * 1000.0 / len(payloads)
+        n = len(payloads)
+        print(f"{spec:<12} {len(views):>5} {correct / n:>9.3f} {unclassified / n:>12.3f} {ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Micro-batching for the yield service.
+
+Requests submitted within a short window are coalesced into a single
+`predict_fn(list_of_items)` call that runs on a bounded thread pool, so the
+uvicorn event loop never blocks on CatBoost (which releases the GIL while
+scoring).
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=2.0, max_workers=4, name="inference"):
+        """
+        predict_fn: callable taking a list of items and returning a list of results (same order).
+            If a batch call raises, its items are retried one at a time so only the failing
+            item's request sees the error.
+        max_batch_size: upper bound on items per predict_fn call.
+        max_wait_ms: how long the first request of a batch waits for company (0 disables coalescing).
+        max_workers: size of the thread pool; also caps the number of batches in flight.
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_workers = max(1, int(max_workers))
+        self.name = name
+
+        self._executor = None
+        self._queue = None
+        self._slots = None
+        self._worker = None
+        self._inflight = set()
+
+        # counters
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    # -------------------------------
+    # lifecycle
+    # -------------------------------
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._worker = asyncio.create_task(self._collect_loop())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._worker = None
+
+    @property
+    def running(self):
+        return self._worker is not None
+
+    # -------------------------------
+    # public API
+    # -------------------------------
+    async def submit(self, item):
+        """Queue one item and wait for its result."""
+        if self._worker is None:
+            raise RuntimeError(f"{self.name} batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "workers": self.max_workers,
+        }
+
+    # -------------------------------
+    # internals
+    # -------------------------------
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+
+            # take whatever is already waiting, then wait out the window for more
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # bound the number of batches running on the pool at once
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run_batch(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._executor, self.predict_fn, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: predict_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                if len(items) == 1:
+                    raise
+                # one bad row must not fail the requests batched with it: score each on its own
+                print(f"[WARN] {self.name}: batch of {len(items)} failed ({e}); retrying items one at a time")
+                results = await loop.run_in_executor(self._executor, self._predict_each, items)
+            self.busy_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.items += len(items)
+            for future, result in zip(futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # never leave a caller waiting forever
+            for future in futures:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"{self.name}: no result for this item"))
+            self._slots.release()
+
+    def _predict_each(self, items):
+        """Fallback after a failed batch: one predict_fn call per item; failures are returned, not raised."""
+        results = []
+        for item in items:
+            try:
+                result = self.predict_fn([item])
+                if len(result) != 1:
+                    raise RuntimeError(f"{self.name}: predict_fn returned {len(result)} results for 1 item")
+                results.append(result[0])
+            except Exception as e:
+                results.append(e)
+        return results
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Compare the CatBoost runtime with the NumPy fast backend (fast_backend.py).
+
+Reports accuracy parity on a CSV of rows, plus per backend (each measured in a
+fresh subprocess): import + load time, resident memory after load, and
+single-row / batch prediction latency.
+
+    python fast_backend.py --train-csv train.csv --out crop_yield_fast
+    python benchmark_backends.py --csv train.csv --fast-dir crop_yield_fast
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux), else peak RSS."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def load_rows(csv_path, feature_names, cat_indices, limit):
+    import pandas as pd
+    from model_registry import normalize_category
+
+    df = pd.read_csv(csv_path, usecols=feature_names, nrows=limit)[feature_names]
+    rows = df.values.tolist()
+    for row in rows:
+        for i in cat_indices:
+            row[i] = normalize_category(row[i]) if isinstance(row[i], str) else str(row[i])
+    return rows
+
+
+def child(backend, model_path, fast_dir, csv_path, limit, repeats):
+    """Runs in a fresh interpreter so import time and RSS are not polluted."""
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    if backend == "catboost":
+        from model_registry import load_catboost_version
+        version = load_catboost_version(model_path)
+    else:
+        from fast_backend import load_fast_version
+        version = load_fast_version(fast_dir)
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    rows = load_rows(csv_path, version.feature_order, version.cat_feature_indices, limit)
+
+    single = []
+    for row in rows[:repeats]:
+        t = time.perf_counter()
+        version.predict_rows([row])
+        single.append((time.perf_counter() - t) * 1000.0)
+    single.sort()
+
+    t = time.perf_counter()
+    preds = version.predict_rows(rows)
+    batch_ms = (time.perf_counter() - t) * 1000.0
+
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "rss_base_mb": base_rss,
+        "rss_loaded_mb": loaded_rss,
+        "single_p50_ms": single[len(single) // 2],
+        "single_p99_ms": single[int(0.99 * (len(single) - 1))],
+        "batch_rows": len(rows),
+        "batch_ms": batch_ms,
+        "predictions": preds,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CatBoost vs the NumPy fast backend")
+    parser.add_argument("--model", default=os.path.join(HERE, "crop_yield_catboost.cbm"))
+    parser.add_argument("--fast-dir", default=os.path.join(HERE, "crop_yield_fast"))
+    parser.add_argument("--csv", required=True, help="rows to score (needs every model feature column)")
+    parser.add_argument("--limit", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=500)
+    parser.add_argument("--child", choices=["catboost", "fast"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.model, args.fast_dir, args.csv, args.limit, args.repeats)
+        return
+
+    results = {}
+    for backend in ("catboost", "fast"):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", backend, "--model", args.model,
+             "--fast-dir", args.fast_dir, "--csv", args.csv, "--limit", str(args.limit),
+             "--repeats", str(args.repeats)],
+            cwd=HERE, check=True, capture_output=True, text=True,
+        ).stdout
+        results[backend] = json.loads(out.strip().splitlines()[-1])
+
+    reference, fast = results["catboost"]["predictions"], results["fast"]["predictions"]
+    max_diff = max(abs(a - b) for a, b in zip(reference, fast)) if reference else 0.0
+    print(f"Accuracy parity over {len(reference)} rows: max |catboost - fast| = {max_diff:.3e}")
+    for backend, r in results.items():
+        print(f"  {backend:<9} load={r['load_seconds'] * 1000:.1f} ms  "
+              f"rss={r['rss_loaded_mb']:.1f} MB (+{r['rss_loaded_mb'] - r['rss_base_mb']:.1f})  "
+              f"single p50={r['single_p50_ms']:.3f} ms p99={r['single_p99_ms']:.3f} ms  "
+              f"batch({r['batch_rows']})={r['batch_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for the crop yield prediction hot path.
+
+Compares the old per-request pandas DataFrame path with the direct
+feature-row path used by cropYieldService, under concurrent load.
+
+    python benchmark_yield.py --requests 2000 --concurrency 8
+
+It also fires an asyncio burst through the service's MicroBatcher to show
+how micro-batching changes throughput for a dashboard-style burst.
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import cropYieldService as service
+from batching import MicroBatcher
+
+SAMPLE_REQUEST = service.CropYieldRequest(
+    state="Bihar",
+    district="Patna",
+    year=2000,
+    season="Kharif",
+    crop="Rice",
+    area=99073,
+    rainfall_mm=229.5,
+    temperature_c=29.5,
+    humidity=78,
+    wind_speed=3.5,
+    solar_radiation=17,
+    soil_moisture=0.605,
+    n_avg=202.68,
+    p_avg=21.54,
+    k_avg=92,
+)
+
+
+def predict_dataframe(request):
+    """The original implementation: one-row DataFrame per request."""
+    input_data = pd.DataFrame({
+        "state": [request.state.lower().strip()],
+        "district": [request.district.lower().strip()],
+        "year": [request.year],
+        "season": [request.season.lower().strip()],
+        "crop": [request.crop.lower().strip()],
+        "area": [request.area],
+        "rainfall_mm": [request.rainfall_mm],
+        "temperature_c": [request.temperature_c],
+        "humidity": [request.humidity],
+        "wind_speed": [request.wind_speed],
+        "solar_radiation": [request.solar_radiation],
+        "soil_moisture": [request.soil_moisture],
+        "n_avg": [request.n_avg],
+        "p_avg": [request.p_avg],
+        "k_avg": [request.k_avg],
+    })
+    return float(service.load_model().predict(input_data)[0])
+
+
+def predict_fast(request):
+    return service.predict_rows([service.build_feature_row(request)])[0]
+
+
+def timed_call(fn):
+    start = time.perf_counter()
+    fn(SAMPLE_REQUEST)
+    return time.perf_counter() - start
+
+
+def run(fn, n_requests, concurrency):
+    # warm-up
+    for _ in range(20):
+        fn(SAMPLE_REQUEST)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda _: timed_call(fn), range(n_requests)))
+    wall = time.perf_counter() - start
+
+    lat_ms = np.array(latencies) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "throughput_rps": n_requests / wall,
+    }
+
+
+async def run_burst(n_requests, max_batch_size, wait_ms, workers):
+    batcher = MicroBatcher(service.score_items, max_batch_size=max_batch_size,
+                           max_wait_ms=wait_ms, max_workers=workers)
+    await batcher.start()
+    version = service.registry.load()
+    row = service.build_feature_row(SAMPLE_REQUEST, version)
+
+    async def one():
+        start = time.perf_counter()
+        await batcher.submit((version, list(row)))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(n_requests)))
+    wall = time.perf_counter() - start
+    stats = batcher.stats()
+    await batcher.stop()
+
+    lat_ms = np.array(latencies) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "throughput_rps": n_requests / wall,
+        "avg_batch_size": stats["avg_batch_size"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crop yield prediction latency")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="inference threads for the burst benchmark")
+    args = parser.parse_args()
+
+    service.load_model()
+    assert abs(predict_dataframe(SAMPLE_REQUEST) - predict_fast(SAMPLE_REQUEST)) < 1e-9, "paths disagree"
+
+    print(f"{args.requests} requests, concurrency={args.concurrency}")
+    for name, fn in [("pandas DataFrame", predict_dataframe), ("feature row", predict_fast)]:
+        stats = run(fn, args.requests, args.concurrency)
+        print(f"  {name:<18} p50={stats['p50_ms']:.3f} ms  p99={stats['p99_ms']:.3f} ms  "
+              f"throughput={stats['throughput_rps']:.0f} req/s")
+
+    print(f"asyncio burst of {args.requests} requests, workers={args.workers}")
+    for name, batch_size, wait_ms in [("offload only", 1, 0.0), ("micro-batched", service.MAX_BATCH_SIZE, service.BATCH_WAIT_MS)]:
+        stats = asyncio.run(run_burst(args.requests, batch_size, wait_ms, args.workers))
+        print(f"  {name:<18} p50={stats['p50_ms']:.3f} ms  p99={stats['p99_ms']:.3f} ms  "
+              f"throughput={stats['throughput_rps']:.0f} req/s  avg batch={stats['avg_batch_size']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,162 @@
 #!/usr/bin/env python3
+import asyncio
 import os
-import pandas as pd
-from catboost import CatBoostRegressor
+import random
+import time
+from types import SimpleNamespace
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional
 import uvicorn
 
+from batching import MicroBatcher
+from instrumentation import Metrics, RequestProfiler, instrument_app
+from model_registry import ModelRegistry, ShadowStats, load_catboost_version
+from prediction_cache import PredictionCache, parse_quantize_spec
+
 # -------------------------------
 # App
 # -------------------------------
-app = FastAPI(title="Crop Yield Prediction API")
+# Per-stage timings (features, cache_lookup, infer, predict, serialize) go to
+# /metrics. YIELD_PROFILE_RATE / YIELD_PROFILE_HEADER=1 turn on the sampling
+# profiler (folded stacks in YIELD_PROFILE_DIR); see instrumentation.py.
+METRICS = Metrics("yield")
+app = FastAPI(title="Crop Yield Prediction API", default_response_class=METRICS.json_response_class())
+instrument_app(app, METRICS, RequestProfiler(
+    os.environ.get("YIELD_PROFILE_DIR", "profiles"),
+    sample_rate=float(os.environ.get("YIELD_PROFILE_RATE", "0")),
+    allow_header=os.environ.get("YIELD_PROFILE_HEADER", "0") == "1",
+    interval_ms=float(os.environ.get("YIELD_PROFILE_INTERVAL_MS", "5")),
+))
 
 # -------------------------------
 # Model Loading
 # -------------------------------
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "crop_yield_catboost.cbm")
-model = None
+# The registry watches MODEL_PATH and hot-swaps new versions without a restart.
+# An optional candidate model (YIELD_CANDIDATE_MODEL_PATH) is either scored in
+# the background for comparison ("shadow") or serves a share of traffic ("ab").
+MODEL_PATH = os.environ.get(
+    "YIELD_MODEL_PATH", os.path.join(os.path.dirname(__file__), "crop_yield_catboost.cbm")
+)
+MODEL_CHECK_INTERVAL = float(os.environ.get("YIELD_MODEL_CHECK_SECONDS", "5"))
+CANDIDATE_MODEL_PATH = os.environ.get("YIELD_CANDIDATE_MODEL_PATH", "")
+CANDIDATE_MODE = os.environ.get("YIELD_CANDIDATE_MODE", "shadow").lower()
+AB_FRACTION = float(os.environ.get("YIELD_AB_FRACTION", "0.1"))
+
+# YIELD_BACKEND=fast serves a NumPy export of the model (see fast_backend.py)
+# from YIELD_FAST_MODEL_DIR instead of the CatBoost runtime. The candidate is
+# loaded by the same backend, so it is then a fast export too (its directory
+# or meta.json).
+BACKEND = os.environ.get("YIELD_BACKEND", "catboost").lower()
+FAST_MODEL_DIR = os.environ.get(
+    "YIELD_FAST_MODEL_DIR", os.path.join(os.path.dirname(__file__), "crop_yield_fast")
+)
+
+if BACKEND == "fast":
+    from fast_backend import META_FILE, load_fast_version
+    model_loader = load_fast_version
+    primary_path = os.path.join(FAST_MODEL_DIR, META_FILE)
+    if os.path.isdir(CANDIDATE_MODEL_PATH):
+        # watch the export's meta.json, which is written last
+        CANDIDATE_MODEL_PATH = os.path.join(CANDIDATE_MODEL_PATH, META_FILE)
+else:
+    model_loader = load_catboost_version
+    primary_path = MODEL_PATH
+registry = ModelRegistry(primary_path, loader=model_loader, poll_interval=MODEL_CHECK_INTERVAL, name="primary")
+candidate_registry = (
+    ModelRegistry(CANDIDATE_MODEL_PATH, loader=model_loader, poll_interval=MODEL_CHECK_INTERVAL, name="candidate")
+    if CANDIDATE_MODEL_PATH else None
+)
+shadow_stats = ShadowStats()
+_shadow_tasks = set()
 
 def load_model():
-    global model
-    if model is None:
-        try:
-            model = CatBoostRegressor()
-            model.load_model(MODEL_PATH)
-            print(f"✅ Crop yield model loaded from {MODEL_PATH}")
-        except Exception as e:
-            print(f"❌ Error loading model: {e}")
-            raise
-    return model
+    """Return the active model object, loading it on first use."""
+    try:
+        return registry.load().model
+    except Exception as e:
+        print(f"❌ Error loading model: {e}")
+        raise
+
+# -------------------------------
+# Inference execution
+# -------------------------------
+# CatBoost runs on a bounded thread pool; requests arriving within
+# BATCH_WAIT_MS of each other are scored in one predict() call.
+INFERENCE_THREADS = int(os.environ.get("YIELD_INFERENCE_THREADS", os.cpu_count() or 1))
+MAX_BATCH_SIZE = int(os.environ.get("YIELD_MAX_BATCH_SIZE", "64"))
+BATCH_WAIT_MS = float(os.environ.get("YIELD_BATCH_WAIT_MS", "2"))
+
+batcher = None
+
+def score_items(items: list) -> list:
+    """
+    Batcher callback: items are (ModelVersion, row) pairs. Rows are grouped per
+    version so a batch that straddles a hot swap is still scored correctly.
+    """
+    results = [None] * len(items)
+    groups = {}
+    for i, (version, row) in enumerate(items):
+        groups.setdefault(id(version), (version, []))[1].append(i)
+    for version, indices in groups.values():
+        with METRICS.stage("predict"):
+            preds = version.predict_rows([items[i][1] for i in indices])
+        for i, pred in zip(indices, preds):
+            results[i] = pred
+    return results
+
+# -------------------------------
+# Result cache
+# -------------------------------
+# Identical (normalized) inputs are answered from an LRU + TTL cache.
+# YIELD_CACHE_QUANTIZE snaps continuous sensor fields onto a grid, e.g.
+# "rainfall_mm=1,temperature_c=0.1,humidity=1,soil_moisture=0.01".
+CACHE_MAX_ENTRIES = int(os.environ.get("YIELD_CACHE_SIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("YIELD_CACHE_TTL_SECONDS", "300"))
+CACHE_QUANTIZE = os.environ.get("YIELD_CACHE_QUANTIZE", "")
+
+prediction_cache = PredictionCache(max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS,
+                                   quantize_steps=parse_quantize_spec(CACHE_QUANTIZE))
+
+def bind_cache_to_version(new_version, old_version=None):
+    """
+    Rebind the cache to a newly active model: drop old results. Quantization
+    steps are resolved to row indices per model version (PredictionCache.quantize).
+    """
+    unknown = [name for name in prediction_cache.quantize_steps if name not in new_version.feature_order]
+    if unknown:
+        print(f"[WARN] Ignoring cache quantization for unknown columns: {unknown}")
+    prediction_cache.set_version(new_version.version_id)
+
+registry.on_swap(bind_cache_to_version)
 
 # Load model on startup
 @app.on_event("startup")
 async def startup_event():
+    global batcher
     load_model()
+    await registry.start()
+    if candidate_registry is not None:
+        candidate_registry.load()
+        await candidate_registry.start()
+        print(f"[INFO] Candidate model in '{CANDIDATE_MODE}' mode from {CANDIDATE_MODEL_PATH}")
+    batcher = MicroBatcher(
+        score_items,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=BATCH_WAIT_MS,
+        max_workers=INFERENCE_THREADS,
+        name="yield-infer",
+    )
+    await batcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await registry.stop()
+    if candidate_registry is not None:
+        await candidate_registry.stop()
+    if batcher is not None:
+        await batcher.stop()
 
 # -------------------------------
 # Request Model
@@ -56,6 +178,38 @@ class CropYieldRequest(BaseModel):
     p_avg: float
     k_avg: float
 
+# -------------------------------
+# Feature building (hot path)
+# -------------------------------
+def build_feature_row(request: CropYieldRequest, version=None) -> list:
+    """
+    Map a request straight into a feature row for a model version (default:
+    the active one). Categorical columns are normalized (strings) or
+    stringified (ints), matching what CatBoost would do with a DataFrame.
+    """
+    return (version or registry.load()).build_row(request)
+
+def predict_rows(rows: list) -> list:
+    """Score already-built feature rows with the active model."""
+    return registry.load().predict_rows(rows)
+
+async def shadow_score(request: CropYieldRequest, served: float, served_version, served_row: list):
+    """
+    Score the candidate model in the background and record its agreement. The
+    candidate sees the row the served value came from (cache-quantized), only
+    reordered for its own schema.
+    """
+    try:
+        version = candidate_registry.active
+        served_values = dict(zip(served_version.feature_order, served_row))
+        values = {name: served_values[name] if name in served_values else getattr(request, name)
+                  for name in version.feature_order}
+        result = await batcher.submit((version, version.build_row(SimpleNamespace(**values))))
+        shadow_stats.record(served, result)
+    except Exception as e:
+        shadow_stats.errors += 1
+        print(f"[WARN] Shadow scoring failed: {e}")
+
 # -------------------------------
 # Prediction endpoint
 # -------------------------------
@@ -65,34 +219,35 @@ async def predict_yield(request: CropYieldRequest):
     Predict crop yield based on input parameters.
     """
     try:
-        # Ensure model is loaded
-        model = load_model()
-        
-        # Normalize inputs (lowercase for categorical fields)
-        input_data = pd.DataFrame({
-            "state": [request.state.lower().strip()],
-            "district": [request.district.lower().strip()],
-            "year": [request.year],
-            "season": [request.season.lower().strip()],
-            "crop": [request.crop.lower().strip()],
-            "area": [request.area],
-            "rainfall_mm": [request.rainfall_mm],
-            "temperature_c": [request.temperature_c],
-            "humidity": [request.humidity],
-            "wind_speed": [request.wind_speed],
-            "solar_radiation": [request.solar_radiation],
-            "soil_moisture": [request.soil_moisture],
-            "n_avg": [request.n_avg],
-            "p_avg": [request.p_avg],
-            "k_avg": [request.k_avg]
-        })
-        
-        # Make prediction
-        prediction = model.predict(input_data)
-        predicted_yield = float(prediction[0])
-        
+        # A/B: a share of traffic is served by the candidate model (never cached)
+        if candidate_registry is not None and CANDIDATE_MODE == "ab" and random.random() < AB_FRACTION:
+            version = candidate_registry.active
+            predicted_yield = await batcher.submit((version, build_feature_row(request, version)))
+        else:
+            # Pin the active version for this request; a hot swap won't affect it
+            version = registry.load()
+
+            # Build features without pandas (quantized when caching is configured)
+            with METRICS.stage("features"):
+                row = prediction_cache.quantize(build_feature_row(request, version), version)
+
+            with METRICS.stage("cache_lookup"):
+                predicted_yield = prediction_cache.get(row)
+            if predicted_yield is None:
+                # Scoring happens off the event loop (queueing + batched predict)
+                start = time.perf_counter()
+                predicted_yield = await batcher.submit((version, row))
+                METRICS.observe_stage("infer", time.perf_counter() - start)
+                prediction_cache.put(row, predicted_yield, version=version.version_id)
+
+            if candidate_registry is not None and CANDIDATE_MODE == "shadow":
+                task = asyncio.create_task(shadow_score(request, predicted_yield, version, row))
+                _shadow_tasks.add(task)
+                task.add_done_callback(_shadow_tasks.discard)
+
         return {
             "success": True,
+            "model_version": version.version_id,
             "predicted_yield": predicted_yield,
             "yield_unit": "tons/hectare",
             "formatted_yield": f"{predicted_yield:.2f} tons/hectare"
@@ -108,12 +263,45 @@ async def predict_yield(request: CropYieldRequest):
             }
         )
 
+# -------------------------------
+# Metrics gauges (read at scrape time)
+# -------------------------------
+METRICS.gauge("batch_queue_depth", "Requests waiting for a batch",
+              lambda: batcher.stats()["queue_depth"] if batcher is not None else None)
+METRICS.gauge("batch_items_total", "Rows scored in batches",
+              lambda: batcher.items if batcher is not None else None, kind="counter")
+METRICS.gauge("batches_total", "Batched predict calls",
+              lambda: batcher.batches if batcher is not None else None, kind="counter")
+METRICS.gauge("cache_lookups_total", "Result cache lookups", labelnames=["result"], kind="counter",
+              fn=lambda: {("hit",): prediction_cache.hits, ("miss",): prediction_cache.misses})
+METRICS.gauge("model_info", "Active model version (value is always 1)", labelnames=["version"],
+              fn=lambda: {(registry.active.version_id,): 1} if registry.active is not None else None)
+
 # -------------------------------
 # Health check endpoint
 # -------------------------------
 @app.get("/health")
 async def health():
-    return {"status": "ok", "model_loaded": model is not None}
+    return {
+        "status": "ok",
+        "model_loaded": registry.active is not None,
+        "model_version": registry.active.version_id if registry.active is not None else None,
+        "batching": batcher.stats() if batcher is not None else None,
+        "cache": prediction_cache.stats(),
+    }
+
+# -------------------------------
+# Model registry endpoint
+# -------------------------------
+@app.get("/models")
+async def models():
+    """Loaded model versions with per-version latency, plus shadow/AB comparison."""
+    return {
+        "primary": registry.describe(),
+        "candidate": candidate_registry.describe() if candidate_registry is not None else None,
+        "candidate_mode": CANDIDATE_MODE if candidate_registry is not None else None,
+        "shadow": shadow_stats.snapshot() if candidate_registry is not None else None,
+    }
 
 # -------------------------------
 # Run with uvicorn when executed directly
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Standalone NumPy evaluator for the CatBoost yield model.
+
+CatBoost models are oblivious trees: every tree applies the same split at each
+depth level, so a prediction is "compare features against borders, pack the
+bits into a leaf index, sum leaf values". This module exports a trained .cbm
+into a directory of plain .npy arrays plus a small meta.json, and evaluates it
+with vectorized NumPy. Arrays are memory-mapped on load, so startup costs a few
+milliseconds and no catboost import.
+
+Categorical splits (one-hot and CTR) are exported as a lookup table: every
+category combination found in the training CSV is run through CatBoost once
+and the leaf-index bits its categorical splits set in each tree are stored;
+at serving time that is a dictionary lookup OR-ed into the leaf index.
+Combinations that were never seen in training fall back to the full CatBoost
+model if it is available.
+
+This only holds when a CTR depends on category values alone. CTRs that also
+combine float-feature borders (CatBoost builds these by default on larger
+models) are refused at export, and every export is checked against CatBoost
+on the whole training CSV before it is written; any disagreement fails the
+export instead of serving wrong predictions.
+
+Export:
+    python fast_backend.py --model crop_yield_catboost.cbm --train-csv crop_yield_train.csv --out crop_yield_fast
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from model_registry import ModelVersion, file_signature, import_catboost, normalize_category
+
+META_FILE = "meta.json"
+ARRAYS = ("split_float_pos", "split_border", "leaf_values", "cat_leaf_bits")
+# max |fast - catboost| accepted by the export parity check
+PARITY_TOLERANCE = 1e-6
+
+
+# -------------------------------
+# Evaluator
+# -------------------------------
+class FastYieldModel:
+    def __init__(self, directory, mmap=True):
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        # np.asarray keeps the mmap-backed buffer but drops the np.memmap subclass overhead
+        arrays = {
+            name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode))
+            for name in ARRAYS
+        }
+
+        self.directory = directory
+        self.feature_names_ = list(meta["feature_names"])
+        self.cat_feature_indices = list(meta["cat_feature_indices"])
+        self.float_columns = list(meta["float_columns"])
+        self.depth = int(meta["depth"])
+        self.n_trees = int(meta["n_trees"])
+        self.scale = float(meta["scale"])
+        self.bias = float(meta["bias"])
+        self.source_model = meta.get("source_model")
+
+        self.split_float_pos = arrays["split_float_pos"]
+        self.split_border = arrays["split_border"]
+        self.leaf_values = arrays["leaf_values"]
+        self.cat_leaf_bits = arrays["cat_leaf_bits"]
+
+        # small derived values, computed once
+        self.has_cat_splits = bool(meta["cat_splits"])
+        self.leaf_offsets = np.arange(self.n_trees, dtype=np.int64) * self.leaf_values.shape[1]
+        self.tuple_ids = {tuple(key): i for i, key in enumerate(meta["cat_tuples"])}
+
+        self._fallback = None
+        self.fallback_rows = 0
+
+    def get_cat_feature_indices(self):
+        return list(self.cat_feature_indices)
+
+    def _cat_tuple(self, row):
+        return tuple(row[i] for i in self.cat_feature_indices)
+
+    def _load_fallback(self):
+        if self._fallback is None:
+            if not self.source_model or not os.path.isfile(self.source_model):
+                return None
+            try:
+                model = import_catboost().CatBoostRegressor()
+            except ImportError:
+                return None
+            model.load_model(self.source_model)
+            self._fallback = model
+        return self._fallback
+
+    def predict(self, rows: list) -> np.ndarray:
+        """Predict rows built in `feature_names_` order (categoricals already normalized)."""
+        n = len(rows)
+        if n == 0:
+            return np.empty(0)
+        X = np.asarray([[row[i] for i in self.float_columns] for row in rows], dtype=np.float32)
+        X = X.reshape(n, len(self.float_columns))
+        # splits are stored depth-major: bits[:, j, t] is split j of tree t
+        bits = (X[:, self.split_float_pos] > self.split_border).reshape(n, self.depth, self.n_trees)
+
+        # pack each tree's split bits (LSB = first split) into its leaf index
+        leaf = bits[:, 0, :].astype(np.int64)
+        for j in range(1, self.depth):
+            leaf |= bits[:, j, :].astype(np.int64) << j
+
+        unknown = []
+        if self.has_cat_splits:
+            ids = np.empty(n, dtype=np.int64)
+            for r, row in enumerate(rows):
+                tid = self.tuple_ids.get(self._cat_tuple(row), -1)
+                if tid < 0:
+                    unknown.append(r)
+                    tid = 0
+                ids[r] = tid
+            if len(self.cat_leaf_bits):
+                leaf |= self.cat_leaf_bits[ids]
+
+        preds = np.take(self.leaf_values, leaf + self.leaf_offsets).sum(axis=1) * self.scale + self.bias
+
+        if unknown:
+            fallback = self._load_fallback()
+            if fallback is None:
+                raise ValueError(
+                    f"Unseen category combination {self._cat_tuple(rows[unknown[0]])} "
+                    f"and no CatBoost fallback available for {self.directory}"
+                )
+            self.fallback_rows += len(unknown)
+            pool = import_catboost().Pool([rows[r] for r in unknown], cat_features=self.cat_feature_indices)
+            preds[unknown] = fallback.predict(pool)
+        return preds
+
+
+class FastModelVersion(ModelVersion):
+    backend = "fast"
+
+    def _predict(self, rows: list):
+        return self.model.predict(rows)
+
+    def describe(self):
+        info = super().describe()
+        info["fallback_rows"] = self.model.fallback_rows
+        return info
+
+
+def load_fast_version(path, signature=None) -> FastModelVersion:
+    """Registry loader; `path` is the export directory or its meta.json."""
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    meta_path = os.path.join(directory, META_FILE)
+    return FastModelVersion(FastYieldModel(directory), meta_path,
+                            signature if signature is not None else file_signature(meta_path))
+
+
+# -------------------------------
+# Export
+# -------------------------------
+def read_training_rows(train_csv, feature_names, cat_indices):
+    """Feature rows of a training CSV, built like ModelVersion.build_row (rows with missing categories are skipped)."""
+    import pandas as pd
+
+    cat_columns = [feature_names[i] for i in cat_indices]
+    df = pd.read_csv(train_csv, usecols=feature_names).dropna(subset=cat_columns)
+    rows = []
+    for values in df[feature_names].itertuples(index=False, name=None):
+        row = list(values)
+        for i in cat_indices:
+            row[i] = normalize_category(row[i]) if isinstance(row[i], str) else str(row[i])
+        rows.append(row)
+    return rows
+
+
+def float_ctrs(dump):
+    """CTRs of a JSON model dump whose combination includes a float-feature border."""
+    return [ctr for ctr in dump["features_info"].get("ctrs", [])
+            if any(e.get("combination_element") == "float_feature" for e in ctr.get("elements", []))]
+
+
+def check_parity(directory, model, rows, cat_indices, tolerance=PARITY_TOLERANCE):
+    """Raise ValueError unless the export in `directory` matches `model` on every row (no fallback)."""
+    fast = FastYieldModel(directory, mmap=False)
+    fast.source_model = None  # an unseen combination must fail here, not be hidden by the fallback
+    expected = np.asarray(model.predict(import_catboost().Pool(rows, cat_features=cat_indices)), dtype=np.float64)
+    got = fast.predict(rows)
+    diff = np.abs(got - expected)
+    worst = int(diff.argmax())
+    if diff[worst] > tolerance:
+        raise ValueError(f"Fast export disagrees with CatBoost on {int((diff > tolerance).sum())}/{len(rows)} "
+                         f"training rows (max |diff| {diff[worst]:.6g} on row {worst}); not exported")
+    return float(diff[worst])
+
+
+def export_fast_model(model_path, out_dir, train_csv):
+    """
+    Export `model_path` to `out_dir`. `train_csv` (the model's training data,
+    one column per feature) supplies the category combinations and the rows
+    of the parity check against CatBoost.
+    """
+    if not train_csv:
+        raise ValueError("--train-csv is required: it enumerates categories and checks the export against CatBoost")
+    catboost = import_catboost()
+    model = catboost.CatBoostRegressor()
+    model.load_model(model_path)
+    feature_names = list(model.feature_names_)
+    cat_indices = list(model.get_cat_feature_indices())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "model.json")
+        model.save_model(json_path, format="json")
+        with open(json_path) as f:
+            dump = json.load(f)
+
+    unsupported = float_ctrs(dump)
+    if unsupported:
+        raise ValueError(f"{len(unsupported)} of {len(dump['features_info']['ctrs'])} CTRs combine categorical "
+                         f"and float features, which the fast backend cannot evaluate; serve this model with "
+                         f"YIELD_BACKEND=catboost (or retrain without float CTR combinations)")
+
+    float_features = sorted(dump["features_info"].get("float_features", []), key=lambda f: f["feature_index"])
+    float_columns = [f["flat_feature_index"] for f in float_features]
+    trees = dump["oblivious_trees"]
+    n_trees = len(trees)
+    depth = max(len(t["splits"]) for t in trees)
+
+    # Padding and categorical slots are float splits against +inf, i.e. always 0:
+    # shallower trees only address their first 2**len(splits) leaves, and
+    # categorical bits are OR-ed in from cat_leaf_bits.
+    split_float_pos = np.zeros(n_trees * depth, dtype=np.int32)
+    split_border = np.full(n_trees * depth, np.inf, dtype=np.float32)
+    leaf_values = np.zeros((n_trees, 2 ** depth), dtype=np.float64)
+    cat_splits = []
+
+    for t, tree in enumerate(trees):
+        if len(tree["leaf_values"]) != 2 ** len(tree["splits"]):
+            raise ValueError("Only single-dimension regression models are supported")
+        for j, split in enumerate(tree["splits"]):
+            slot = j * n_trees + t
+            if split["split_type"] == "FloatFeature":
+                split_float_pos[slot] = split["float_feature_index"]
+                split_border[slot] = split["border"]
+            else:
+                cat_splits.append((t, j))
+        leaf_values[t, : len(tree["leaf_values"])] = tree["leaf_values"]
+
+    # Categorical split outcomes per known category combination
+    train_rows = read_training_rows(train_csv, feature_names, cat_indices)
+    if not train_rows:
+        raise ValueError(f"No usable rows in {train_csv}")
+    cat_tuples = []
+    cat_leaf_bits = np.zeros((0, n_trees), dtype=np.int64)
+    if cat_splits:
+        cat_tuples = sorted({tuple(row[i] for i in cat_indices) for row in train_rows})
+        rows = []
+        for values in cat_tuples:
+            row = [0.0] * len(feature_names)
+            for i, value in zip(cat_indices, values):
+                row[i] = value
+            rows.append(row)
+        pool = catboost.Pool(rows, cat_features=cat_indices)
+        leaves = np.asarray(model.calc_leaf_indexes(pool), dtype=np.int64)
+        cat_leaf_bits = np.zeros((len(cat_tuples), n_trees), dtype=np.int64)
+        for t, j in cat_splits:
+            cat_leaf_bits[:, t] |= leaves[:, t] & (1 << j)
+
+    scale, bias = dump.get("scale_and_bias", [1.0, [0.0]])
+    meta = {
+        "source_model": os.path.abspath(model_path),
+        "feature_names": feature_names,
+        "cat_feature_indices": cat_indices,
+        "float_columns": float_columns,
+        "depth": depth,
+        "n_trees": n_trees,
+        "scale": float(scale),
+        "bias": float(bias[0] if isinstance(bias, list) else bias),
+        "cat_splits": len(cat_splits),
+        "cat_tuples": [list(t) for t in cat_tuples],
+    }
+
+    arrays = {
+        "split_float_pos": split_float_pos,
+        "split_border": split_border,
+        "leaf_values": leaf_values,
+        "cat_leaf_bits": cat_leaf_bits,
+    }
+    # check a staged copy first, so a bad export never reaches out_dir
+    with tempfile.TemporaryDirectory() as staging:
+        for name in ARRAYS:
+            np.save(os.path.join(staging, f"{name}.npy"), arrays[name])
+        with open(os.path.join(staging, META_FILE), "w") as f:
+            json.dump(meta, f)
+        max_diff = check_parity(staging, model, train_rows, cat_indices)
+    print(f"[OK] Parity with CatBoost on {len(train_rows)} training rows (max |diff| {max_diff:.2g})")
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, f"{name}.npy"), arrays[name])
+
+    # meta.json goes last (atomically) so a watching registry never sees a half export
+    tmp_meta = os.path.join(out_dir, META_FILE + ".tmp")
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, os.path.join(out_dir, META_FILE))
+
+    print(f"✅ Exported {n_trees} trees (depth {depth}, {len(cat_splits)} categorical splits, "
+          f"{len(cat_tuples)} category combinations) to {out_dir}")
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a CatBoost yield model to the NumPy fast backend")
+    parser.add_argument("--model", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "crop_yield_catboost.cbm"))
+    parser.add_argument("--train-csv", required=True,
+                        help="training data: enumerates category combinations and checks the export")
+    parser.add_argument("--out", default="crop_yield_fast")
+    args = parser.parse_args()
+    export_fast_model(args.model, args.out, args.train_csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Hot-path instrumentation for the model services (same file in cropDisease/ and
+cropYield/).
+
+Metrics: per-stage latency histograms (read, decode, forward, ...), request
+latency per route and a few scrape-time gauges, exposed on `/metrics` in the
+Prometheus text format. No client library needed. Numbers are per process:
+with serving.py's workers, each scrape lands on one worker.
+
+Profiling: an opt-in sampling profiler. While a profiled request runs, a
+thread snapshots every thread's Python stack every few milliseconds (idle
+waits dropped) and writes them as folded stacks (`thread;file:func;... count`)
+to the profile directory, ready for flamegraph.pl / speedscope. A request is
+profiled when it sends `X-Profile: 1` (if the header is allowed) or is picked
+by the sample rate; one profile runs at a time, and since every thread is
+sampled, concurrent requests show up in it too.
+
+    metrics = Metrics("disease")
+    with metrics.stage("decode"):
+        ...
+    instrument_app(app, metrics, RequestProfiler("profiles", sample_rate=0.01))
+"""
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter as StackCounts
+from contextlib import contextmanager
+
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+# seconds; covers sub-millisecond cache hits up to slow cold loads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = _format_labels(self.labelnames + ("le",), labels + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {values[-2]!r}")
+            lines.append(f"{self.name}_count{suffix} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time: fn() returns a number, or {label values tuple: number}."""
+
+    def __init__(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Metrics:
+    def __init__(self, namespace, buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self._metrics = []
+        self.stages = self.histogram("stage_seconds", "Time spent per request/batch stage", ["stage"], buckets)
+        self.requests = self.histogram("request_seconds", "HTTP request latency", ["method", "route", "status"], buckets)
+        self.profiles = self.counter("profiles_total", "Sampled request profiles", ["outcome"])
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self._name(name), help_text, labelnames, buckets))
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(self._name(name), help_text, labelnames))
+
+    def gauge(self, name, help_text, fn, labelnames=(), kind="gauge"):
+        """kind="counter" for monotonically increasing values kept elsewhere (e.g. cache hits)."""
+        return self._add(Gauge(self._name(name), help_text, fn, labelnames, kind))
+
+    def observe_stage(self, stage, seconds):
+        self.stages.observe(seconds, stage)
+
+    def stage(self, stage):
+        """Context manager timing one stage: `with metrics.stage("decode"): ...`."""
+        return self.stages.time(stage)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def json_response_class(self):
+        """JSONResponse that records its serialization time as the "serialize" stage."""
+        metrics = self
+
+        class TimedJSONResponse(JSONResponse):
+            def render(self, content):
+                with metrics.stage("serialize"):
+                    return super().render(content)
+
+        return TimedJSONResponse
+
+
+# -------------------------------
+# Sampling profiler
+# -------------------------------
+# frames from these files are threads parked on a lock / queue / socket
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "thread.py")
+
+
+class StackSampler:
+    def __init__(self, interval_seconds=0.005):
+        self.interval = max(0.0005, float(interval_seconds))
+        self.counts = StackCounts()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class RequestProfiler:
+    def __init__(self, out_dir="profiles", sample_rate=0.0, allow_header=False, interval_ms=5.0, max_files=200):
+        """
+        out_dir:      where the .folded profiles are written
+        sample_rate:  fraction of requests profiled at random (0 = none)
+        allow_header: profile requests sending `X-Profile: 1`
+        max_files:    oldest profiles are deleted beyond this many
+        """
+        self.out_dir = out_dir
+        self.sample_rate = max(0.0, float(sample_rate))
+        self.allow_header = bool(allow_header)
+        self.interval = float(interval_ms) / 1000.0
+        self.max_files = max(1, int(max_files))
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.allow_header or self.sample_rate > 0
+
+    def wants(self, scope):
+        if self.allow_header and (b"x-profile", b"1") in scope.get("headers", ()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin(self):
+        """A started sampler, or None if another profile is running."""
+        if not self._busy.acquire(blocking=False):
+            return None
+        sampler = StackSampler(self.interval)
+        sampler.start()
+        return sampler
+
+    def finish(self, sampler, name):
+        """Stop `sampler` and write its profile as `name` (blocking; run it off the event loop)."""
+        try:
+            counts = sampler.stop()
+        finally:
+            self._busy.release()
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, name), "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        self._trim()
+
+    def _trim(self):
+        files = sorted(
+            (os.path.join(self.out_dir, n) for n in os.listdir(self.out_dir) if n.endswith(".folded")),
+            key=os.path.getmtime,
+        )
+        for path in files[: max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class InstrumentationMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware wrapping): times each request
+    until its last body chunk is sent, so streamed NDJSON responses are
+    measured in full, and runs the profiler around the chosen requests.
+    """
+
+    def __init__(self, app, metrics, profiler=None):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler if (profiler is not None and profiler.enabled) else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampler = name = None
+        if self.profiler is not None and self.profiler.wants(scope):
+            sampler = self.profiler.begin()
+            if sampler is None:
+                self.metrics.profiles.inc("skipped_busy")
+            else:
+                label = scope["path"].strip("/").replace("/", "_") or "root"
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{label}-{random.getrandbits(24):06x}.folded"
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if name is not None:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-profile", name.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.requests.observe(seconds, scope["method"], route, str(status[0]))
+            if sampler is not None:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.profiler.finish, sampler, name)
+                self.metrics.profiles.inc("written")
+
+
+def instrument_app(app, metrics, profiler=None):
+    """Add `/metrics` plus request timing (and profiling of the chosen requests) to a FastAPI app."""
+
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.add_middleware(InstrumentationMiddleware, metrics=metrics, profiler=profiler)
+    return app
+
+
+def read_profile(path, top=25):
+    """Heaviest leaf functions of a .folded profile (for a quick look without flamegraph tooling)."""
+    leaves = StackCounts()
+    total = 0
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            leaves[stack.rsplit(";", 1)[-1]] += int(count)
+            total += int(count)
+    return {"samples": total, "top": [(leaf, n, round(n / total, 3)) for leaf, n in leaves.most_common(top)]}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise SystemExit("usage: python instrumentation.py <profile.folded>")
+    summary = read_profile(sys.argv[1])
+    print(f"{summary['samples']} samples")
+    for leaf, count, share in summary["top"]:
+        print(f"{share:>7.1%} {count:>6d}  {leaf}")
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Versioned model registry for the yield service.
+
+A ModelRegistry watches one model file. When the file changes it loads the
+new version on a worker thread and swaps it in with a single reference
+assignment; requests that already picked up the previous ModelVersion keep
+using it until they finish, so nothing in flight is dropped.
+"""
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+
+# Column order used when the model file carries no feature names
+FEATURE_COLUMNS = [
+    "state", "district", "year", "season", "crop", "area",
+    "rainfall_mm", "temperature_c", "humidity", "wind_speed",
+    "solar_radiation", "soil_moisture", "n_avg", "p_avg", "k_avg",
+]
+
+_version_ids = itertools.count(1)
+
+
+def import_catboost():
+    """Import catboost on first use, so the fast backend never pays for it."""
+    import catboost
+    return catboost
+
+
+@lru_cache(maxsize=4096)
+def normalize_category(value: str) -> str:
+    """Lowercase/strip a categorical value; repeated districts/crops hit the cache."""
+    return sys.intern(value.lower().strip())
+
+
+def file_signature(path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class LatencyStats:
+    """Rolling latency window (milliseconds) with simple percentiles."""
+
+    def __init__(self, window=2048):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rows = 0
+
+    def record(self, seconds, rows=1):
+        with self._lock:
+            self._samples.append(seconds * 1000.0)
+            self.calls += 1
+            self.rows += rows
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"calls": self.calls, "rows": self.rows, "p50_ms": None, "p99_ms": None}
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "p50_ms": round(samples[int(0.50 * (len(samples) - 1))], 4),
+            "p99_ms": round(samples[int(0.99 * (len(samples) - 1))], 4),
+        }
+
+
+class ModelVersion:
+    """One loaded model file plus the schema needed to build rows for it."""
+
+    backend = "catboost"
+
+    def __init__(self, model, path, signature):
+        self.model = model
+        self.path = path
+        self.signature = signature
+        self.version_id = f"v{next(_version_ids)}-{signature[0] if signature else 0}"
+        self.loaded_at = time.time()
+        self.feature_order = list(model.feature_names_ or FEATURE_COLUMNS)
+        self.cat_feature_indices = list(model.get_cat_feature_indices())
+        self.latency = LatencyStats()
+
+    def build_row(self, source) -> list:
+        """
+        Map an object with one attribute per feature (e.g. the pydantic request)
+        into a feature row in this model's column order.
+        """
+        row = [getattr(source, name) for name in self.feature_order]
+        for i in self.cat_feature_indices:
+            value = row[i]
+            row[i] = normalize_category(value) if isinstance(value, str) else str(value)
+        return row
+
+    def predict_rows(self, rows: list) -> list:
+        start = time.perf_counter()
+        preds = [float(p) for p in self._predict(rows)]
+        self.latency.record(time.perf_counter() - start, rows=len(rows))
+        return preds
+
+    def _predict(self, rows: list):
+        return self.model.predict(import_catboost().Pool(rows, cat_features=self.cat_feature_indices))
+
+    def describe(self):
+        return {
+            "version": self.version_id,
+            "backend": self.backend,
+            "path": self.path,
+            "loaded_at": self.loaded_at,
+            "features": len(self.feature_order),
+            "latency": self.latency.snapshot(),
+        }
+
+
+def load_catboost_version(path, signature=None) -> ModelVersion:
+    model = import_catboost().CatBoostRegressor()
+    model.load_model(path)
+    return ModelVersion(model, path, signature if signature is not None else file_signature(path))
+
+
+class ModelRegistry:
+    def __init__(self, path, loader=load_catboost_version, poll_interval=5.0, history=5, name="primary"):
+        """
+        path: model file to serve and watch.
+        loader: callable(path, signature) -> ModelVersion.
+        poll_interval: seconds between file checks (0 disables watching).
+        history: number of retired versions whose describe() snapshot is kept for /models stats
+            (the models themselves are released once in-flight requests finish).
+        """
+        self.path = path
+        self.loader = loader
+        self.poll_interval = float(poll_interval)
+        self.name = name
+        self.active = None
+        self.retired = deque(maxlen=history)
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error = None
+        self._failed_signature = None
+        self._listeners = []
+        self._watcher = None
+        self._load_lock = threading.Lock()
+
+    def on_swap(self, callback):
+        """Register callback(new_version, old_version) run after each swap."""
+        self._listeners.append(callback)
+
+    def load(self):
+        """Synchronously load the model if nothing is active yet."""
+        with self._load_lock:
+            if self.active is None:
+                self._swap(self.loader(self.path, file_signature(self.path)))
+        return self.active
+
+    def _swap(self, new_version):
+        old_version = self.active
+        self.active = new_version
+        if old_version is not None:
+            self.retired.appendleft(dict(old_version.describe(), retired_at=time.time()))
+            self.reloads += 1
+        print(f"✅ [{self.name}] model {new_version.version_id} active (from {self.path})")
+        for callback in self._listeners:
+            callback(new_version, old_version)
+
+    # -------------------------------
+    # background watching
+    # -------------------------------
+    async def start(self):
+        if self._watcher is None and self.poll_interval > 0:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def reload_if_changed(self):
+        """Load and swap in the model file if it differs from the active version."""
+        signature = file_signature(self.path)
+        current = self.active.signature if self.active is not None else None
+        if signature is None or signature == current or signature == self._failed_signature:
+            return False
+
+        # wait for writers to finish: the file must look the same twice in a row
+        await asyncio.sleep(min(1.0, self.poll_interval))
+        if file_signature(self.path) != signature:
+            return False
+
+        loop = asyncio.get_running_loop()
+        try:
+            new_version = await loop.run_in_executor(None, self.loader, self.path, signature)
+        except Exception as e:
+            self._failed_signature = signature
+            self.failed_reloads += 1
+            self.last_error = str(e)
+            print(f"❌ [{self.name}] failed to load new model from {self.path}: {e} (keeping {current})")
+            return False
+        self._swap(new_version)
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                print(f"[WARN] [{self.name}] model watcher error: {e}")
+
+    def describe(self):
+        return {
+            "path": self.path,
+            "active": self.active.describe() if self.active is not None else None,
+            "retired": list(self.retired),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_error": self.last_error,
+        }
+
+
+class ShadowStats:
+    """Agreement between the serving model and a shadow/candidate model."""
+
+    def __init__(self):
+        self.compared = 0
+        self.errors = 0
+        self.abs_diff_sum = 0.0
+        self.max_abs_diff = 0.0
+
+    def record(self, served, candidate):
+        diff = abs(served - candidate)
+        self.compared += 1
+        self.abs_diff_sum += diff
+        self.max_abs_diff = max(self.max_abs_diff, diff)
+
+    def snapshot(self):
+        return {
+            "compared": self.compared,
+            "errors": self.errors,
+            "mean_abs_diff": (self.abs_diff_sum / self.compared) if self.compared else None,
+            "max_abs_diff": self.max_abs_diff if self.compared else None,
+        }
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+In-memory result cache for the yield service.
+
+Entries are keyed on the normalized feature row (optionally with continuous
+fields quantized) plus the model version, evicted LRU-first once
+`max_entries` is reached and expired after `ttl_seconds`.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def parse_quantize_spec(spec: str) -> dict:
+    """
+    Parse "rainfall_mm=1,temperature_c=0.1" into {"rainfall_mm": 1.0, "temperature_c": 0.1}.
+    Empty / missing spec disables quantization.
+    """
+    steps = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, step = part.partition("=")
+        step = float(step)
+        if step <= 0:
+            raise ValueError(f"Quantization step for '{name}' must be > 0, got {step}")
+        steps[name.strip()] = step
+    return steps
+
+
+class PredictionCache:
+    def __init__(self, max_entries=10000, ttl_seconds=300.0, quantize_steps=None):
+        """
+        max_entries: LRU capacity (0 disables the cache).
+        ttl_seconds: entry lifetime (0 or less means no expiry).
+        quantize_steps: {column name: step} applied to continuous fields before keying.
+        """
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.quantize_steps = dict(quantize_steps or {})
+        self.version = None
+        self._quantize_indices = {}  # version_id -> {column index: step}
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def quantize(self, row: list, version) -> list:
+        """
+        Snap configured continuous fields of a row built for `version` (a
+        ModelVersion) onto their grid. Returns a new row.
+        """
+        if not self.quantize_steps:
+            return row
+        indices = self._quantize_indices.get(version.version_id)
+        if indices is None:
+            # resolved per version: a request pinned to an older model keeps its own schema
+            order = version.feature_order
+            indices = self._quantize_indices[version.version_id] = {
+                order.index(name): step
+                for name, step in self.quantize_steps.items()
+                if name in order and order.index(name) not in version.cat_feature_indices
+            }
+        row = list(row)
+        for i, step in indices.items():
+            row[i] = round(round(row[i] / step) * step, 10)
+        return row
+
+    def set_version(self, version):
+        """Bind the cache to a model version; a different version drops every entry."""
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._quantize_indices.clear()
+                self.version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get(self, row: list):
+        """Return the cached value for a (quantized) row, or None."""
+        if not self.enabled:
+            return None
+        key = tuple(row)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, row: list, value, version=None):
+        """
+        Store a value. If `version` is given and no longer matches the cache's
+        version (model changed while the prediction was running) it is dropped.
+        """
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[tuple(row)] = (value, expires_at)
+            self._entries.move_to_end(tuple(row))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "quantized_fields": len(self.quantize_steps),
+        }
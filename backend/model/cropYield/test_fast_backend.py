@@ -0,0 +1,112 @@
+"""
+Export checks of the NumPy fast backend against CatBoost.
+
+    python -m pytest backend/model/cropYield/test_fast_backend.py
+"""
+import asyncio
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+catboost = pytest.importorskip("catboost")
+pd = pytest.importorskip("pandas")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batching import MicroBatcher  # noqa: E402
+from fast_backend import (META_FILE, check_parity, export_fast_model, float_ctrs,  # noqa: E402
+                          load_fast_version, read_training_rows)
+from model_registry import FEATURE_COLUMNS  # noqa: E402
+
+CAT_INDICES = [0, 1, 2, 3, 4]
+
+
+@pytest.fixture(scope="module")
+def train_csv(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = pd.DataFrame({
+        "state": rng.choice(["Punjab", "Bihar", "Kerala"], n),
+        "district": rng.choice([f"D{i}" for i in range(10)], n),
+        "year": rng.integers(2000, 2008, n),
+        "season": rng.choice(["Kharif", "Rabi"], n),
+        "crop": rng.choice(["Rice", "Wheat", "Maize"], n),
+    })
+    for column in FEATURE_COLUMNS[5:]:
+        df[column] = rng.normal(50, 10, n)
+    df["yield"] = (df["area"] * 0.1 + (df["crop"] == "Rice") * 5
+                   + (df["rainfall_mm"] > 50) * (df["district"] == "D3") * 7 + rng.normal(0, 1, n))
+    path = str(tmp_path_factory.mktemp("data") / "train.csv")
+    df.to_csv(path, index=False)
+    return path
+
+
+def train_model(train_csv, path, iterations=100, **params):
+    df = pd.read_csv(train_csv)
+    rows = read_training_rows(train_csv, FEATURE_COLUMNS, CAT_INDICES)
+    X = pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+    model = catboost.CatBoostRegressor(iterations=iterations, depth=6, verbose=0, random_seed=0, **params)
+    model.fit(X, df["yield"], cat_features=CAT_INDICES)
+    model.save_model(path)
+    return model
+
+
+def test_float_ctr_model_is_refused(train_csv, tmp_path):
+    # CatBoost's default CTRs combine categories with float borders on a model like this
+    model = train_model(train_csv, str(tmp_path / "model.cbm"), iterations=200)
+    model.save_model(str(tmp_path / "model.json"), format="json")
+    with open(tmp_path / "model.json") as f:
+        assert float_ctrs(json.load(f))
+
+    with pytest.raises(ValueError, match="combine categorical and float"):
+        export_fast_model(str(tmp_path / "model.cbm"), str(tmp_path / "fast"), train_csv)
+    assert not os.path.exists(tmp_path / "fast" / META_FILE)
+
+
+def test_export_matches_catboost(train_csv, tmp_path):
+    model = train_model(train_csv, str(tmp_path / "model.cbm"), max_ctr_complexity=1)
+    export_fast_model(str(tmp_path / "model.cbm"), str(tmp_path / "fast"), train_csv)
+
+    rows = read_training_rows(train_csv, FEATURE_COLUMNS, CAT_INDICES)
+    version = load_fast_version(str(tmp_path / "fast"))
+    expected = model.predict(catboost.Pool(rows, cat_features=CAT_INDICES))
+    np.testing.assert_allclose(version.predict_rows(rows), expected, atol=1e-6)
+    assert version.model.fallback_rows == 0
+
+
+def test_parity_check_rejects_a_wrong_export(train_csv, tmp_path):
+    model = train_model(train_csv, str(tmp_path / "model.cbm"), max_ctr_complexity=1)
+    export_fast_model(str(tmp_path / "model.cbm"), str(tmp_path / "fast"), train_csv)
+    leaf_values = np.load(tmp_path / "fast" / "leaf_values.npy")
+    leaf_values[0, 0] += 1.0
+    np.save(tmp_path / "fast" / "leaf_values.npy", leaf_values)
+
+    rows = read_training_rows(train_csv, FEATURE_COLUMNS, CAT_INDICES)
+    with pytest.raises(ValueError, match="disagrees with CatBoost"):
+        check_parity(str(tmp_path / "fast"), model, rows, CAT_INDICES)
+
+
+def test_unseen_category_fails_only_its_request(train_csv, tmp_path):
+    train_model(train_csv, str(tmp_path / "model.cbm"), max_ctr_complexity=1)
+    export_fast_model(str(tmp_path / "model.cbm"), str(tmp_path / "fast"), train_csv)
+    version = load_fast_version(str(tmp_path / "fast"))
+    version.model.source_model = None  # no CatBoost fallback
+
+    rows = read_training_rows(train_csv, FEATURE_COLUMNS, CAT_INDICES)[:4]
+    rows[2] = list(rows[2])
+    rows[2][1] = "never seen"
+
+    async def score():
+        batcher = MicroBatcher(version.predict_rows, max_batch_size=8, max_wait_ms=50)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*[batcher.submit(row) for row in rows], return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(score())
+    assert isinstance(results[2], ValueError)
+    assert all(isinstance(r, float) for i, r in enumerate(results) if i != 2)
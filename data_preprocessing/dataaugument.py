@@ -1,19 +1,63 @@
+"""
+Balances an image-classification dataset to the median class size:
+large classes are sampled down, small ones are topped up with flipped /
+rotated copies.
+
+(Training can also balance and augment at load time without writing any
+files: mobilevit_rice2.py --balance --augment, see
+backend/model/cropDisease/train_augment.py.)
+
+Before balancing, dataset_index.py merges class folders into unified classes
+(class_map.json) and drops near-duplicate images across all corpora.
+--root may also be a packed directory (packed_dataset.py): sources are then
+read from its shards and kept originals are written out instead of linked.
+
+The work runs on a process pool, one task per source image: each source is
+decoded once and every augmentation planned for it is made from that
+in-memory copy. Kept originals are hardlinked (or reflinked, or copied as a
+last resort) instead of duplicated.
+
+Runs are incremental and deterministic under --seed: which images are kept
+and how each is augmented depends only on its content hash and the seed,
+outputs are named after that hash, and manifest.json in the output folder
+records the source path, content hash, op and seed of every output. A rerun
+hashes only new or modified sources, reuses every output whose entry is
+unchanged, and deletes outputs whose source is gone.
+
+    python data_preprocessing/dataaugument.py --workers 8 --seed 0
+"""
+import argparse
+import fcntl
+import hashlib
+import json
 import os
 import numpy as np
 from PIL import Image
 import random
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dataset_index import (CLASS_MAP, DUPLICATE_THRESHOLD, build_index, find_class_folders, load_class_map, load_index,
+                           save_index)
+from packed_dataset import open_packed, open_source, packed_member, packed_root, read_bytes, source_stat
 
 # --- Configuration ---
 # ⚠️ IMPORTANT: Change this to your root directory containing the subfolders (classes)
 ROOT_DIR = 'data_preprocessing/data' 
 # ⚠️ IMPORTANT: Change this to where you want the balanced dataset to be saved
 OUTPUT_DIR = 'data_preprocessing/data_balanced' 
+# Worker processes (0 = one per CPU core)
+WORKERS = int(os.environ.get("AUGMENT_WORKERS", "0"))
 # ---------------------
 
+MANIFEST_NAME = 'manifest.json'
+INDEX_NAME = 'index.json'
+FICLONE = 0x40049409  # linux ioctl: share the source's data blocks (btrfs, xfs)
+
 def get_all_image_paths(folder_path, image_extensions=('.jpg', '.jpeg', '.png', '.bmp', '.tiff')):
     """
-    Recursively finds all image paths in a given folder.
+    Recursively finds all image paths in a given folder (or packed directory).
     
     Args:
         folder_path (str): The starting path.
@@ -22,12 +66,7 @@ def get_all_image_paths(folder_path, image_extensions=('.jpg', '.jpeg', '.png',
     Returns:
         list: A list of full paths to all images.
     """
-    image_paths = []
-    for root, _, files in os.walk(folder_path):
-        for filename in files:
-            if filename.lower().endswith(image_extensions):
-                image_paths.append(os.path.join(root, filename))
-    return image_paths
+    return [path for images in find_class_folders(folder_path, image_extensions).values() for path in images]
 
 def calculate_median_images_recursive(root_dir):
     """
@@ -35,7 +74,7 @@ def calculate_median_images_recursive(root_dir):
     and calculates the median count.
     
     Args:
-        root_dir (str): The path to the root directory.
+        root_dir (str): The path to the root directory (or a packed directory).
         
     Returns:
         tuple: A tuple containing (dict of folder counts, median count, dict of folder paths).
@@ -44,28 +83,14 @@ def calculate_median_images_recursive(root_dir):
     # Stores the actual path for each class name (e.g., 'classA': '/path/to/classA')
     folder_paths = {} 
     
-    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
     print(f"🔬 Analyzing image counts recursively in: {root_dir}")
     
-    # os.walk traverses the directory tree
-    for root, dirs, files in os.walk(root_dir, topdown=False):
-        # A 'leaf' directory is one that does not contain any subdirectories (dirs list is empty)
-        # or it's simply a directory containing images we want to count.
-        
-        image_files = [f for f in files if f.lower().endswith(image_extensions)]
-        
-        if image_files:
-            # Use the directory name as the class name
-            folder_name = os.path.basename(root)
-            # Ensure unique names if the same name appears at different levels
-            # We will use the full path as the unique key, and the basename as the display name
-            unique_key = root 
-            
-            # Count only if it hasn't been counted as a parent of a deeper leaf node
-            if unique_key not in folder_counts:
-                folder_counts[unique_key] = len(image_files)
-                folder_paths[unique_key] = root
-                print(f"   - Class '{folder_name}' (Path: {root}): {len(image_files)} images")
+    # One walk (or one index read) for the whole tree; the full path is the
+    # unique key, and the basename is the display name
+    for root, image_files in find_class_folders(root_dir).items():
+        folder_counts[root] = len(image_files)
+        folder_paths[root] = root
+        print(f"   - Class '{os.path.basename(root)}' (Path: {root}): {len(image_files)} images")
 
     # Extract the counts and calculate the median
     counts_list = list(folder_counts.values())
@@ -79,10 +104,10 @@ def calculate_median_images_recursive(root_dir):
     
     return folder_counts, median_count, folder_paths
 
-def augment_image(img, augmentations):
+def augment_image(img, augmentations, rng=random):
     """Applies a random augmentation to a PIL Image."""
     # Pick a random augmentation from the available list
-    aug_func = random.choice(augmentations)
+    aug_func = rng.choice(augmentations)
     return aug_func(img)
 
 def augment_flip_h(img):
@@ -101,110 +126,373 @@ def augment_rotate_m90(img):
     """Rotate -90 degrees (270)."""
     return img.transpose(Image.ROTATE_270)
 
-def balance_dataset(folder_paths, output_dir, folder_counts, target_count):
+# List of available augmentation functions, by name so plans can be sent to workers
+AUGMENTATIONS = {
+    "flip_h": augment_flip_h,
+    "flip_v": augment_flip_v,
+    "rotate_90": augment_rotate_90,
+    "rotate_m90": augment_rotate_m90,
+}
+
+def link_or_copy(src, dst):
+    """
+    Puts `src` at `dst` without duplicating the data when the filesystem allows it.
+    Images inside a packed directory are written out ('extract').
+
+    Returns:
+        str: 'unchanged' (dst already is src), 'hardlink', 'reflink', 'copy' or 'extract'.
+    """
+    if packed_member(src) is not None:
+        tmp = dst + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(read_bytes(src))
+        os.replace(tmp, dst)
+        return "extract"
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return "unchanged"
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass  # other filesystem, or links not supported
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return "reflink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+def save_atomic(img, path):
+    """Writes a JPEG via a temp file, so a hardlinked original at `path` is replaced, never overwritten."""
+    tmp = path + ".tmp"
+    img.save(tmp, 'jpeg')
+    os.replace(tmp, path)
+
+def file_sha1(path):
+    """Content hash of one file (packed images: taken from the pack index)."""
+    member = packed_member(path)
+    if member is not None:
+        dataset, i = member
+        return dataset.sha1(i)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_sources(paths, previous, pool):
+    """
+    Content hashes for `paths`. Files whose size and mtime match the previous
+    manifest keep their recorded hash; the rest are hashed on the pool.
+
+    Returns:
+        dict: {path: {'size', 'mtime_ns', 'sha1'}}.
+    """
+    sources, to_hash = {}, []
+    for path in paths:
+        size, mtime_ns = source_stat(path)
+        old = previous.get(path)
+        if old and old["size"] == size and old["mtime_ns"] == mtime_ns:
+            sources[path] = old
+        else:
+            sources[path] = {"size": size, "mtime_ns": mtime_ns}
+            to_hash.append(path)
+    for path, sha1 in zip(to_hash, pool.map(file_sha1, to_hash, chunksize=32)):
+        sources[path]["sha1"] = sha1
+    return sources
+
+def load_manifest(output_dir):
+    """The manifest of the previous run in `output_dir` (empty if there is none)."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"sources": {}, "outputs": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def process_source(job):
+    """
+    Worker task for one source image: link the original if it is kept, then
+    decode it once and write every augmentation planned for it.
+
+    Args:
+        job (dict): {'src', 'link' (destination or None), 'augment' (list of (destination, op name))}.
+
+    Returns:
+        dict: {'written': [destinations], 'links': {method: count}, 'errors': [messages]}.
+    """
+    result = {"written": [], "links": {}, "errors": []}
+    src = job["src"]
+    if job["link"]:
+        try:
+            method = link_or_copy(src, job["link"])
+            result["links"][method] = result["links"].get(method, 0) + 1
+            result["written"].append(job["link"])
+        except OSError as e:
+            result["errors"].append(f"Error copying {os.path.basename(src)}: {e}")
+    if job["augment"]:
+        try:
+            # Open the image once for all its augmentations
+            with Image.open(open_source(src)) as im:
+                img = im.convert('RGB')
+        except Exception as e:
+            result["errors"].append(f"Error augmenting {os.path.basename(src)}: {e}")
+            return result
+        for dst, op in job["augment"]:
+            try:
+                save_atomic(AUGMENTATIONS[op](img), dst)
+                result["written"].append(dst)
+            except Exception as e:
+                result["errors"].append(f"Error augmenting {os.path.basename(src)} ({op}): {e}")
+    return result
+
+def class_images(original_folder_path):
+    """Images of one class folder (non-recursive in the leaf node), sorted."""
+    image_extensions = ('.jpg', '.jpeg', '.png') # Augmentation/copy works best with these
+    root = None if os.path.isdir(original_folder_path) else packed_root(original_folder_path)
+    if root is not None:
+        folder = os.path.relpath(original_folder_path, root).replace(os.sep, '/')
+        members = open_packed(root).member_paths().get(folder, [])
+        return sorted(path for path in members if path.lower().endswith(image_extensions))
+    return sorted(
+        os.path.join(original_folder_path, f)
+        for f in os.listdir(original_folder_path)
+        if os.path.isfile(os.path.join(original_folder_path, f)) and f.lower().endswith(image_extensions)
+    )
+
+def source_key(sha1, seed):
+    """Per-image random number fixed by (seed, content): the same image gets the same choices on every run."""
+    return int(hashlib.sha1(f"{seed}:{sha1}".encode()).hexdigest()[:16], 16)
+
+def plan_class(original_images_paths, new_folder_path, target_count, sources, seed):
+    """
+    Decides what one class contributes to the balanced set.
+
+    Choices depend on each image's content hash and the seed rather than on
+    its position in the folder, and outputs are named after the content hash,
+    so adding or removing a few images only changes the outputs tied to them.
+
+    Args:
+        original_images_paths (list): The class images in the source dataset.
+        new_folder_path (str): The class folder in the balanced dataset.
+        target_count (int): The target number of images per folder (median).
+        sources (dict): hash_sources() entries for the images.
+        seed (int): Seed for the keep / augment choices.
+
+    Returns:
+        tuple: (jobs, one per source image (see process_source), {destination: manifest entry}).
+    """
+    folder_name = os.path.basename(new_folder_path) # The class label
+
+    # Identical files would map to the same output; keep the first of each
+    unique = {}
+    for src in original_images_paths:
+        unique.setdefault(sources[src]["sha1"], src)
+    current_count = len(unique)
+    ranked = sorted(unique.items(), key=lambda item: (source_key(item[0], seed), item[0]))
+
+    jobs, outputs = {}, {}
+
+    def add(sha1, src, dst, op):
+        job = jobs.setdefault(src, {"src": src, "link": None, "augment": []})
+        if op == "original":
+            job["link"] = dst
+        else:
+            job["augment"].append((dst, op))
+        outputs[dst] = {"source": src, "sha1": sha1, "op": op, "seed": seed}
+
+    # --- Phase 1: Deletion (if current_count >= target_count) ---
+    # Keep the 'target_count' images that rank first for this seed
+    kept = ranked[:target_count]
+    for sha1, src in kept:
+        add(sha1, src, os.path.join(new_folder_path, f"{folder_name}_{sha1[:12]}{os.path.splitext(src)[1]}"), "original")
+    if current_count >= target_count:
+        print(f"   - {folder_name}: DELETION MODE, keeping {target_count} of {current_count} images.")
+        return list(jobs.values()), outputs
+
+    # --- Phase 2: Augmentation (if current_count < target_count) ---
+    # Spread the augmentations round-robin over the images in rank order; an
+    # image's k-th augmentation always uses the same op
+    images_needed = target_count - current_count
+    print(f"   - {folder_name}: AUGMENTATION MODE, {current_count} images + {images_needed} augmented.")
+    ops = sorted(AUGMENTATIONS)
+    for i in range(images_needed):
+        k, j = divmod(i, current_count)
+        sha1, src = ranked[j]
+        op = ops[(source_key(sha1, seed) + k) % len(ops)]
+        add(sha1, src, os.path.join(new_folder_path, f"{folder_name}_{sha1[:12]}_aug{k}_{op}.jpg"), op)
+    return list(jobs.values()), outputs
+
+def remove_stale_outputs(output_dir, planned, previous_outputs=()):
+    """
+    Deletes files in the output class folders that the current plan does not
+    produce, plus outputs of the last run in folders no longer planned (then
+    drops such folders if they end up empty).
+    """
+    removed = 0
+    for folder in {os.path.dirname(path) for path in planned}:
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            if path not in planned and os.path.isfile(path):
+                os.unlink(path)
+                removed += 1
+    for path in previous_outputs:
+        if path not in planned and os.path.isfile(path):
+            os.unlink(path)
+            removed += 1
+            if not os.listdir(os.path.dirname(path)):
+                os.rmdir(os.path.dirname(path))
+    if removed:
+        print(f"🧹 Removed {removed} stale files from {output_dir}")
+    return removed
+
+def pending_jobs(jobs, planned, previous_outputs):
+    """Drops outputs the previous run already produced from the same content with the same op and seed."""
+    pending, reused = [], 0
+    for job in jobs:
+        def stale(dst):
+            return previous_outputs.get(dst) != planned[dst] or not os.path.exists(dst)
+        link = job["link"] if job["link"] and stale(job["link"]) else None
+        augment = [(dst, op) for dst, op in job["augment"] if stale(dst)]
+        reused += bool(job["link"]) - bool(link) + len(job["augment"]) - len(augment)
+        if link or augment:
+            pending.append({"src": job["src"], "link": link, "augment": augment})
+    return pending, reused
+
+def balance_dataset(folder_paths, output_dir, folder_counts, target_count, workers=None, seed=0):
     """
     Balances the dataset to the target count (median) using augmentation/deletion.
     
     Args:
         folder_paths (dict): Dictionary of full paths for each class (key is the path).
         output_dir (str): Path to the new, balanced dataset directory.
-        folder_counts (dict): Dictionary of image counts per class path.
+        folder_counts (dict): Dictionary of image counts per class path (unused; classes are recounted).
         target_count (int): The target number of images per folder (median).
-    """
-    
-    # Ensure the output directory is clean
-    if os.path.exists(output_dir):
-        print(f"\n🧹 Cleaning up existing output directory: {output_dir}")
-        shutil.rmtree(output_dir)
-    os.makedirs(output_dir)
-    print(f"✅ Created new output directory: {output_dir}")
-    
-    # List of available augmentation functions
-    augmentations = [augment_flip_h, augment_flip_v, augment_rotate_90, augment_rotate_m90]
-    image_extensions = ('.jpg', '.jpeg', '.png') # Augmentation/copy works best with these
+        workers (int): Worker processes (default: one per CPU core).
+        seed (int): Seed for the keep / augment choices.
 
-    # Iterate through the unique keys which are the full paths of the class directories
-    for unique_key, original_folder_path in folder_paths.items():
-        current_count = folder_counts[unique_key]
-        folder_name = os.path.basename(original_folder_path) # The class label
-        
-        # Create a new, flat structure for the balanced data
-        new_folder_path = os.path.join(output_dir, folder_name)
-        os.makedirs(new_folder_path, exist_ok=True)
-        
-        print(f"\n⚙️ Processing Class '{folder_name}' (Current: {current_count}, Target: {target_count})")
-        
-        # Get a list of all images in the original folder (non-recursive in the leaf node)
-        original_images_paths = [
-            os.path.join(original_folder_path, f)
-            for f in os.listdir(original_folder_path) 
-            if os.path.isfile(os.path.join(original_folder_path, f)) and f.lower().endswith(image_extensions)
-        ]
-        
-        if not original_images_paths:
-            print(f"   - ⚠️ Skipping: No images found in {folder_name} at path {original_folder_path}.")
+    Returns:
+        dict: see balance_classes.
+    """
+    classes = {}
+    for unique_key, original_folder_path in sorted(folder_paths.items()):
+        images = class_images(original_folder_path)
+        if not images:
+            print(f"   - ⚠️ Skipping: No images found at path {original_folder_path}.")
             continue
+        classes[os.path.basename(original_folder_path)] = images
+    return balance_classes(classes, output_dir, target_count, workers, seed)
+
+def balance_classes(classes, output_dir, target_count, workers=None, seed=0):
+    """
+    Balances {class name: image paths} to the target count; each class becomes
+    one flat folder in `output_dir`.
+
+    The output directory keeps a manifest (source path, content hash, op and
+    seed of every output); a rerun only writes what changed since.
+
+    Returns:
+        dict: {'files', 'reused', 'seconds', 'links', 'errors'} totals for the run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    previous = load_manifest(output_dir)
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Hash new / changed sources, then plan every class (cheap)
+        sources = hash_sources([src for paths in classes.values() for src in paths], previous["sources"], pool)
+        print(f"\n⚙️ Planning {len(classes)} classes (target {target_count} each, seed {seed})")
+        jobs, planned = [], {}
+        for name, images in sorted(classes.items()):
+            # Create a new, flat structure for the balanced data
+            new_folder_path = os.path.join(output_dir, name)
+            os.makedirs(new_folder_path, exist_ok=True)
+            class_jobs, class_outputs = plan_class(images, new_folder_path, target_count, sources, seed)
+            jobs.extend(class_jobs)
+            planned.update(class_outputs)
+        remove_stale_outputs(output_dir, planned, previous["outputs"])
+        jobs, reused = pending_jobs(jobs, planned, previous["outputs"])
 
-        # --- Phase 1: Copying and Deletion (if current_count >= target_count) ---
-        if current_count >= target_count:
-            # Randomly select 'target_count' image paths to keep and copy
-            images_to_keep_paths = random.sample(original_images_paths, target_count)
-            
-            for i, src in enumerate(images_to_keep_paths):
-                # Use os.path.basename to get just the filename
-                original_filename = os.path.basename(src) 
-                # Create a new, consistent filename
-                dst_filename = f"{folder_name}_{i:04d}{os.path.splitext(original_filename)[1]}"
-                dst = os.path.join(new_folder_path, dst_filename)
-                shutil.copy2(src, dst)
-            
-            print(f"   - DELETION MODE: Copied {target_count} images to balance the count.")
-            
-        # --- Phase 2: Copying and Augmentation (if current_count < target_count) ---
-        else: # current_count < target_count
-            
-            # 1. Copy all original images first
-            for i, src in enumerate(original_images_paths):
-                original_filename = os.path.basename(src)
-                dst_filename = f"{folder_name}_{i:04d}{os.path.splitext(original_filename)[1]}"
-                dst = os.path.join(new_folder_path, dst_filename)
-                shutil.copy2(src, dst)
-
-            images_copied = current_count
-            images_needed = target_count - current_count
-            
-            print(f"   - AUGMENTATION MODE: Need {images_needed} more images.")
-
-            # 2. Augment images until the target count is reached
-            for i in range(images_needed):
-                # Choose a random image path to augment
-                src_path = random.choice(original_images_paths)
-                
-                try:
-                    # Open the image from the source path
-                    img = Image.open(src_path).convert('RGB')
-                    augmented_img = augment_image(img, augmentations)
-                    
-                    # New filename format: [Folder]_[Index]_[Aug]_[Extension]
-                    new_filename = f"{folder_name}_{images_copied + i:04d}_aug{i:02d}.jpg"
-                    new_path = os.path.join(new_folder_path, new_filename)
-                    augmented_img.save(new_path, 'jpeg')
-                    
-                except Exception as e:
-                    print(f"   - Error augmenting {os.path.basename(src_path)}: {e}")
-                    continue
-
-            print(f"   - Added {images_needed} augmented images.")
-            
-    print("\n\n🎉 Dataset Balancing Complete! New dataset is in the folder: " + OUTPUT_DIR)
+        total_files = sum(bool(job["link"]) + len(job["augment"]) for job in jobs)
+        totals = {"files": 0, "reused": reused, "links": {}, "errors": []}
+        print(f"♻️ Reusing {reused} of {len(planned)} outputs from the last run")
+        print(f"🚀 Writing {total_files} files from {len(jobs)} sources with {workers} worker(s)")
+        written = set()
+        write_start = last_report = time.perf_counter()
+        futures = [pool.submit(process_source, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            written.update(result["written"])
+            totals["files"] += len(result["written"])
+            for method, count in result["links"].items():
+                totals["links"][method] = totals["links"].get(method, 0) + count
+            for message in result["errors"]:
+                print(f"   - {message}")
+            totals["errors"].extend(result["errors"])
+
+            now = time.perf_counter()
+            if now - last_report >= 2.0 or done == len(futures):
+                last_report = now
+                elapsed = now - write_start
+                print(f"   [{done * 100 // max(1, len(futures)):3d}%] {totals['files']}/{total_files} files, "
+                      f"{totals['files'] / elapsed if elapsed else 0.0:.1f} files/s")
+
+    # Outputs that failed stay out of the manifest, so the next run retries them
+    pending = {dst for job in jobs for dst in ([job["link"]] if job["link"] else []) + [d for d, _ in job["augment"]]}
+    save_manifest(output_dir, {
+        "seed": seed,
+        "target_count": target_count,
+        "sources": sources,
+        "outputs": {dst: entry for dst, entry in planned.items() if dst not in pending or dst in written},
+    })
+
+    totals["seconds"] = time.perf_counter() - start
+    links = ", ".join(f"{count} {method}" for method, count in sorted(totals["links"].items())) or "none"
+    print(f"\n🎉 Dataset Balancing Complete! {totals['files']} files written, {reused} reused, in "
+          f"{totals['seconds']:.1f}s ({totals['files'] / max(totals['seconds'], 1e-9):.1f} files/s; "
+          f"originals: {links}; {len(totals['errors'])} errors). New dataset is in the folder: {output_dir}")
+    return totals
 
 
 # --- Main Execution Block ---
+def main():
+    parser = argparse.ArgumentParser(description="Balance class folders to the median size")
+    parser.add_argument("--root", default=ROOT_DIR, help="directory containing the class subfolders")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="where the balanced dataset is written")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes (0 = one per CPU core)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the keep / augment choices")
+    parser.add_argument("--class-map", default=CLASS_MAP, help="JSON {folder: class} mapping ('' = folder names)")
+    parser.add_argument("--threshold", type=int, default=DUPLICATE_THRESHOLD,
+                        help="near-duplicate pHash/dHash distance (of 64 bits)")
+    parser.add_argument("--no-dedup", action="store_true", help="keep near-duplicate images")
+    args = parser.parse_args()
+
+    # 1. Merge class folders and drop near-duplicates (see dataset_index.py);
+    #    the index in the output folder doubles as the hash cache
+    os.makedirs(args.output, exist_ok=True)
+    index_path = os.path.join(args.output, INDEX_NAME)
+    index = build_index(args.root, load_class_map(args.class_map), args.threshold, args.workers,
+                        cache=load_index(index_path), dedup=not args.no_dedup)
+    save_index(index_path, index)
+    if not index["classes"]:
+        print("❌ No subfolders with images found. Exiting.")
+        return
+
+    # 2. Balance the dataset to the median class size
+    median = int(np.median([len(images) for images in index["classes"].values()]))
+    print(f"\n📊 Calculated Median Image Count: {median}")
+    balance_classes(index["classes"], args.output, median, workers=args.workers, seed=args.seed)
+
+
 if __name__ == '__main__':
-    # 1. Calculate the median using the recursive function
-    counts, median, paths = calculate_median_images_recursive(ROOT_DIR)
-    
-    if median > 0:
-        # 2. Balance the dataset
-        # Pass the map of class paths
-        balance_dataset(paths, OUTPUT_DIR, counts, median)
\ No newline at end of file
+    main()
@@ -0,0 +1,291 @@
+"""
+Indexes the leaf-image corpora before balancing.
+
+- Class folders are mapped to unified class names with a JSON mapping file
+  (class_map.json), so e.g. CornDataset_1/Blight and
+  CornDataset_2/Corn___Northern_Leaf_Blight become one class.
+- Every image gets a 64-bit pHash and dHash, computed on a process pool and
+  cached by (size, mtime) between runs. The root may be a packed directory
+  (packed_dataset.py); its images are then hashed in shard order.
+- Near-duplicates (pHash and dHash both within the threshold) are found with
+  a multi-index hash table and grouped; each group keeps one image. Groups whose images
+  carry different labels are conflicts and are dropped entirely.
+
+    python data_preprocessing/dataset_index.py --root data_preprocessing/data --report dedup_report.json
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from packed_dataset import is_packed, open_packed, open_source, source_stat
+
+# --- Configuration ---
+ROOT_DIR = 'data_preprocessing/data'
+CLASS_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class_map.json')
+# Max Hamming distance (of 64 bits) for two images to count as near-duplicates
+DUPLICATE_THRESHOLD = int(os.environ.get("DEDUP_THRESHOLD", "6"))
+# ---------------------
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+PHASH_SIZE = 32  # pHash: DCT of a 32x32 grayscale image, low 8x8 frequencies
+
+
+def find_class_folders(root_dir, image_extensions=IMAGE_EXTENSIONS):
+    """
+    Finds every folder under `root_dir` that directly contains images. A
+    packed directory (packed_dataset.py) is read from its index instead.
+
+    Returns:
+        dict: {folder path: sorted list of image paths}.
+    """
+    if is_packed(root_dir):
+        return {os.path.join(root_dir, name): paths for name, paths in open_packed(root_dir).member_paths().items()}
+    folders = {}
+    for root, _, files in os.walk(root_dir):
+        images = sorted(os.path.join(root, f) for f in files if f.lower().endswith(image_extensions))
+        if images:
+            folders[root] = images
+    return dict(sorted(folders.items()))
+
+
+def load_class_map(path):
+    """The class mapping file: {folder name or path relative to the root: unified class}. Missing file = {}."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def class_name(folder, root_dir, class_map):
+    """Unified class of a folder: its relative path or basename looked up in `class_map`, else the basename."""
+    relative = os.path.relpath(folder, root_dir).replace(os.sep, '/')
+    name = os.path.basename(folder)
+    return class_map.get(relative, class_map.get(name, name))
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _bits_to_int(bits):
+    return int(np.packbits(bits.astype(np.uint8).ravel()).view('>u8')[0])
+
+
+def image_hashes(path):
+    """
+    (pHash, dHash) of one image as 64-bit ints; the image is decoded once.
+    Worker task: returns (path, phash, dhash, error).
+    """
+    try:
+        with Image.open(open_source(path)) as im:
+            im.draft('L', (PHASH_SIZE * 4, PHASH_SIZE * 4))  # JPEG: decode at reduced scale
+            gray = im.convert('L')
+            small = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+            diff = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    except Exception as e:
+        return path, None, None, str(e)
+    low = (DCT @ small @ DCT.T)[:8, :8]
+    phash = _bits_to_int(low > np.median(low.ravel()[1:]))  # median without the DC term
+    dhash = _bits_to_int(diff[:, 1:] > diff[:, :-1])
+    return path, phash, dhash, None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class HashIndex:
+    """
+    Multi-index hashing for radius queries over 64-bit hashes. The bits are
+    split into radius + 1 chunks; two hashes within `radius` bits of each
+    other agree exactly on at least one chunk, so a query is only compared
+    with the hashes sharing a chunk value with it.
+    """
+
+    def __init__(self, radius, bits=64):
+        self.radius = radius
+        parts = radius + 1
+        bounds = [i * bits // parts for i in range(parts + 1)]
+        self.chunks = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self.tables = [{} for _ in self.chunks]
+        self.items = {}  # hash: [items]
+
+    def add(self, value, item):
+        if value not in self.items:
+            self.items[value] = []
+            for (shift, mask), table in zip(self.chunks, self.tables):
+                table.setdefault((value >> shift) & mask, []).append(value)
+        self.items[value].append(item)
+
+    def search(self, value):
+        """Items whose hash is within the radius of `value`: [(distance, item)]."""
+        candidates = set()
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            candidates.update(table.get((value >> shift) & mask, ()))
+        found = []
+        for other in candidates:
+            d = hamming(value, other)
+            if d <= self.radius:
+                found.extend((d, item) for item in self.items[other])
+        return found
+
+
+def hash_images(paths, cache, workers):
+    """
+    pHash / dHash for `paths`, reusing `cache` entries whose size and mtime match.
+
+    Returns:
+        tuple: ({path: {'size', 'mtime_ns', 'phash', 'dhash'}}, [error messages]).
+    """
+    hashes, todo, errors = {}, [], []
+    for path in paths:
+        size, mtime_ns = source_stat(path)
+        old = cache.get(path)
+        if old and old["size"] == size and old["mtime_ns"] == mtime_ns:
+            hashes[path] = old
+        else:
+            hashes[path] = {"size": size, "mtime_ns": mtime_ns}
+            todo.append(path)
+    if todo:
+        print(f"🔑 Hashing {len(todo)} images ({len(paths) - len(todo)} cached) with {workers} worker(s)")
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, phash, dhash, error in pool.map(image_hashes, todo, chunksize=32):
+                if error:
+                    errors.append(f"Error hashing {path}: {error}")
+                    del hashes[path]
+                else:
+                    hashes[path].update(phash=phash, dhash=dhash)
+        seconds = time.perf_counter() - start
+        print(f"   - {len(todo)} images in {seconds:.1f}s ({len(todo) / max(seconds, 1e-9):.1f} img/s)")
+    return hashes, errors
+
+
+def group_duplicates(paths, hashes, threshold):
+    """
+    Groups near-duplicates: images whose pHash and dHash both differ by at
+    most `threshold` bits, joined transitively.
+
+    Returns:
+        list: groups (lists of paths, in `paths` order) with more than one image.
+    """
+    parent = {path: path for path in paths}
+
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    index = HashIndex(threshold)
+    for path in paths:
+        entry = hashes[path]
+        for _, other in index.search(entry["phash"]):
+            if hamming(entry["dhash"], hashes[other]["dhash"]) <= threshold:
+                parent[find(path)] = find(other)
+        index.add(entry["phash"], path)
+
+    groups = {}
+    for path in paths:
+        groups.setdefault(find(path), []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def build_index(root_dir, class_map=None, threshold=DUPLICATE_THRESHOLD, workers=None, cache=None, dedup=True):
+    """
+    Unified classes of `root_dir` with near-duplicates removed.
+
+    Args:
+        root_dir (str): Directory containing the class folders (any depth).
+        class_map (dict): {folder name or relative path: unified class}.
+        threshold (int): Max pHash / dHash Hamming distance of near-duplicates.
+        workers (int): Hashing processes (default: one per CPU core).
+        cache (dict): 'hashes' of a previous index, reused for unchanged files.
+        dedup (bool): False only merges classes.
+
+    Returns:
+        dict: {'classes': {class: [kept paths]}, 'hashes', 'duplicates': [{'class', 'keep', 'drop'}],
+               'conflicts': [{'classes', 'images'}], 'errors'}.
+    """
+    class_map = class_map or {}
+    folders = find_class_folders(root_dir)
+    label = {}
+    for folder, images in folders.items():
+        name = class_name(folder, root_dir, class_map)
+        for path in images:
+            label[path] = name
+    paths = list(label)
+    print(f"🗂️ {len(paths)} images in {len(folders)} folders -> {len(set(label.values()))} classes")
+
+    index = {"hashes": {}, "duplicates": [], "conflicts": [], "errors": []}
+    keep = set(paths)
+    if dedup:
+        index["hashes"], index["errors"] = hash_images(paths, (cache or {}).get("hashes", {}), workers or os.cpu_count() or 1)
+        hashed = [path for path in paths if path in index["hashes"]]
+        keep = set(hashed)
+        for group in group_duplicates(hashed, index["hashes"], threshold):
+            classes = sorted({label[path] for path in group})
+            if len(classes) > 1:
+                # the same picture under different labels: trust none of them
+                keep.difference_update(group)
+                index["conflicts"].append({"classes": classes, "images": group})
+                continue
+            # keep the first image (folder order); the rest are duplicates of it
+            keep.difference_update(group[1:])
+            index["duplicates"].append({"class": label[group[0]], "keep": group[0], "drop": group[1:]})
+        dropped = len(hashed) - len(keep)
+        print(f"🔍 {len(index['duplicates'])} near-duplicate groups (threshold {threshold}), "
+              f"{len(index['conflicts'])} spanning several classes: {dropped} images dropped")
+
+    index["classes"] = {}
+    for path in paths:
+        if path in keep:
+            index["classes"].setdefault(label[path], []).append(path)
+    for name, images in sorted(index["classes"].items()):
+        print(f"   - Class '{name}': {len(images)} images")
+    return index
+
+
+def load_index(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_index(path, index):
+    with open(path + ".tmp", 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge class folders and find near-duplicate images")
+    parser.add_argument("--root", default=ROOT_DIR, help="directory containing the class subfolders")
+    parser.add_argument("--class-map", default=CLASS_MAP, help="JSON {folder: class} mapping ('' = folder names)")
+    parser.add_argument("--threshold", type=int, default=DUPLICATE_THRESHOLD, help="max Hamming distance (of 64)")
+    parser.add_argument("--workers", type=int, default=0, help="hashing processes (0 = one per CPU core)")
+    parser.add_argument("--report", default="dataset_index.json", help="where to write the index (also the hash cache)")
+    args = parser.parse_args()
+
+    index = build_index(args.root, load_class_map(args.class_map), args.threshold, args.workers,
+                        cache=load_index(args.report))
+    for conflict in index["conflicts"][:10]:
+        print(f"   - ⚠️ {conflict['classes']}: {', '.join(conflict['images'])}")
+    save_index(args.report, index)
+    print(f"✅ Index written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
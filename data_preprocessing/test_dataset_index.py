@@ -0,0 +1,115 @@
+"""
+Near-duplicate search checks on synthetic 64-bit hashes: the multi-index
+radius search, transitive grouping, and cross-label conflicts.
+
+    python -m pytest data_preprocessing/test_dataset_index.py
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dataset_index import HashIndex, build_index, group_duplicates, hamming  # noqa: E402
+
+THRESHOLD = 6
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def chunk_edge_flips(index, distance):
+    """
+    Bit sets of size `distance` that touch as many chunks as possible, on the
+    first and last bit of each chunk (where an off-by-one in the bounds shows).
+    """
+    edges = [bit for lo, mask in index.chunks for bit in (lo, lo + mask.bit_length() - 1)]
+    lows = [lo for lo, _ in index.chunks]
+    highs = [lo + mask.bit_length() - 1 for lo, mask in index.chunks]
+    yield lows[:distance]
+    yield highs[-distance:]
+    yield sorted(set(edges))[:distance]
+    yield sorted(set(edges))[-distance:]
+
+
+def test_chunks_cover_every_bit_once():
+    index = HashIndex(THRESHOLD)
+    covered = [bit for lo, mask in index.chunks for bit in range(lo, lo + mask.bit_length())]
+    assert sorted(covered) == list(range(64))
+    assert len(index.chunks) == THRESHOLD + 1
+
+
+@pytest.mark.parametrize("distance", [THRESHOLD - 1, THRESHOLD, THRESHOLD + 1])
+def test_search_radius(distance):
+    rng = random.Random(distance)
+    index = HashIndex(THRESHOLD)
+    base = rng.getrandbits(64)
+    index.add(base, "base")
+    patterns = list(chunk_edge_flips(index, distance)) + [rng.sample(range(64), distance) for _ in range(500)]
+    for bits in patterns:
+        query = flip(base, bits)
+        assert hamming(base, query) == distance
+        found = index.search(query)
+        if distance <= THRESHOLD:
+            assert found == [(distance, "base")], bits
+        else:
+            assert found == [], bits
+
+
+def hashes_for(values):
+    return {path: {"phash": phash, "dhash": dhash} for path, (phash, dhash) in values.items()}
+
+
+def test_group_duplicates_needs_both_hashes_and_joins_transitively():
+    base = 0x0123456789ABCDEF
+    hashes = hashes_for({
+        "a": (base, base),
+        "b": (flip(base, range(THRESHOLD)), base),                    # pHash at the threshold from a
+        "c": (flip(base, range(20, 21 + THRESHOLD)), base),           # pHash one bit beyond it
+        "d": (flip(base, range(THRESHOLD + 1)), flip(base, [63])),    # beyond it from a, 1 bit from b
+        "e": (base, flip(base, range(40, 41 + THRESHOLD))),           # dHash one bit beyond it
+    })
+    groups = group_duplicates(list(hashes), hashes, THRESHOLD)
+    assert groups == [["a", "b", "d"]]
+
+
+def test_group_duplicates_chain():
+    # each link is at the threshold; the ends are far apart but end up in one group
+    values, value = {}, 0
+    for i in range(4):
+        values[f"img{i}"] = (value, value)
+        value = flip(value, range(i * THRESHOLD, (i + 1) * THRESHOLD))
+    hashes = hashes_for(values)
+    assert hamming(hashes["img0"]["phash"], hashes["img3"]["phash"]) > THRESHOLD
+    assert group_duplicates(list(hashes), hashes, THRESHOLD) == [list(hashes)]
+
+
+def test_group_spanning_two_labels_is_a_conflict(tmp_path):
+    base = 0x0F0F0F0F0F0F0F0F
+    files = {
+        "CornDataset_1/Blight/x.jpg": (base, base),
+        "CornDataset_1/Blight/y.jpg": (flip(base, [0, 1]), base),
+        "CornDataset_2/Healthy/x.jpg": (flip(base, [2]), flip(base, [5])),  # same picture, other label
+        "CornDataset_2/Healthy/z.jpg": (~base & (2 ** 64 - 1), ~base & (2 ** 64 - 1)),
+        "CornDataset_2/Healthy/w.jpg": (~base & (2 ** 64 - 1), flip(~base & (2 ** 64 - 1), [7])),
+    }
+    cache = {}
+    for name, (phash, dhash) in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())  # never decoded: the cached hashes below match size and mtime
+        st = os.stat(path)
+        cache[str(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "phash": phash, "dhash": dhash}
+
+    index = build_index(str(tmp_path), threshold=THRESHOLD, workers=1, cache={"hashes": cache})
+    conflict = [str(tmp_path / name) for name in list(files)[:3]]
+    assert index["conflicts"] == [{"classes": ["Blight", "Healthy"], "images": conflict}]
+    assert index["duplicates"] == [{"class": "Healthy", "keep": str(tmp_path / "CornDataset_2/Healthy/w.jpg"),
+                                    "drop": [str(tmp_path / "CornDataset_2/Healthy/z.jpg")]}]
+    assert index["classes"] == {"Healthy": [str(tmp_path / "CornDataset_2/Healthy/w.jpg")]}
+    assert index["errors"] == []
@@ -0,0 +1,80 @@
+"""
+Packed dataset checks: member naming, path resolution, and that the copy in
+backend/model/cropDisease/ (kept for its Docker build context) matches this one.
+
+    python -m pytest data_preprocessing/test_packed_dataset.py
+"""
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import packed_dataset  # noqa: E402
+from packed_dataset import open_packed, open_source, pack_classes, packed_member, read_bytes, scan_classes  # noqa: E402
+
+BACKEND_COPY = os.path.join(HERE, "..", "backend", "model", "cropDisease", "packed_dataset.py")
+
+
+def test_backend_copy_is_identical():
+    if not os.path.exists(BACKEND_COPY):
+        pytest.skip("backend copy not in this checkout")
+    with open(os.path.join(HERE, "packed_dataset.py"), "rb") as a, open(BACKEND_COPY, "rb") as b:
+        assert a.read() == b.read(), "edit data_preprocessing/packed_dataset.py and copy it to backend/model/cropDisease/"
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry(monkeypatch):
+    monkeypatch.setattr(packed_dataset, "_OPENED", {})
+
+
+@pytest.fixture
+def corpora(tmp_path):
+    """Two corpora with the same class folder and file names, but different bytes."""
+    root = tmp_path / "data"
+    for corpus in ("CornDataset_1", "CornDataset_2"):
+        for name in ("a.jpg", "b.jpg"):
+            path = root / corpus / "Healthy" / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(f"{corpus}/{name}".encode() * 100)
+    return root
+
+
+def test_same_names_in_two_corpora_stay_apart(corpora, tmp_path):
+    out = str(tmp_path / "packed")
+    index = pack_classes(scan_classes(str(corpora)), out, str(corpora))
+    assert index["classes"] == ["Healthy"]
+    assert sorted(row[5] for row in index["samples"]) == [
+        "CornDataset_1/Healthy/a.jpg", "CornDataset_1/Healthy/b.jpg",
+        "CornDataset_2/Healthy/a.jpg", "CornDataset_2/Healthy/b.jpg"]
+    for corpus in ("CornDataset_1", "CornDataset_2"):
+        path = os.path.join(out, corpus, "Healthy", "a.jpg")
+        assert read_bytes(path) == (corpora / corpus / "Healthy" / "a.jpg").read_bytes()
+    assert sorted(open_packed(out).member_paths()) == ["CornDataset_1/Healthy", "CornDataset_2/Healthy"]
+
+
+def test_duplicate_member_names_are_refused(corpora, tmp_path):
+    path = str(corpora / "CornDataset_1" / "Healthy" / "a.jpg")
+    twice = os.path.join(str(corpora), "CornDataset_1", "..", "CornDataset_1", "Healthy", "a.jpg")
+    with pytest.raises(ValueError, match="would both be packed"):
+        pack_classes({"Healthy": [path, twice]}, str(tmp_path / "packed"), str(corpora))
+
+
+def test_open_source_resolves_without_filesystem_calls(corpora, tmp_path, monkeypatch):
+    out = str(tmp_path / "packed")
+    pack_classes(scan_classes(str(corpora)), out, str(corpora))
+    path = os.path.join(out, "CornDataset_2", "Healthy", "b.jpg")
+    assert packed_member(path) is not None  # opens the directory once
+
+    calls = []
+    for name in ("stat", "lstat"):
+        real = getattr(os, name)
+        monkeypatch.setattr(os, name, lambda *a, _real=real, **k: calls.append(a[0]) or _real(*a, **k))
+    assert open_source(path).read() == (corpora / "CornDataset_2" / "Healthy" / "b.jpg").read_bytes()
+    assert calls == []
+
+    dataset = open_packed(out)
+    dataset.close()
+    assert dataset._fds == {}